@@ -19,13 +19,267 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import StaleElementReferenceException
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 import time # time.sleep() will be useful when waiting for a page to load
-import pickle
 import io
+import json
+import http.client
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from driver_pool import new_driver, set_default_profile, PROFILES
+from fetch_backend import HttpBackend
+from crawl_engine import CrawlEngine
+from response_cache import ResponseCache, CachedBackend
+from metrics_store import MetricsStore
+from profile_table import ProfileTable
+from journal import Journal
+import tracing
+from element_lookup import is_present, find_all_now
+from rate_limiter import RateLimiter, ThrottledBackend, BlockedError, raise_if_blocked, BLOCKED_RETRIES
+from result_stream import ResultSink, school_totals
 
 
-def get_docs_profiles_pages (school):
+
+def report_failure (url, error, action="scrape"):
+	'''
+	Report a page that couldn't be scraped (or a way of scraping it that
+	couldn't be used), so that failures never go unnoticed.
+
+	Parameters
+	----------
+	url : str
+		The URL of the page.
+	error : Exception or str
+		What went wrong.
+	action : str
+		What couldn't be done with the page, like "scrape".
+	'''
+
+	print(f"Couldn't {action} {url} - {error}")
+
+
+
+def parse_docs_profiles_pages (root):
+	'''
+	Extract the (first) pages of documents and of members' profiles from a
+	parsed page of a school.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of the school.
+
+	Returns
+	-------
+	(docs_pages, profiles_pages) : tuple
+		Tuple of lists: one for the pages of documents and another for the
+		members of the departments.
+	'''
+
+	# List to hold the scraped URLs for the documents and profiles
+	docs_pages = []
+	profiles_pages = []
+
+	# Loop through the <span>s with information (except the last one) to\
+	# extract the desired URLs
+	for elem in root.find_all(class_name="u-fs12")[:-1]:
+		# We want information from inner <a>nchors
+		inner_anchors = elem.find_all("a")
+		# If the department has a has link to members and documents
+		if len(inner_anchors) == 2:
+			profiles_pages.append(inner_anchors[0].get_attribute("href"))
+			docs_pages.append(inner_anchors[1].get_attribute("href"))
+		# If the department has only a link to its members
+		elif len(inner_anchors) == 1:
+			profiles_pages.append(inner_anchors[0].get_attribute("href"))
+
+	return (docs_pages, profiles_pages)
+
+
+
+def parse_member_views (root):
+	'''
+	Extract the total profile views of the members listed in a parsed page
+	of members.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of members.
+
+	Returns
+	-------
+	total_views : int
+		The sum of the profile views of the members in the page.
+	'''
+
+	total_views = 0
+	for container in root.find_all(class_name="container-fluid"):
+		# Target element
+		total_views += int(container.find_all(class_name="u-ml0x")[1].\
+			text.split()[3].strip().replace(",", ""))
+
+	return total_views
+
+
+
+def has_next_page (root):
+	'''
+	Check if a parsed page of results has a link to a next page.
+	'''
+
+	return root.find(class_name="next_page") is not None
+
+
+# Templates of the URLs of the background (XHR) requests that return the\
+# documents and the members of a department in batches of JSON, which is\
+# what the infinite scroll and the pages of members are built from. `{url}`\
+# is the page's URL (without query) and `{page}` the 1-based batch number
+DOCUMENTS_BATCH_URL = "{url}?page={page}&format=json"
+MEMBERS_BATCH_URL = "{url}?page={page}&format=json"
+# Headers that make the site answer with JSON instead of a full page
+BATCH_HEADERS = {
+	"Accept": "application/json",
+	"X-Requested-With": "XMLHttpRequest"
+}
+# Keys of a batch under which its items may be listed, and keys of an item\
+# with its number of views (the first one found is used)
+BATCH_ITEMS_KEYS = ("works", "documents", "users", "members", "items")
+BATCH_VIEWS_KEYS = ("view_count", "views_count", "views")
+# Maximum number of batches fetched per page (a safety net in case the\
+# endpoint never reports the end)
+MAX_BATCHES = 1000
+
+
+
+def parse_batch (data):
+	'''
+	Extract the views of the items in a batch returned by one of the JSON
+	endpoints.
+
+	Parameters
+	----------
+	data : dict or list
+		The decoded JSON of the batch: either a list of items, or an object
+		with the list under one of `BATCH_ITEMS_KEYS`.
+
+	Returns
+	-------
+	(views, items, more) : tuple
+		The sum of the views of the items, the number of items, and whether
+		there are more batches (`None` if the batch doesn't say).
+	'''
+
+	more = None
+	if isinstance(data, dict):
+		# Flags that some endpoints use to tell if there are more batches
+		for key in ("more", "has_more", "next_page"):
+			if key in data:
+				more = bool(data[key])
+				break
+		items = next((data[key] for key in BATCH_ITEMS_KEYS if key in data), None)
+		if items is None:
+			raise ValueError("No list of items in the batch")
+	else:
+		items = data
+
+	views = 0
+	for item in items:
+		value = next((item[key] for key in BATCH_VIEWS_KEYS if key in item), 0)
+		# Counts may come formatted, like "1,234"
+		views += int(str(value or 0).replace(",", ""))
+
+	return (views, len(items), more)
+
+
+
+def iter_batches (page_url, url_template, backend, max_batches=MAX_BATCHES):
+	'''
+	Fetch the JSON batches behind a page of documents or members, one after
+	the other, until there are no more.
+
+	Parameters
+	----------
+	page_url : str
+		The URL of the page (of documents or members) of the department.
+	url_template : str
+		Template of the URLs of the batches (like `DOCUMENTS_BATCH_URL`).
+	backend : object
+		A backend from `fetch_backend`.
+	max_batches : int
+		Maximum number of batches to fetch.
+
+	Yields
+	------
+	(views, items) : tuple
+		The sum of the views of the items in each batch and their number.
+
+	Raises
+	------
+	ValueError
+		If a batch can't be fetched or isn't JSON with the expected
+		structure (so the caller can fall back to the browser).
+	'''
+
+	base_url = page_url.split("?")[0].rstrip("/")
+	for page in range(1, max_batches + 1):
+		response = backend.fetch(url_template.format(url=base_url, page=page), BATCH_HEADERS)
+		if response.status != 200:
+			raise ValueError(f"Batch {page} of {page_url} returned status {response.status}")
+		views, items, more = parse_batch(json.loads(response.html))
+		# An empty batch means we are past the last one
+		if items == 0:
+			break
+		yield (views, items)
+		if more is False:
+			break
+
+
+
+def count_batched (page_url, url_template, backend):
+	'''
+	Sum the views (of documents or of members' profiles) of a department
+	straight from its JSON batches, with no rendering or scrolling.
+
+	Parameters
+	----------
+	page_url : str
+		The URL of the page of documents or members of the department.
+	url_template : str
+		`DOCUMENTS_BATCH_URL` or `MEMBERS_BATCH_URL` (or a custom one).
+	backend : object
+		A backend from `fetch_backend`.
+
+	Returns
+	-------
+	total_views : int
+		The total views of the department's documents or members.
+	'''
+
+	return sum(views for views, _ in iter_batches(page_url, url_template, backend))
+
+
+
+def try_batched (page_url, url_template, backend):
+	'''
+	Like `count_batched`, but return `None` (instead of raising) if the
+	batches can't be used, so that the page can be rendered instead: the
+	endpoint isn't there or answers with something else than the expected
+	JSON, or the connection fails (a reset, a timeout, too many
+	redirects...). Blocks are still raised (`rate_limiter.BlockedError`),
+	since the browser would be blocked too.
+	'''
+
+	try:
+		with tracing.phase("batches", url=page_url):
+			return count_batched(page_url, url_template, backend)
+	except (ValueError, KeyError, TypeError, AttributeError, OSError, http.client.HTTPException) as error:
+		report_failure(page_url, error, "use the batches of")
+		return None
+
+
+
+def get_docs_profiles_pages (school, backend=None):
 	'''
 	Get all the (first) pages of documents and of members' profiles for
 	a single school (that has its own institutional page).
@@ -34,6 +288,9 @@ def get_docs_profiles_pages (school):
 	----------
 	school : str
 		The URL for the page of the school.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the page is fetched and
+		parsed with it instead of being rendered by the driver.
 
 	Returns
 	-------
@@ -42,8 +299,14 @@ def get_docs_profiles_pages (school):
 		members of the departments.
 	'''
 	
+	# The links are in the page's HTML, so there's no need for a browser if\
+	# we have a backend
+	if backend is not None:
+		return parse_docs_profiles_pages(backend.fetch(school).root)
+
 	# Go to the page of the school
-	driver.get(school)
+	with tracing.phase("driver_get", url=school):
+		driver.get(school)
 
 	# List to hold the scraped URLs for the documents and profiles
 	docs_pages = []
@@ -69,76 +332,244 @@ def get_docs_profiles_pages (school):
 
 
 
-def count_views (dept_page):
+def members_page_url (dept_page, page_number):
 	'''
-	Scrape the views from the list of members of a single department.
+	The URL of a given page of members of a department.
+	'''
+
+	return dept_page.split("?")[0]+"?page="+str(page_number)
+
+
+
+def iter_member_views (dept_page, backend=None):
+	'''
+	Walk the pages of members of a single department, following the
+	"next page" links, and yield the profile views of each page as soon as
+	it's scraped.
 	In cases where a school's page is actually a department, this function
 	is used as well.
 
+	With a backend, the next page is fetched in the background while the
+	current one is being parsed.
+
 	Parameters
 	----------
 	dept_page : str
 		The URL for the first page of members of the target department.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the pages are fetched and
+		parsed with it instead of being rendered by the driver.
 
-	Returns
-	-------
-	tuple
-		`(total_views, next_link)` if the last page of results was scraped,
-		otherwise, return a tuple with only the total profile views for the
-		members of the target department.
+	Yields
+	------
+	(page_url, views) : tuple
+		The URL of a page of members and the sum of the profile views of
+		the members listed in it.
 	'''
 
-	driver.get(dept_page)
-
-	# Running sum of the profile views scraped
-	total_views = 0
 	# Number of the current page of results
 	if "?page=" not in dept_page:
 		page_number = 1
 	else:
-		page_number = int(dept_page.split("=")[1]) + 1
+		page_number = int(dept_page.split("=")[1])
+	page_url = dept_page
+
+	# The list of members is in the page's HTML, so there's no need for a\
+	# browser if we have a backend
+	if backend is not None:
+		with ThreadPoolExecutor(max_workers=1) as prefetcher:
+			pending = prefetcher.submit(backend.fetch, page_url)
+			while pending is not None:
+				root = pending.result().root
+				# Start fetching the next page (if there's one) before\
+				# parsing the members of this one
+				next_url = members_page_url(dept_page, page_number + 1) if has_next_page(root) else None
+				pending = prefetcher.submit(backend.fetch, next_url) if next_url else None
+				yield (page_url, parse_member_views(root))
+				page_url = next_url
+				page_number += 1
+		return
 
-	member_containers = driver.find_elements_by_class_name("container-fluid")
+	with tracing.phase("driver_get", url=page_url):
+		driver.get(page_url)
 
 	# Run the loop while there's pages of members to scrape
 	while True:
 
+		# Running sum of the profile views scraped in this page
+		total_views = 0
 		# Loop through the relevant elements found to scrape the required\
 		# information
-		for container in member_containers:
+		for container in driver.find_elements_by_class_name("container-fluid"):
 			# Target element
 			info_span = int(container.find_elements_by_class_name("u-ml0x")[1].\
 				text.split()[3].strip().replace(",", ""))
 			# Update the running sum with the scraped views
 			total_views += info_span
 
-		# Try to move to the next page of results
+		# Check if there's a next page before handing this one over, since\
+		# the caller may use the driver in the meantime
+		has_next = is_present(driver, By.CLASS_NAME, "next_page")
+		yield (page_url, total_views)
+
+		# If this was the last page, then there's nothing more to scrape
+		if not has_next:
+			break
+
+		# Otherwise, navigate to the next page of results
+		page_number += 1
+		page_url = members_page_url(dept_page, page_number)
+		with tracing.phase("driver_get", url=page_url):
+			driver.get(page_url)
+
+
+
+def count_views (dept_page, backend=None):
+	'''
+	Scrape the total profile views of the members of a single department,
+	over all of its pages of members.
+
+	Parameters
+	----------
+	dept_page : str
+		The URL for the first page of members of the target department.
+	backend : object, optional
+		A backend from `fetch_backend` (see `iter_member_views`).
+
+	Returns
+	-------
+	total_views : int
+		The total profile views of the members of the department.
+	'''
+
+	return sum(views for _, views in iter_member_views(dept_page, backend=backend))
+
+
+
+# Maximum number of seconds to wait for new content after scrolling down a\
+# page, and maximum number of scrolls per page
+SCROLL_TIMEOUT = 10
+MAX_SCROLLS = 200
+# Seconds without any request in flight after which we consider that a\
+# scroll didn't load anything new
+NETWORK_IDLE_TIME = 0.3
+
+# Number of requests currently in flight: the ones made through jQuery\
+# (which is what Academia.edu uses for its infinite scroll) and the number of\
+# resources loaded since the last check (not zero while anything else is\
+# loading). The resource timings are cleared after each check, since the\
+# browser stops recording them once its buffer (250 entries by default) is\
+# full, and a count stuck at the limit would look like an idle network
+NETWORK_STATE_JS = """
+var resources = performance.getEntriesByType("resource").length;
+performance.clearResourceTimings();
+return [window.jQuery ? window.jQuery.active : 0, resources];
+"""
+
+# Count elements with JavaScript instead of `find_elements`, which would\
+# block for the whole implicit wait when there are none
+COUNT_ELEMENTS_JS = "return document.querySelectorAll(arguments[0]).length;"
+
+# Value returned by `content_arrived` when the network went idle
+IDLE = "idle"
+
+
+
+class content_arrived (object):
+	'''
+	An expectation for checking that new elements matching a CSS selector
+	showed up in the page, or that the network has been idle for a while (so
+	that nothing else is coming).
+
+	Parameters
+	----------
+	selector : str
+		The CSS selector of the elements.
+	count : int
+		The number of elements there were before.
+	idle_time : float
+		Seconds without any request in flight after which we give up.
+
+	Returns
+	-------
+	int or str or bool
+		The new number of elements once there are more than `count`, `IDLE`
+		if the network went idle, `False` otherwise.
+	'''
+
+	def __init__(self, selector, count, idle_time=NETWORK_IDLE_TIME):
+		self.selector = selector
+		self.count = count
+		self.idle_time = idle_time
+		self._idle_since = None
+
+
+	def __call__ (self, driver):
+		new_count = driver.execute_script(COUNT_ELEMENTS_JS, self.selector)
+		if new_count > self.count:
+			return new_count
+
+		active, resources = driver.execute_script(NETWORK_STATE_JS)
+		now = time.monotonic()
+		# Something is still loading (or this is the first check), so start\
+		# counting the idle time again
+		if active or resources or self._idle_since is None:
+			self._idle_since = now
+			return False
+
+		# `WebDriverWait` keeps polling while the result is falsy, so the\
+		# network going idle has to be a truthy value of its own
+		return IDLE if now - self._idle_since >= self.idle_time else False
+
+
+def scroll_until_loaded (driver, selector, timeout=SCROLL_TIMEOUT, max_scrolls=MAX_SCROLLS):
+	'''
+	Scroll down an infinite-scroll page until it stops loading new elements.
+
+	Instead of sleeping a fixed time after every scroll, wait until new
+	elements show up (and continue right away) or until the network goes
+	idle without them (and stop).
+
+	Parameters
+	----------
+	driver : selenium.webdriver.Chrome
+		The driver, with the page already loaded.
+	selector : str
+		CSS selector of the elements loaded by scrolling.
+	timeout : float
+		Maximum number of seconds to wait after each scroll.
+	max_scrolls : int
+		Maximum number of scrolls.
+
+	Returns
+	-------
+	loaded : list
+		The number of new elements loaded by each scroll.
+	'''
+
+	loaded = []
+	count = driver.execute_script(COUNT_ELEMENTS_JS, selector)
+
+	for _ in range(max_scrolls):
+		driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
 		try:
-			# We are moving to the next page of results
-			page_number += 1
-			# If no element with this class can be found, then we are at the\
-			# last page of results
-			next_page = driver.find_element_by_class_name("next_page")
-			next_link = dept_page.split("?")[0]+"?page="+str(page_number) 
-			# If the element was found, navigate to the next page
-			driver.get(next_link)
-			# If there's at least one more page of members to scrape, return\
-			# the scraped views for the current page, as well as the URL for\
-			# the next page of members
-			return (total_views, next_link)
-
-		# If this was the last page, then break the loop because there's\
-		# nothing more to scrape
-		except:
+			with tracing.phase("wait_scroll"):
+				new_count = WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+					content_arrived(selector, count))
+		# Still loading after `timeout`: take what we have
+		except TimeoutException:
+			break
+		if new_count == IDLE:
 			break
 
-	# Otherwise, if this was the last page of results, return just the\
-	# scraped profile views
-	return (total_views,)
+		loaded.append(new_count - count)
+		count = new_count
 
+	return loaded
 
 
-def count_reads (docs_page):
+
+def count_reads (docs_page, scroll_timeout=SCROLL_TIMEOUT, max_scrolls=MAX_SCROLLS):
 	'''
 	Scrape the total number of document reads for a single department,
 	given the first page of documents available.
@@ -147,22 +578,28 @@ def count_reads (docs_page):
 	----------
 	docs_page : str
 		The URL of the first page of publications for a target department.
+	scroll_timeout : float
+		Maximum number of seconds to wait for new documents after each
+		scroll.
+	max_scrolls : int
+		Maximum number of scrolls per page of documents.
 
 	Returns
 	-------
 	total_reads : int
 		The total number of times the publications associated to the target
 		department have been read.
-	'''
 
-	driver.get(docs_page)
-
-	# Time to wait for the page to load every time new content is\
-	# dynamically loaded (in seconds)
-	scroll_pause_time = 0.5
+	Raises
+	------
+	BlockedError
+		If a page of documents is a block (a CAPTCHA, an interstitial...).
+	'''
 
-	# Get scroll height
-	last_height = driver.execute_script("return document.body.scrollHeight")
+	with tracing.phase("driver_get", url=docs_page):
+		driver.get(docs_page)
+	# Don't read a CAPTCHA as a department without reads
+	raise_if_blocked(driver.current_url, 200, driver.page_source)
 
 	# Running sum of scraped document views
 	total_reads = 0
@@ -172,103 +609,247 @@ def count_reads (docs_page):
 	# Run this outer loop while we there are pages of documents to be scraped
 	while True:
 
-		# https://stackoverflow.com/a/28928684/1316860
-		# ---------------------------------------------------------------------------
-		# Loop until the current page is completely loaded
-		while True:
-			# Scroll down to bottom
-			driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-
-			# Wait to load page
-			time.sleep(scroll_pause_time)
-
-			# Calculate new scroll height and compare with last scroll height
-			new_height = driver.execute_script("return document.body.scrollHeight")
-			# If the page's height didn't change since last iteration, then\
-			# there's nothing more to load in this page
-			if new_height == last_height:
-				break
-			# Current height of the page
-			last_height = new_height
-		# ---------------------------------------------------------------------------
+		# Keep scrolling until no more documents are loaded in this page
+		scroll_until_loaded(driver, ".js-view-count", timeout=scroll_timeout, max_scrolls=max_scrolls)
 
 		# Scrape the available document views
-		views_elems = driver.find_elements_by_class_name("js-view-count")
+		# (scrolling already waited for them, so a page without documents\
+		# shouldn't wait any longer)
+		views_elems = find_all_now(driver, By.CLASS_NAME, "js-view-count")
 		# Loop through the scraped elements to get the actual document\
 		# views/reads
 		for elem in views_elems:
 			# Update the running sum with the scraped values
 			total_reads += int(elem.text.strip().split()[0].replace(",", ""))
 		
-		# Try to move to the next page of results
-		try:
-			# We are moving to the next page of results
-			page_number += 1
-			# If no element with this class can be found, then we are at the\
-			# last page of results
-			next_page = driver.find_element_by_class_name("next_page")
-			# If the element was found, navigate to the next page
-			driver.get(docs_page+"?page="+str(page_number))
-		
-		# If this was the last page, then break the loop because there's\
-		# nothing more to scrape
-		except:
+		# If there's no element with this class, then we are at the last\
+		# page of results, so break the loop because there's nothing more\
+		# to scrape (the page is fully loaded, so don't wait for it)
+		if not is_present(driver, By.CLASS_NAME, "next_page"):
 			break
 
+		# Otherwise, move to the next page of results
+		page_number += 1
+		next_link = docs_page+"?page="+str(page_number)
+		with tracing.phase("driver_get", url=next_link):
+			driver.get(next_link)
+		raise_if_blocked(driver.current_url, 200, driver.page_source)
+
 
 	return total_reads
 
 
 
+def count_department_reads (docs_page, url_template, backend, scroll_timeout=SCROLL_TIMEOUT, max_scrolls=MAX_SCROLLS):
+	'''
+	Scrape the total number of document reads for a single department,
+	straight from its JSON batches if possible, or by scrolling its pages of
+	documents in the browser otherwise.
+
+	Parameters
+	----------
+	docs_page : str
+		The URL of the first page of publications of the department.
+	url_template : str
+		Template of the URLs of the batches (like `DOCUMENTS_BATCH_URL`), or
+		`None` to always scroll.
+	backend : object
+		A backend from `fetch_backend` to fetch the batches with.
+	scroll_timeout : float
+		See `count_reads`.
+	max_scrolls : int
+		See `count_reads`.
+
+	Returns
+	-------
+	total_reads : int
+		The total number of times the department's publications have been
+		read.
+	'''
+
+	total_reads = try_batched(docs_page, url_template, backend) if url_template is not None and backend is not None else None
+	if total_reads is None:
+		total_reads = count_reads(docs_page, scroll_timeout, max_scrolls)
+
+	return total_reads
+
+
+
+def crawl_views (dept_pages, backend, per_host=4):
+	'''
+	Scrape the total profile views of the members of several departments
+	concurrently, with the asynchronous crawl engine.
+
+	Parameters
+	----------
+	dept_pages : list
+		The URLs for the first pages of members of the target departments.
+	backend : object
+		A backend from `fetch_backend`, safe to use from several threads.
+	per_host : int
+		Maximum number of requests in flight to a single host.
+
+	Returns
+	-------
+	(dept_views, failed) : tuple
+		Dictionary of the type `dept_page: total_views` with the departments
+		whose every page was scraped, and the list of the departments with a
+		page that couldn't be scraped (blocked too many times or failed),
+		which are left out instead of counted with partial views.
+	'''
+
+	engine = CrawlEngine(backend, per_host=per_host)
+	# Department of every page of members added, to know which departments\
+	# the failed pages belong to
+	page_depts = {}
+
+	# Every page of members adds its views to the results, and the next\
+	# page (if there's one) to the frontier
+	def on_members_page (engine, page, dept_page, page_number):
+		if has_next_page(page.root):
+			next_url = members_page_url(dept_page, page_number + 1)
+			page_depts[next_url] = dept_page
+			engine.add(next_url, on_members_page, dept_page=dept_page, page_number=page_number + 1)
+		return (dept_page, parse_member_views(page.root))
+
+	for dept_page in dept_pages:
+		page_depts[dept_page] = dept_page
+		engine.add(dept_page, on_members_page, dept_page=dept_page, page_number=1)
+
+	# Add up the views of the pages of each department
+	dept_views = {dept_page: 0 for dept_page in dept_pages}
+	for dept_page, views in engine.crawl():
+		dept_views[dept_page] += views
+
+	# Don't let failed pages go unnoticed, and leave out their departments
+	failed = []
+	for url, error in engine.errors:
+		report_failure(url, error)
+		dept_page = page_depts[url]
+		if dept_page not in failed:
+			failed.append(dept_page)
+			del dept_views[dept_page]
+
+	return (dept_views, failed)
+
+
+
+# List with the names of the schools
+SCHOOLS = [
+	"ISEP",
+	"ISCAP",
+	"ESE",
+	"ESMAE",
+	"ESTG",
+	"ESS",
+	"ESHT",
+	"ESMAD"
+]
+
+# URLs from where we'll extract the profiles for each school. If a school\
+# has an empty string, it means that school is not present in ResearchGate
+SCHOOL_PAGES = [
+	"http://cityoffuture.academia.edu/",
+	"http://iscap.academia.edu/",
+	"https://ipp.academia.edu/Departments/Escola_Superior_de_Educa%C3%A7%C3%A3o_do_Porto",
+	"http://esmae-ipp.academia.edu/",
+	[
+		"https://ipp.academia.edu/Departments/Escola_superior_de_Tecnologia_e_Gest%C3%A3o_de_Felgueiras",
+		"http://ipp.academia.edu/Departments/School_of_Management_and_Technology_of_Felgueiras",
+		"https://ipp.academia.edu/Departments/School_of_Technology_and_Management_of_Felgueiras"
+	],
+	[
+		"https://ipp.academia.edu/Departments/Escola_Superior_de_Sa%C3%BAde_do_Porto",
+		"https://ipp.academia.edu/Departments/Escola_Superior_de_Tecnologia_da_Sa%C3%BAde_do_Porto",
+		"https://ipp.academia.edu/Departments/School_of_Health_Technologies"
+	],
+	"http://ipp.academia.edu/Departments/Escola_Superior_de_Hotelaria_e_Turismo",
+	"https://ipp.academia.edu/Departments/Escola_Superior_de_Media_Artes_e_Design"
+]
+
+
+
 if __name__ == "__main__":
-	# List with the names of the schools
-	schools = [
-		"ISEP",
-		"ISCAP",
-		"ESE",
-		"ESMAE",
-		"ESTG",
-		"ESS",
-		"ESHT",
-		"ESMAD"
-	]
-
-	# URLs from where we'll extract the profiles for each school. If a school\
-	# has an empty string, it means that school is not present in ResearchGate
-	school_pages = [
-		"http://cityoffuture.academia.edu/",
-		"http://iscap.academia.edu/",
-		"https://ipp.academia.edu/Departments/Escola_Superior_de_Educa%C3%A7%C3%A3o_do_Porto",
-		"http://esmae-ipp.academia.edu/",
-		[
-			"https://ipp.academia.edu/Departments/Escola_superior_de_Tecnologia_e_Gest%C3%A3o_de_Felgueiras",
-			"http://ipp.academia.edu/Departments/School_of_Management_and_Technology_of_Felgueiras",
-			"https://ipp.academia.edu/Departments/School_of_Technology_and_Management_of_Felgueiras"
-		],
-		[
-			"https://ipp.academia.edu/Departments/Escola_Superior_de_Sa%C3%BAde_do_Porto",
-			"https://ipp.academia.edu/Departments/Escola_Superior_de_Tecnologia_da_Sa%C3%BAde_do_Porto",
-			"https://ipp.academia.edu/Departments/School_of_Health_Technologies"
-		],
-		"http://ipp.academia.edu/Departments/Escola_Superior_de_Hotelaria_e_Turismo",
-		"https://ipp.academia.edu/Departments/Escola_Superior_de_Media_Artes_e_Design"
-	]
-
-	# We'll use Google Chrome
-	driver = webdriver.Chrome()
-	# Make the driver wait 10 seconds when needed
-	driver.implicitly_wait(10)
+	parser = argparse.ArgumentParser(description="Scrape document reads and profile views of IPP's schools from Academia.edu.")
+	parser.add_argument("--backend", choices=["http", "selenium"], default="http",
+		help="fetch the schools' pages and lists of members with plain HTTP requests or with the browser")
+	parser.add_argument("--per-host", type=int, default=0,
+		help="fetch the lists of members with the asynchronous engine, with up to this many requests in flight (needs --backend http)")
+	parser.add_argument("--cache", default="page_cache",
+		help="directory of the on-disk cache of fetched pages")
+	parser.add_argument("--no-cache", action="store_true",
+		help="always fetch pages from the network")
+	parser.add_argument("--store", default="metrics.sqlite3",
+		help="SQLite file where the metrics of every department page are kept")
+	parser.add_argument("--incremental", action="store_true",
+		help="only scrape department pages that are new or older than --max-age, and compute the totals from the store")
+	parser.add_argument("--max-age", type=float, default=7 * 24,
+		help="hours after which a stored page is scraped again (with --incremental)")
+	parser.add_argument("--records", default="acadEdu_pages.cols",
+		help="file where the metrics of every department page are saved by column (Parquet if it ends with .parquet)")
+	parser.add_argument("--output", default="acadEdu_results.ndjson",
+		help="NDJSON file where every page of documents and members is written as soon as it's scraped")
+	parser.add_argument("--journal", default="academiaEdu.journal",
+		help="file where every completed school and page is recorded")
+	parser.add_argument("--resume", action="store_true",
+		help="replay the journal of a previous run and skip the work already done")
+	parser.add_argument("--batches", action="store_true",
+		help="sum the reads and views from the site's JSON batch endpoints instead of rendering the pages (needs --backend http)")
+	parser.add_argument("--documents-endpoint", default=DOCUMENTS_BATCH_URL,
+		help="template of the URLs of the batches of documents ({url} is the page, {page} the batch number)")
+	parser.add_argument("--members-endpoint", default=MEMBERS_BATCH_URL,
+		help="template of the URLs of the batches of members ({url} is the page, {page} the batch number)")
+	parser.add_argument("--scroll-timeout", type=float, default=SCROLL_TIMEOUT,
+		help="maximum seconds to wait for new documents after each scroll")
+	parser.add_argument("--max-scrolls", type=int, default=MAX_SCROLLS,
+		help="maximum number of scrolls per page of documents")
+	parser.add_argument("--browser", choices=PROFILES, default="lean",
+		help="profile of the browsers: lean (headless, without images, fonts or trackers) or full (a normal window)")
+	parser.add_argument("--trace",
+		help="record how long every phase of the run takes, and write the trace to this JSON file")
+	args = parser.parse_args()
+	if args.trace:
+		tracing.enable()
+	if args.batches and args.backend != "http":
+		parser.error("--batches needs --backend http")
+
+	schools = SCHOOLS
+	school_pages = SCHOOL_PAGES
+
+	# We'll use Google Chrome (lean, unless asked otherwise), which waits\
+	# 10 seconds when needed
+	set_default_profile(args.browser)
+	driver = new_driver()
+	# The pages of documents need to be scrolled in the browser, but the\
+	# schools' pages and lists of members can be fetched with plain HTTP\
+	# requests, which follow limits that adapt to how much the site puts up\
+	# with (blocked pages are put back in the frontier of the asynchronous\
+	# engine, or asked for again after a pause otherwise)
+	limiter = RateLimiter()
+	backend = None
+	if args.backend == "http":
+		backend = ThrottledBackend(HttpBackend(), limiter, 0 if args.per_host > 0 else BLOCKED_RETRIES)
+	# Cache of fetched pages, so that re-runs don't fetch them again (the\
+	# pages of documents are scrolled in the browser, so they can't be\
+	# cached)
+	cache = None if args.no_cache else ResponseCache(args.cache)
+	if backend is not None and cache is not None:
+		backend = CachedBackend(backend, cache)
+	# Store with the metrics of every page of documents and members scraped
+	store = MetricsStore(args.store)
+	max_age = args.max_age * 3600
+	# Journal where every completed school and page is recorded, so that a\
+	# run that crashes can be resumed
+	journal = Journal(args.journal, resume=args.resume)
+	# Every department's reads and views are written to the output as soon\
+	# as they're scraped, and the totals of each school are computed from it\
+	# at the end
+	sink = ResultSink(args.output)
 
 
 	# Counter to keep track of which school we are looking at (by using the\
 	# index of the `schools` list)
 	counter = 0
-	# Final dictionaries with the total sum of document reads and profile\
-	# views for each school, respectively
-	reads_count = {school:0 for school in schools}
-	views_count = {school:0 for school in schools}
-	# String to be written to a .txt file with the scraped results
-	write_string = ""
 	# All the first pages of publications for the departments of each\
 	# school (list of lists where the inner lists represent a single\
 	# school)
@@ -278,9 +859,18 @@ if __name__ == "__main__":
 	# school)
 	all_members = []
 
+	# Pages of every school found in a previous run (if resuming)
+	found_pages = {record["school"]: (record["docs"], record["members"]) for record in journal.of_kind("pages")}
+
 	# Loop through the schools to scrape their pages of publications for\
 	# their departments as well as for their members
-	for school_page in school_pages:
+	for school, school_page in zip(schools, school_pages):
+
+		# Skip the schools whose pages were already found
+		if school in found_pages:
+			all_docs.append(found_pages[school][0])
+			all_members.append(found_pages[school][1])
+			continue
 
 		# If the school doesn't have a single institutional page, then it\
 		# probably has multiple pages as departments. In those cases\
@@ -289,9 +879,9 @@ if __name__ == "__main__":
 		# When schools have their own institutional pages
 		if type(school_page) != list:
 			if "ipp.academia.edu" in school_page:
-				docs_page, members_page = page+"/Documents", page
+				docs_page, members_page = [school_page+"/Documents"], [school_page]
 			else:
-				docs_page, members_page = get_docs_profiles_pages(school_page)
+				docs_page, members_page = get_docs_profiles_pages(school_page, backend=backend)
 
 		# When they don't
 		else:
@@ -302,74 +892,140 @@ if __name__ == "__main__":
 				docs_page.append(page+"/Documents")
 				members_page.append(page)
 
-	# This block would be used if the script was executed in parts and\
-	# we had beforehand a .pickle file with the document and member\
-	# pages
-	# with open("scraped_profiles.pickle", "rb") as f:
-		# docs = pickle.load(f)
-		# members = pickle.load(f)
+		# Create a nested list with all the first pages of publications and\
+		# members for each department of a single school
+		all_docs.append(docs_page)
+		all_members.append(members_page)
+		journal.append("pages", school=school, docs=docs_page, members=members_page)
+
+	# Add the pages scraped in a previous run (if resuming) to the output\
+	# again, since it was started over
+	done_pages = set()
+	for record in journal.of_kind("reads"):
+		sink.profile("academia", record["school"], record["page"], {"reads": record["reads"]}, resumed=True)
+		done_pages.add(record["page"])
+	for record in journal.of_kind("views"):
+		sink.profile("academia", record["school"], record["page"], {"views": record["views"]}, resumed=True)
+		done_pages.add(record["page"])
 
 	# Loop through each school once again, but this time to scrape the\
 	# total counts for publication reads and profile views for the\
 	# scraped URLs
-	for school_page in school_pages:
+	for docs_page, members_page in zip(all_docs, all_members):
+		school = schools[counter]
+		tracing.set_context(school=school)
 
 		# Scrape the publication reads
 		for page in docs_page:
 		# for page in docs[counter]:
-			reads_count[schools[counter]] += count_reads(page)
+			# Skip the pages done in a previous run and, in incremental\
+			# mode, the pages with recent metrics
+			if page in done_pages:
+				continue
+			if args.incremental and not store.needs_refresh("academia", page, max_age):
+				sink.profile("academia", school, page, store.metrics_of("academia", page), stored=True)
+				continue
+			try:
+				page_reads = count_department_reads(page, args.documents_endpoint if args.batches else None, backend,
+					args.scroll_timeout, args.max_scrolls)
+			# Leave the page out instead of counting it as a zero (it isn't\
+			# in the journal, so --resume scrapes it)
+			except BlockedError as error:
+				report_failure(page, error)
+				continue
+			store.save("academia", school, page, {"reads": page_reads})
+			journal.append("reads", school=school, page=page, reads=page_reads)
+			sink.profile("academia", school, page, {"reads": page_reads})
+
+		# Pages of members to scrape
+		members_page = [page for page in members_page if page not in done_pages]
+		# In incremental mode, the pages that aren't scraped again are\
+		# written to the output with their stored metrics
+		if args.incremental:
+			stale_pages = []
+			for page in members_page:
+				if store.needs_refresh("academia", page, max_age):
+					stale_pages.append(page)
+				else:
+					sink.profile("academia", school, page, store.metrics_of("academia", page), stored=True)
+			members_page = stale_pages
+
+		# Scrape the profile views of every department at once with the\
+		# asynchronous engine
+		if args.per_host > 0 and backend is not None:
+			dept_views, failed = crawl_views(members_page, backend, per_host=args.per_host)
+			# The departments with pages that couldn't be scraped aren't in\
+			# the journal (nor in the store), so a later run scrapes them
+			for page in failed:
+				report_failure(page, "it's left out of the totals")
+			for page, final_views in dept_views.items():
+				store.save("academia", school, page, {"views": final_views})
+				journal.append("views", school=school, page=page, views=final_views)
+				sink.profile("academia", school, page, {"views": final_views})
+			members_page_serial = []
+		else:
+			members_page_serial = members_page
 
 		# Scrape the profile views
-		for page in members_page:
+		for page in members_page_serial:
 		# for page in members[counter]:
-			final_views = 0
-			# Stupid little trick because it wasn't possible to scrape all\
-			# pages of members with a single function call. Instead, as\
-			# long as the function call is used to scrape any other page\
-			# that is not the last page of members, return the total views\
-			# scraped for that page as well as the URL for the next page;\
-			# when the last page is scraped, return just the scraped views
-			while True:
-				temp_result = count_views(page)
-				# If two-item tuple was returned, update the total views\
-				# and the target page for the next function call
-				if len(temp_result) == 2:
-					final_views += temp_result[0]
-					page = temp_result[1]
-				# Otherwise, just update the total views and break the loop\
-				# because we have finally finished scraping the current\
-				# department
-				else:
-					final_views += temp_result[0]
-					break
-			# Update the total views for the current school with the views\
-			# scraped for the current department
-			views_count[schools[counter]] += final_views
-
-		# Create phrases for the scraped information and add it to the string\
-		# which will be written to the .txt file
-		write_string += schools[counter] + "'s documents have been read " +\
-			str(reads_count[schools[counter]]) + " times.\n"
-		write_string += schools[counter] + "'s members' profiles have been visited " +\
-			str(views_count[schools[counter]]) + " times.\n\n"
+			# Keep the URL of the department's first page
+			dept_page = page
+			try:
+				# Straight from the JSON batches, if possible
+				final_views = try_batched(dept_page, args.members_endpoint, backend) if args.batches else None
+				# Otherwise, add up the views of the pages of the department\
+				# as they are scraped
+				if final_views is None:
+					final_views = 0
+					for members_url, page_views in iter_member_views(dept_page, backend=backend):
+						final_views += page_views
+						sink.page("academia", school, members_url, views=page_views)
+			except BlockedError as error:
+				report_failure(dept_page, error)
+				continue
+			store.save("academia", school, dept_page, {"views": final_views})
+			journal.append("views", school=school, page=dept_page, views=final_views)
+			sink.profile("academia", school, dept_page, {"views": final_views})
 
 		# Increment the counter since we are moving to the next school
 		counter += 1
-		# Create a nested list with all the first pages of publications and\
-		# members for each department of a single school
-		all_docs.append(docs_page)
-		all_members.append(members_page)
 
 	# Quit/exit the driver
 	driver.quit()
+	if backend is not None:
+		backend.close()
+	# Keep the metrics of every department page (not just the totals), so that\
+	# they can be analyzed later
+	ProfileTable.from_store(store, "academia").save(args.records)
+	store.close()
 
-	# We can execute the following block to create a single .pickle\
-	# file with all the document and member scraped pages
-	# Write the dictionary of schools and profiles to a new .pickle file
-	with open("scraped_profiles.pickle", "wb") as f:
-		pickle.dump(all_docs, f, pickle.HIGHEST_PROTOCOL)
-		pickle.dump(all_members, f, pickle.HIGHEST_PROTOCOL)
+	journal.close()
+
+	# The totals of each school come from the pages written to the output
+	sink.close()
+	totals = school_totals(args.output, "academia")
+	# String to be written to a .txt file with the scraped results
+	write_string = ""
+	for school in schools:
+		school_total = totals.get(school, {})
+		# Create phrases for the scraped information and add them to the\
+		# string which will be written to the .txt file
+		write_string += school + "'s documents have been read " +\
+			str(school_total.get("reads", 0)) + " times.\n"
+		write_string += school + "'s members' profiles have been visited " +\
+			str(school_total.get("views", 0)) + " times.\n\n"
 
 	# Finally, write the scraped information to a .txt file
 	with open("acadEdu_reads_views.txt", "w") as f:
-		f.write(write_string)
\ No newline at end of file
+		f.write(write_string)
+	print(sink.records, "records written to", args.output)
+
+	if cache is not None:
+		print("Page cache:", cache.stats())
+	print("Rate limits:", limiter.stats())
+
+	# Where the time went
+	if args.trace:
+		tracing.tracer.export(args.trace)
+		tracing.tracer.print_summary()
\ No newline at end of file
@@ -0,0 +1,397 @@
+'''
+File to benchmark the scrapers offline, against a local HTTP server that
+serves synthetic pages shaped like the ones of Google Scholar, ResearchGate
+and Academia.edu.
+
+Every scraper function that can work from a backend is run against the
+server, which can add a fixed latency to every response to look more like
+the real sites. For each one we measure how many pages per second it gets
+through, the latency per unit of work (a profile, a page of results, a
+department) and the peak memory allocated while it runs. The results of each
+run are appended as one JSON line to a file, so that runs can be compared
+over time (for example, before and after a change).
+
+Usage: python benchmark.py [--latency 0.05] [--authors 40] [--output benchmark_results.jsonl]
+'''
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+from fetch_backend import HttpBackend
+from tracing import percentile
+
+# The ResearchGate scraper imports our account's credentials, which aren't\
+# needed (nor wanted) to scrape the local server
+try:
+	import researchGate_id
+except ImportError:
+	sys.modules["researchGate_id"] = types.SimpleNamespace(user="", password="")
+
+import google_scholar_pubs_per_institution as scholar
+import researchGate_reads_citations_per_institution as researchgate
+import academiaEdu_school_reads_profileViews as academia
+
+
+# Number of results in a page of Scholar's author search, and of members in\
+# a page of ResearchGate and Academia.edu
+RESULTS_PER_PAGE = 10
+
+# Folder with the sample batches of Academia.edu's JSON endpoints
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "academia")
+
+
+
+class FixtureSite (object):
+	'''
+	Synthetic pages of the three platforms. Every page is generated from its
+	URL, so the same URL always gets the same page.
+
+	Parameters
+	----------
+	authors : int
+		Number of authors (or members) of each school or department.
+	'''
+
+	def __init__(self, authors=40):
+		self.authors = authors
+
+
+	def publications (self, user_id):
+		'''
+		Number of publications of a Scholar author (some need several pages).
+		'''
+
+		return (int(user_id.split("_")[-1]) * 37) % 250
+
+
+	def page (self, path, query):
+		'''
+		The page for a path and query.
+
+		Returns
+		-------
+		(content_type, body) : tuple
+			The type and the content of the page, or `None` if there's no
+			such page.
+		'''
+
+		if path == "/citations" and "mauthors" in query:
+			return ("text/html", self.scholar_results(query["mauthors"][0], int(query.get("after", ["0"])[0])))
+		if path == "/citations" and "user" in query:
+			return ("text/html", self.scholar_profile(query["user"][0], int(query.get("cstart", ["0"])[0]),
+				int(query.get("pagesize", ["20"])[0])))
+		if path.startswith("/institution/"):
+			return ("text/html", self.researchgate_members(path.split("/")[2], int(query.get("page", ["1"])[0])))
+		if path.startswith("/profile/"):
+			return ("text/html", self.researchgate_profile(path.split("/")[2]))
+		if path.startswith("/batches/"):
+			try:
+				with open(os.path.join(FIXTURES, path.split("/")[2]), encoding="utf-8") as f:
+					return ("application/json", f.read())
+			except OSError:
+				return None
+		if path.startswith("/Departments/"):
+			return ("text/html", self.academia_members(path.split("/")[2], int(query.get("page", ["1"])[0])))
+
+		return None
+
+
+	def scholar_results (self, school, after):
+		cards = []
+		for i in range(after, min(after + RESULTS_PER_PAGE, self.authors)):
+			user_id = f"{school}_{i}"
+			cards.append(f'''
+				<div class="gsc_1usr">
+					<a class="gs_ai_pho" href="/citations?hl=en&amp;user={user_id}"><img></a>
+					<h3 class="gs_ai_name"><a>Author {i} of {school}</a></h3>
+					<div class="gs_ai_cby">Cited by {i * 11}</div>
+				</div>''')
+		# The "next page" button is disabled in the last page
+		if after + RESULTS_PER_PAGE < self.authors:
+			next_url = f"/citations?view_op\\x3dsearch_authors\\x26hl\\x3den\\x26mauthors\\x3d{school}\\x26after\\x3d{after + RESULTS_PER_PAGE}"
+			button = f'''<button type="button" onclick="window.location='{next_url}'">Next</button>'''
+		else:
+			button = '<button type="button" disabled>Next</button>'
+
+		return f'''<html><body><div id="gsc_sa_ccl">{"".join(cards)}</div>
+			<button type="button">Previous</button>{button}</body></html>'''
+
+
+	def scholar_profile (self, user_id, cstart, pagesize):
+		index = int(user_id.split("_")[-1])
+		stats = [index * 11, index * 5, index % 30, index % 20, index % 25, index % 15]
+		cells = "".join(f'<td class="gsc_rsb_std">{value}</td>' for value in stats)
+		pubs = max(0, min(pagesize, self.publications(user_id) - cstart))
+		rows = "".join(f'<tr class="gsc_a_tr"><td class="gsc_a_t">Paper {cstart + i}</td></tr>' for i in range(pubs))
+		if pubs == 0:
+			rows = '<tr class="gsc_a_tr"><td class="gsc_a_e">There are no articles in this profile.</td></tr>'
+
+		return f'''<html><body><table id="gsc_rsb_st">{cells}</table>
+			<table id="gsc_a_t"><tbody>{rows}</tbody></table></body></html>'''
+
+
+	def researchgate_members (self, school, page):
+		last_page = (self.authors - 1) // RESULTS_PER_PAGE + 1
+		members = "".join(f'''
+			<li class="people-item" data-account-key="{school}_{i}">
+				<a class="display-name">Member {i} of {school}</a>
+			</li>''' for i in range((page - 1) * RESULTS_PER_PAGE, min(page * RESULTS_PER_PAGE, self.authors)))
+		links = "".join(f'<a class="navi-page-link">{i}</a>' for i in range(1, last_page + 1))
+
+		return f'<html><body><ul>{members}</ul><div class="navi">{links}</div></body></html>'
+
+
+	def researchgate_profile (self, account_key):
+		index = int(account_key.split("_")[-1])
+		values = [index, index * 3, index * 2, index * 7]
+		# Each value nested five <div>s deep
+		items = "".join(f'<div class="application-box-layout__item"><div><div><div><div><div>{value}</div></div></div></div></div></div>'
+			for value in values)
+
+		return f"<html><body>{items}</body></html>"
+
+
+	def academia_members (self, department, page):
+		last_page = (self.authors - 1) // RESULTS_PER_PAGE + 1
+		members = "".join(f'''
+			<div class="container-fluid">
+				<span class="u-ml0x">Member {i}</span>
+				<span class="u-ml0x">{i} Followers | {i * 13:,} Views</span>
+			</div>''' for i in range((page - 1) * RESULTS_PER_PAGE, min(page * RESULTS_PER_PAGE, self.authors)))
+		next_page = '<a class="next_page" rel="next">Next</a>' if page < last_page else ""
+
+		return f"<html><body>{members}{next_page}</body></html>"
+
+
+
+class FixtureServer (object):
+	'''
+	A local HTTP server for a `FixtureSite`, running in a background thread.
+
+	Parameters
+	----------
+	site : FixtureSite
+		The pages to serve.
+	latency : float
+		Seconds to wait before answering every request.
+	'''
+
+	def __init__(self, site, latency=0.0):
+		self.site = site
+		self.latency = latency
+		# Number of requests answered
+		self.requests = 0
+		self._lock = threading.Lock()
+		server = self
+
+		class Handler (BaseHTTPRequestHandler):
+			# Keep the connections alive, like the real sites
+			protocol_version = "HTTP/1.1"
+			# The headers and the body are written separately, which with\
+			# Nagle's algorithm adds a delayed ACK (~40 ms) to every response
+			disable_nagle_algorithm = True
+
+			def do_GET (self):
+				parts = urlsplit(self.path)
+				page = server.site.page(parts.path, parse_qs(parts.query))
+				if server.latency:
+					time.sleep(server.latency)
+				with server._lock:
+					server.requests += 1
+				status, (content_type, body) = (200, page) if page is not None else (404, ("text/plain", "Not found"))
+				data = body.encode("utf-8")
+				self.send_response(status)
+				self.send_header("Content-Type", content_type + "; charset=utf-8")
+				self.send_header("Content-Length", str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+			def log_message (self, *args):
+				pass
+
+		self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self._httpd.daemon_threads = True
+		self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+		self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+		self._thread.start()
+
+
+	def close (self):
+		self._httpd.shutdown()
+		self._httpd.server_close()
+
+
+
+def measure (name, server, units, work, memory=True):
+	'''
+	Run a benchmark: call `work` on each unit, timing every call.
+
+	Parameters
+	----------
+	name : str
+		Name of the benchmark.
+	server : FixtureServer
+		The server, to count the pages fetched.
+	units : list
+		The inputs of `work` (profiles, schools, departments...).
+	work : callable
+		The scraper function to benchmark, called as `work(unit)`.
+	memory : bool
+		Whether to trace the memory allocated (which slows Python down a
+		bit).
+
+	Returns
+	-------
+	dict
+		The measurements of the benchmark.
+	'''
+
+	requests_before = server.requests
+	latencies = []
+	if memory:
+		tracemalloc.start()
+	start = time.perf_counter()
+	for unit in units:
+		call_start = time.perf_counter()
+		work(unit)
+		latencies.append(time.perf_counter() - call_start)
+	seconds = time.perf_counter() - start
+	peak_memory = None
+	if memory:
+		peak_memory = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	pages = server.requests - requests_before
+
+	result = {
+		"name": name,
+		"units": len(units),
+		"pages": pages,
+		"seconds": seconds,
+		"pages_per_sec": pages / seconds if seconds else None,
+		"latency_mean": seconds / len(units) if units else None,
+		"latency_p50": percentile(sorted(latencies), 50),
+		"latency_p95": percentile(sorted(latencies), 95),
+		"peak_memory_bytes": peak_memory
+	}
+	print(f"{name:<28} {pages:>6} pages {seconds:8.2f} s {result['pages_per_sec'] or 0:8.1f} pages/s "
+		f"p50 {result['latency_p50'] or 0:.3f} s p95 {result['latency_p95'] or 0:.3f} s")
+
+	return result
+
+
+
+def run_benchmarks (server, schools=("isep.ipp", "iscap.ipp"), per_host=4, memory=True):
+	'''
+	Run every benchmark against a fixture server.
+
+	Returns
+	-------
+	list
+		The measurements of each benchmark.
+	'''
+
+	# Point the scrapers to the local server
+	scholar.SCHOLAR_URL = server.url
+	researchgate.RESEARCHGATE_URL = server.url
+
+	backend = HttpBackend()
+	site = server.site
+	results = []
+
+	# Google Scholar: pages of results, profiles (with all of their\
+	# publications) and a whole crawl with the asynchronous engine
+	def scholar_results (school):
+		page = f"{server.url}/citations?view_op=search_authors&hl=en&mauthors={school}"
+		while page is not None:
+			root = backend.fetch(page).root
+			scholar.parse_page_cards(root)
+			page = scholar.parse_next_page_url(root)
+	results.append(measure("scholar_results_pages", server, list(schools), scholar_results, memory))
+
+	profiles = [f"{server.url}/citations?hl=en&user={school}_{i}" for school in schools for i in range(site.authors)]
+	results.append(measure("scholar_author_profile", server, profiles,
+		lambda profile: scholar.scrape_author_profile(profile, backend=backend), memory))
+	results.append(measure("scholar_crawl_schools", server, [list(schools)],
+		lambda schools: scholar.crawl_schools(schools, backend, per_host=per_host), memory))
+
+	# ResearchGate: lists of members and profiles
+	listings = [f"{server.url}/institution/{school}/members?page=1" for school in schools]
+	results.append(measure("researchgate_get_profiles", server, listings,
+		lambda source: researchgate.get_profiles(source, backend=backend), memory))
+	rg_profiles = [f"{server.url}/profile/{school}_{i}" for school in schools for i in range(site.authors)]
+	results.append(measure("researchgate_profiles", server, rg_profiles,
+		lambda profile: researchgate.get_school_reads_citations([profile], backend=backend), memory))
+
+	# Academia.edu: pages of members, one department at a time and all at\
+	# once with the asynchronous engine, and the JSON batches
+	departments = [f"{server.url}/Departments/{school}" for school in schools]
+	results.append(measure("academia_count_views", server, departments,
+		lambda dept_page: academia.count_views(dept_page, backend=backend), memory))
+	results.append(measure("academia_crawl_views", server, [departments],
+		lambda dept_pages: academia.crawl_views(dept_pages, backend, per_host=per_host), memory))
+	results.append(measure("academia_batches", server, ["documents", "members"],
+		lambda kind: academia.count_batched(server.url, server.url + "/batches/" + kind + "_batch_{page}.json", backend),
+		memory))
+
+	backend.close()
+
+	return results
+
+
+
+def git_commit ():
+	'''
+	The commit the code being benchmarked is at (if it's in a git repo).
+	'''
+
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+			cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		return None
+
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local server with synthetic pages.")
+	parser.add_argument("--latency", type=float, default=0.05,
+		help="seconds the server waits before answering every request")
+	parser.add_argument("--authors", type=int, default=40,
+		help="number of authors (or members) of each school or department")
+	parser.add_argument("--per-host", type=int, default=4,
+		help="requests in flight for the benchmarks of the asynchronous engine")
+	parser.add_argument("--no-memory", action="store_true",
+		help="don't trace the memory allocated (tracing slows Python down a bit)")
+	parser.add_argument("--output", default="benchmark_results.jsonl",
+		help="file where the results of the run are appended, as one JSON line")
+	args = parser.parse_args()
+
+	server = FixtureServer(FixtureSite(args.authors), latency=args.latency)
+	try:
+		benchmarks = run_benchmarks(server, per_host=args.per_host, memory=not args.no_memory)
+	finally:
+		server.close()
+
+	run = {
+		"date": datetime.datetime.now().isoformat(timespec="seconds"),
+		"commit": git_commit(),
+		"python": platform.python_version(),
+		"latency": args.latency,
+		"authors": args.authors,
+		"per_host": args.per_host,
+		"benchmarks": benchmarks
+	}
+	with open(args.output, "a") as f:
+		f.write(json.dumps(run) + "\n")
+	print("Results appended to", args.output)
@@ -0,0 +1,197 @@
+'''
+File with a small asynchronous crawl engine shared by the scraping scripts.
+
+Instead of loading one page at a time, the engine keeps a frontier of URLs and
+fetches many of them at once, limiting how many requests are in flight for
+each host (so we don't hammer any site) and in total. Every URL in the frontier
+has an extractor callback, which receives the fetched page and can add more
+URLs to the frontier (the next page of results, the profiles listed in it,
+...). The callbacks are where each script's parsing functions are used.
+
+The frontier has a queue per host, and a page is only started when its host
+has room for it, so a host with a long queue can't take up the requests meant
+for the others.
+
+The pages themselves are downloaded by a backend from `fetch_backend`, run in
+a thread pool so that the event loop is never blocked.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from urllib.parse import urlsplit
+import asyncio
+
+from rate_limiter import BlockedError
+
+
+# Times a blocked URL is put back in the frontier before giving up on it
+MAX_BLOCKED_RETRIES = 3
+
+
+
+class CrawlEngine (object):
+	'''
+	Crawl a frontier of URLs concurrently.
+
+	Parameters
+	----------
+	backend : object
+		A backend from `fetch_backend` (it must be safe to use from several
+		threads, like `HttpBackend`).
+	per_host : int
+		Maximum number of requests in flight for a single host.
+	max_in_flight : int
+		Maximum number of requests in flight overall.
+	'''
+
+	def __init__(self, backend, per_host=4, max_in_flight=32):
+		self.backend = backend
+		self.per_host = per_host
+		self.max_in_flight = max_in_flight
+		# URLs waiting to be fetched, as `(url, callback, context)` tuples in\
+		# a queue per host
+		self._frontier = {}
+		# Keys (usually the URLs) already added, so that no page is fetched\
+		# twice
+		self._seen = set()
+		# Values returned by the callbacks
+		self.results = []
+		# Exceptions raised while fetching or parsing, as `(url, exception)`
+		self.errors = []
+		# Times each URL was blocked
+		self.blocked = {}
+		# Number of pages fetched
+		self.pages = 0
+		# Event set whenever a URL is added while crawling
+		self._wakeup = None
+
+
+	def _enqueue (self, url, callback, context):
+		'''
+		Put a URL in the queue of its host.
+		'''
+
+		self._frontier.setdefault(urlsplit(url).netloc, deque()).append((url, callback, context))
+		# Wake up the crawl loop if it's waiting for more work
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+
+	def add (self, url, callback, key=None, **context):
+		'''
+		Add a URL to the frontier.
+
+		Parameters
+		----------
+		url : str
+			The URL of the page.
+		callback : callable
+			Function called as `callback(engine, page, **context)` once the
+			page is fetched. It can call `engine.add()` to add more URLs.
+			Anything it returns (other than `None`) is kept in
+			`engine.results`.
+		key : hashable, optional
+			What tells this page apart from the others added (the URL by
+			default). A page whose URL was already added is fetched again
+			if it's given another key, like `(school, url)` for a profile
+			listed by two schools.
+		**context
+			Extra keyword arguments for the callback (the school the page
+			belongs to, for example).
+
+		Returns
+		-------
+		bool
+			`False` if the URL (or its key) had already been added (and was
+			ignored).
+		'''
+
+		if key is None:
+			key = url
+		if key in self._seen:
+			return False
+		self._seen.add(key)
+		self._enqueue(url, callback, context)
+
+		return True
+
+
+	async def _process (self, url, callback, context, host, in_flight, loop, executor):
+		'''
+		Fetch a single page and run its callback.
+		'''
+
+		try:
+			page = await loop.run_in_executor(executor, self.backend.fetch, url)
+		except BlockedError as e:
+			# Try the page again later (the backend holds back its host\
+			# meanwhile) instead of losing it
+			self.blocked[url] = self.blocked.get(url, 0) + 1
+			if self.blocked[url] > MAX_BLOCKED_RETRIES:
+				self.errors.append((url, e))
+			else:
+				self._enqueue(url, callback, context)
+			return
+		except Exception as e:
+			self.errors.append((url, e))
+			return
+		finally:
+			in_flight[host] -= 1
+		self.pages += 1
+		try:
+			result = callback(self, page, **context)
+		except Exception as e:
+			self.errors.append((url, e))
+			return
+		if result is not None:
+			self.results.append(result)
+
+
+	async def run (self):
+		'''
+		Crawl until the frontier is empty and every request has finished.
+
+		Returns
+		-------
+		results : list
+			The values returned by the callbacks.
+		'''
+
+		loop = asyncio.get_running_loop()
+		self._wakeup = asyncio.Event()
+		# Requests in flight for each host
+		in_flight = {}
+		tasks = set()
+
+		with ThreadPoolExecutor(self.max_in_flight) as executor:
+			while self._frontier or tasks:
+				# Start as many requests as the limits allow, taking from the\
+				# queue of every host with room for more (a host at its limit\
+				# keeps its pages queued instead of taking up the slots)
+				for host, queue in list(self._frontier.items()):
+					while queue and in_flight.get(host, 0) < self.per_host and len(tasks) < self.max_in_flight:
+						url, callback, context = queue.popleft()
+						in_flight[host] = in_flight.get(host, 0) + 1
+						tasks.add(asyncio.ensure_future(
+							self._process(url, callback, context, host, in_flight, loop, executor)))
+					if not queue:
+						del self._frontier[host]
+
+				# Wait for a request to finish or for new URLs to be added
+				self._wakeup.clear()
+				waker = asyncio.ensure_future(self._wakeup.wait())
+				done, _ = await asyncio.wait(tasks | {waker}, return_when=asyncio.FIRST_COMPLETED)
+				waker.cancel()
+				tasks -= done
+
+		self._wakeup = None
+
+		return self.results
+
+
+	def crawl (self):
+		'''
+		Run the crawl to completion (for code that isn't asynchronous).
+		'''
+
+		return asyncio.run(self.run())
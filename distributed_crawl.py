@@ -0,0 +1,535 @@
+'''
+File to split a crawl of the three platforms across several worker processes,
+on the same machine or on others, through a shared work queue.
+
+A coordinator puts the first pages of every school in the queue. Workers
+claim pages from it: a page of results (or of a school) adds the profiles and
+pages found in it to the queue, and a profile (or a page of members or
+documents) reports its metrics. The coordinator keeps the metrics of every
+profile in the store as they arrive, and prints the totals of each school
+once the queue is empty. Adding workers (each with its own browser and
+connections) adds throughput, since they never wait for each other.
+
+	python distributed_crawl.py coordinator --queue work_queue.sqlite3
+	python distributed_crawl.py worker --queue work_queue.sqlite3 --platforms scholar academia
+
+A worker that dies or hangs loses its tasks once their leases expire, and
+they are given to other workers. Running the coordinator again with the same
+queue resumes the crawl (tasks already done are not queued again); use a new
+queue file for a new crawl.
+'''
+
+from contextlib import contextmanager
+import argparse
+import os
+import socket
+import threading
+import time
+from work_queue import SQLiteQueue, PENDING, LEASED
+from driver_pool import new_driver, set_default_profile, PROFILES
+from fetch_backend import HttpBackend, SeleniumBackend, FallbackBackend
+from response_cache import ResponseCache, CachedBackend
+from metrics_store import MetricsStore
+from identity_index import IdentityIndex
+from scheduler import Scheduler
+from rate_limiter import RateLimiter, ThrottledBackend, BlockedError
+
+
+# The types of tasks of each platform
+PLATFORM_KINDS = {
+	"scholar": ("scholar_results", "scholar_profile"),
+	"researchgate": ("researchgate_members", "researchgate_profile"),
+	"academia": ("academia_school", "academia_members", "academia_documents")
+}
+KIND_PLATFORM = {kind: platform for platform, kinds in PLATFORM_KINDS.items() for kind in kinds}
+
+# The types of tasks whose result are the metrics of a profile (or page)
+METRIC_KINDS = ("scholar_profile", "researchgate_profile", "academia_members", "academia_documents")
+
+# The types of tasks that find more work (and so are done first)
+DISCOVERY_KINDS = ("scholar_results", "researchgate_members", "academia_school")
+
+# The platforms' scripts are only imported when needed (the one of\
+# ResearchGate needs our account's credentials)
+_modules = {}
+
+
+def platform_module (platform):
+	'''
+	Import the script of a platform.
+	'''
+
+	if platform not in _modules:
+		if platform == "scholar":
+			import google_scholar_pubs_per_institution as module
+		elif platform == "researchgate":
+			import researchGate_reads_citations_per_institution as module
+		else:
+			import academiaEdu_school_reads_profileViews as module
+		_modules[platform] = module
+
+	return _modules[platform]
+
+
+
+def seed_tasks (platforms):
+	'''
+	The first tasks of a crawl: the first page of every school.
+
+	Parameters
+	----------
+	platforms : iterable
+		The platforms to crawl.
+
+	Returns
+	-------
+	list
+		`(kind, payload)` tuples.
+	'''
+
+	tasks = []
+	if "scholar" in platforms:
+		gs = platform_module("scholar")
+		for school in gs.SCHOOLS:
+			tasks.append(("scholar_results", {
+				"url": f"{gs.SCHOLAR_URL}/citations?view_op=search_authors&hl=en&mauthors={school}",
+				"school": school.split(".")[0].upper()}))
+
+	if "researchgate" in platforms:
+		rg = platform_module("researchgate")
+		# Schools without a page aren't in ResearchGate
+		tasks.extend(("researchgate_members", {"url": school_page, "school": school})
+			for school, school_page in zip(rg.SCHOOLS, rg.SCHOOL_PAGES) if school_page != "")
+
+	if "academia" in platforms:
+		academia = platform_module("academia")
+		for school, school_page in zip(academia.SCHOOLS, academia.SCHOOL_PAGES):
+			# Schools that are departments (or a list of them) already give\
+			# us their pages of documents and members
+			if type(school_page) == list or "ipp.academia.edu" in school_page:
+				pages = school_page if type(school_page) == list else [school_page]
+				tasks.extend(academia_page_tasks(school, [page+"/Documents" for page in pages], pages))
+			else:
+				tasks.append(("academia_school", {"url": school_page, "school": school}))
+
+	return tasks
+
+
+
+def academia_page_tasks (school, docs_pages, members_pages):
+	'''
+	The tasks for the pages of documents and of members of a school's
+	departments on Academia.edu.
+	'''
+
+	return ([("academia_documents", {"url": page, "school": school}) for page in docs_pages] +
+		[("academia_members", {"url": page, "school": school}) for page in members_pages])
+
+
+
+@contextmanager
+def keep_leased (open_queue, task, worker, lease):
+	'''
+	Renew the lease of a task in the background while it's being done (in a
+	`with` statement), so that slow tasks aren't given to other workers.
+
+	Parameters
+	----------
+	open_queue : callable
+		Function that opens a new connection to the queue (the renewals are
+		made from another thread).
+	task : work_queue.Task
+		The task.
+	worker : str
+		The name of the worker.
+	lease : float
+		Seconds of each lease.
+	'''
+
+	done = threading.Event()
+
+	def renew ():
+		queue = open_queue()
+		try:
+			# Renew well before the lease expires, and stop if the task was\
+			# given to someone else meanwhile
+			while not done.wait(lease / 3):
+				if not queue.renew(task, worker, lease):
+					break
+		finally:
+			queue.close()
+
+	renewer = threading.Thread(target=renew, daemon=True)
+	renewer.start()
+	try:
+		yield
+	finally:
+		done.set()
+		renewer.join()
+
+
+
+class Worker (object):
+	'''
+	Does the tasks of a queue, one at a time.
+
+	Parameters
+	----------
+	queue : work_queue.QueueBackend
+		The queue.
+	name : str
+		The name of the worker (unique among the workers of the queue).
+	platforms : iterable
+		The platforms whose tasks the worker claims.
+	cache_dir : str, optional
+		The directory of the page cache, if the cache is used.
+	cookies_path : str
+		The file with the ResearchGate session shared by every worker.
+	batches : bool
+		Whether to sum Academia.edu's reads and views from the JSON batch
+		endpoints (rendering the pages only if that fails).
+	'''
+
+	def __init__(self, queue, name, platforms, cache_dir=None, cookies_path="researchGate_cookies.json", batches=False):
+		self.queue = queue
+		self.name = name
+		self.kinds = [kind for platform in platforms for kind in PLATFORM_KINDS[platform]]
+		self.cache_dir = cache_dir
+		self.cookies_path = cookies_path
+		self.batches = batches
+		# Backends of each platform, created when their first task comes.\
+		# Their requests follow the limits of each site, and blocked pages\
+		# go back to the queue
+		self._backends = {}
+		self.limiter = RateLimiter()
+		# The tasks found are queued longest first (with the initial\
+		# estimates, until the coordinator corrects them)
+		self.scheduler = Scheduler(None, discovery_kinds=DISCOVERY_KINDS)
+		self.handlers = {
+			"scholar_results": self.scholar_results,
+			"scholar_profile": self.scholar_profile,
+			"researchgate_members": self.researchgate_members,
+			"researchgate_profile": self.researchgate_profile,
+			"academia_school": self.academia_school,
+			"academia_members": self.academia_members,
+			"academia_documents": self.academia_documents
+		}
+
+
+	def _cached (self, backend, session=None):
+		if self.cache_dir is None:
+			return backend
+		return CachedBackend(backend, ResponseCache(self.cache_dir), session=session)
+
+
+	def backend (self, platform):
+		'''
+		The backend used to fetch the pages of a platform.
+		'''
+
+		if platform not in self._backends:
+			module = platform_module(platform)
+			if platform == "scholar":
+				self._backends[platform] = self._cached(FallbackBackend(ThrottledBackend(HttpBackend(), self.limiter),
+					ThrottledBackend(SeleniumBackend(module.pool), self.limiter)))
+			elif platform == "researchgate":
+				# The worker process' driver and backend, logged in with the\
+				# shared session
+				import researchGate_id
+				module.init_worker(researchGate_id.user, researchGate_id.password, "http",
+					self.cache_dir, self.cookies_path)
+				self._backends[platform] = module.worker_backend
+			else:
+				self._backends[platform] = self._cached(ThrottledBackend(HttpBackend(), self.limiter))
+
+		return self._backends[platform]
+
+
+	def scholar_results (self, payload):
+		gs = platform_module("scholar")
+		root = self.backend("scholar").fetch(payload["url"]).root
+		school = payload["school"]
+		children = [("scholar_profile", {"url": profile, "school": school, "cited_by": cited_by})
+			for profile, cited_by in gs.parse_page_cards(root)]
+		next_page = gs.parse_next_page_url(root)
+		if next_page is not None:
+			children.append(("scholar_results", {"url": next_page, "school": school}))
+
+		return ({"authors": gs.parse_page_authors(root)}, children)
+
+
+	def scholar_profile (self, payload):
+		gs = platform_module("scholar")
+
+		return ({"metrics": gs.scrape_author_profile(payload["url"], backend=self.backend("scholar"))}, [])
+
+
+	def researchgate_members (self, payload):
+		rg = platform_module("researchgate")
+		self.backend("researchgate")
+		user_urls, names = rg.profiles_task(payload["url"])
+		children = [("researchgate_profile", {"url": profile, "school": payload["school"]}) for profile in user_urls]
+
+		return ({"names": names}, children)
+
+
+	def researchgate_profile (self, payload):
+		rg = platform_module("researchgate")
+		# Profiles are fetched with the worker's backend (which loads the\
+		# pages that need it in a logged in browser)
+		backend = self.backend("researchgate")
+		scraped = []
+		rg.get_school_reads_citations([payload["url"]], driver=rg.worker_driver, backend=backend,
+			on_profile=lambda *metrics: scraped.append(metrics), skip_blocked=False)
+		# Profiles without reads and citations have no metrics
+		metrics = {"reads": scraped[0][1], "citations": scraped[0][2]} if scraped else None
+
+		return ({"metrics": metrics}, [])
+
+
+	def academia_school (self, payload):
+		academia = platform_module("academia")
+		docs_pages, members_pages = academia.get_docs_profiles_pages(payload["url"], backend=self.backend("academia"))
+
+		return ({}, academia_page_tasks(payload["school"], docs_pages, members_pages))
+
+
+	def academia_members (self, payload):
+		academia = platform_module("academia")
+		backend = self.backend("academia")
+		views = academia.try_batched(payload["url"], academia.MEMBERS_BATCH_URL, backend) if self.batches else None
+		if views is None:
+			views = academia.count_views(payload["url"], backend=backend)
+
+		return ({"metrics": {"views": views}}, [])
+
+
+	def academia_documents (self, payload):
+		academia = platform_module("academia")
+		reads = academia.try_batched(payload["url"], academia.DOCUMENTS_BATCH_URL, self.backend("academia")) if self.batches else None
+		# The documents are loaded by scrolling, so they need the browser
+		if reads is None:
+			if getattr(academia, "driver", None) is None:
+				academia.driver = new_driver()
+			reads = academia.count_reads(payload["url"])
+
+		return ({"metrics": {"reads": reads}}, [])
+
+
+	def do (self, task):
+		'''
+		Do a task.
+
+		Returns
+		-------
+		(result, children) : tuple
+			The result of the task (with the seconds it took) and the new
+			tasks found while doing it, with their priorities.
+		'''
+
+		start = time.perf_counter()
+		result, children = self.handlers[task.kind](task.payload)
+		result["seconds"] = time.perf_counter() - start
+
+		return (result, self.scheduler.prioritized(children))
+
+
+	def close (self):
+		for backend in self._backends.values():
+			backend.close()
+		academia = _modules.get("academia")
+		if getattr(academia, "driver", None) is not None:
+			academia.driver.quit()
+		if "scholar" in _modules:
+			_modules["scholar"].pool.close()
+
+
+
+def run_worker (queue, worker, open_queue, lease=300, poll=5):
+	'''
+	Claim and do tasks until the queue has nothing left to do.
+
+	Parameters
+	----------
+	queue : work_queue.QueueBackend
+		The queue.
+	worker : Worker
+		The worker.
+	open_queue : callable
+		Function that opens a new connection to the queue.
+	lease : float
+		Seconds of each lease.
+	poll : float
+		Seconds to wait before asking again when there's nothing to claim.
+
+	Returns
+	-------
+	int
+		The number of tasks done.
+	'''
+
+	done = 0
+	while True:
+		task = queue.claim(worker.name, lease=lease, kinds=worker.kinds)
+		if task is None:
+			# Stop once every task of our platforms was done (but not before\
+			# the coordinator has put the first ones in the queue), and\
+			# otherwise wait for the tasks still leased to other workers,\
+			# which may add new ones or come back to the queue
+			counts = queue.counts(worker.kinds)
+			if sum(counts.values()) > 0 and counts[PENDING] == 0 and counts[LEASED] == 0:
+				return done
+			time.sleep(poll)
+			continue
+
+		try:
+			with keep_leased(open_queue, task, worker.name, lease):
+				result, children = worker.do(task)
+		except KeyboardInterrupt:
+			# Give the task back right away instead of waiting for the lease
+			queue.release(task, worker.name)
+			raise
+		# Being blocked says nothing about the task, so it goes back to the\
+		# queue as it was (the site is paused by our limiter meanwhile)
+		except BlockedError as error:
+			print("Blocked", task, "-", error.reason)
+			queue.release(task, worker.name)
+			continue
+		except Exception as error:
+			print("Failed", task, "-", repr(error))
+			queue.fail(task, worker.name, repr(error))
+			continue
+
+		if queue.complete(task, worker.name, result, children):
+			done += 1
+		else:
+			print("Lost the lease of", task)
+
+
+
+def run_coordinator (queue, platforms, store, identities, poll=5):
+	'''
+	Seed the queue with the first pages of every school, and keep the
+	metrics reported by the workers until the queue has nothing left to do.
+	Meanwhile, the tasks waiting in the queue are kept in order from the
+	longest to the shortest, as estimated from the metrics of previous runs
+	and from the timings reported by the workers.
+
+	Parameters
+	----------
+	queue : work_queue.QueueBackend
+		The queue.
+	platforms : iterable
+		The platforms to crawl.
+	store : metrics_store.MetricsStore
+		Where the metrics of every profile are kept.
+	identities : identity_index.IdentityIndex
+		Where the authors found are linked.
+	poll : float
+		Seconds between checks of the queue.
+
+	Returns
+	-------
+	dict
+		Dictionary of the type `platform: {school: {metric: total}}`.
+	'''
+
+	scheduler = Scheduler(queue, store, discovery_kinds=DISCOVERY_KINDS, platforms=KIND_PLATFORM)
+	added = queue.put_many(scheduler.prioritized(seed_tasks(platforms)))
+	print("Queued", added, "new tasks.")
+
+	totals = {platform: {} for platform in platforms}
+	last_number = 0
+	last_counts = None
+	while True:
+		# The counts are taken before the results, so that nothing done\
+		# in between is missed when the queue turns out to be empty
+		counts = queue.counts()
+		for number, kind, payload, result in queue.results(after=last_number):
+			last_number = number
+			platform = KIND_PLATFORM[kind]
+			school = payload["school"]
+			if kind == "scholar_results":
+				identities.link_many("scholar", result["authors"], school)
+			elif kind == "researchgate_members":
+				identities.link_many("researchgate", result["names"].items(), school)
+			elif kind in METRIC_KINDS and result["metrics"] is not None:
+				scheduler.observe(kind, payload, result["metrics"], result["seconds"])
+				fingerprint = str(payload["cited_by"]) if "cited_by" in payload else None
+				store.save(platform, school, payload["url"], result["metrics"], fingerprint)
+				school_totals = totals.setdefault(platform, {}).setdefault(school, {})
+				for metric, value in result["metrics"].items():
+					if value is not None:
+						school_totals[metric] = school_totals.get(metric, 0) + value
+
+		if counts != last_counts:
+			print(", ".join(f"{number} {state}" for state, number in counts.items()))
+			last_counts = counts
+		if counts[PENDING] == 0 and counts[LEASED] == 0:
+			return totals
+
+		# Reorder the tasks found since the last check (and every task, if\
+		# the estimates changed enough)
+		scheduler.rebalance()
+		time.sleep(poll)
+
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Crawl the platforms with several workers sharing a work queue.")
+	parser.add_argument("role", choices=["coordinator", "worker"],
+		help="seed the queue and collect the metrics, or do the tasks of the queue")
+	parser.add_argument("--queue", default="work_queue.sqlite3",
+		help="SQLite file of the queue shared by the coordinator and the workers")
+	parser.add_argument("--platforms", nargs="+", choices=list(PLATFORM_KINDS), default=list(PLATFORM_KINDS),
+		help="platforms to crawl (coordinator) or whose tasks to claim (worker)")
+	parser.add_argument("--lease", type=float, default=300,
+		help="seconds a task stays claimed by a worker that stops renewing it")
+	parser.add_argument("--max-attempts", type=int, default=3,
+		help="times a task is tried before it's set aside as failed")
+	parser.add_argument("--poll", type=float, default=5,
+		help="seconds between checks of the queue")
+	parser.add_argument("--worker-name", default=f"{socket.gethostname()}-{os.getpid()}",
+		help="name of the worker (unique among the workers)")
+	parser.add_argument("--store", default="metrics.sqlite3",
+		help="SQLite file where the coordinator keeps the metrics of every profile (and the identities of the authors)")
+	parser.add_argument("--cache", default="page_cache",
+		help="directory of the on-disk cache of fetched pages")
+	parser.add_argument("--no-cache", action="store_true",
+		help="always fetch pages from the network")
+	parser.add_argument("--cookies", default="researchGate_cookies.json",
+		help="file where the ResearchGate session is saved, so that we log in only once (even across workers)")
+	parser.add_argument("--batches", action="store_true",
+		help="sum Academia.edu's reads and views from the site's JSON batch endpoints when possible")
+	parser.add_argument("--browser", choices=PROFILES, default="lean",
+		help="profile of the browsers: lean (headless, without images, fonts or trackers) or full (a normal window)")
+	args = parser.parse_args()
+	set_default_profile(args.browser)
+
+	def open_queue ():
+		return SQLiteQueue(args.queue, max_attempts=args.max_attempts)
+
+	queue = open_queue()
+
+	if args.role == "worker":
+		worker = Worker(queue, args.worker_name, args.platforms, None if args.no_cache else args.cache,
+			args.cookies, args.batches)
+		try:
+			print(args.worker_name, "did", run_worker(queue, worker, open_queue, args.lease, args.poll), "tasks.")
+		finally:
+			worker.close()
+
+	else:
+		store = MetricsStore(args.store)
+		identities = IdentityIndex(args.store)
+		totals = run_coordinator(queue, args.platforms, store, identities, args.poll)
+		for platform, schools in totals.items():
+			for school, metrics in schools.items():
+				print(f"{platform} - {school}: " + ", ".join(f"{number} {metric}" for metric, number in metrics.items()))
+		# Don't let failed pages go unnoticed
+		for kind, payload, error in queue.failures():
+			print("Failed to scrape", payload["url"], f"({kind}) -", error)
+		store.close()
+		identities.close()
+
+	queue.close()
\ No newline at end of file
@@ -0,0 +1,255 @@
+'''
+File with a small pool of long-lived Selenium drivers that the scraping
+scripts can share, instead of starting a new Google Chrome window for every
+single page they visit.
+
+Starting a browser is by far the slowest step of a scraping run, so the pool
+keeps a few warm drivers around, hands them out on request and only replaces
+them when they stop responding or after they have loaded a given number of
+pages (long-lived browsers tend to leak memory).
+'''
+
+from contextlib import contextmanager
+import threading
+
+from selenium import webdriver
+
+import tracing
+
+
+# Seconds a driver waits for elements that aren't in the page yet (see also\
+# `element_lookup`)
+IMPLICIT_WAIT = 10
+
+# Browser profiles `new_driver` can start: "lean" (headless, small window,\
+# without images, fonts, extensions or trackers) and "full" (a normal,\
+# visible browser, handy to watch what a script is doing)
+PROFILES = ("lean", "full")
+# Profile used when none is given
+default_profile = "lean"
+
+# Size of the window of lean browsers. Big enough for the sites to use their\
+# desktop layout, small enough to keep the rendering cheap
+LEAN_WINDOW_SIZE = (1280, 800)
+
+# Requests blocked in lean browsers: images, fonts, media and the usual\
+# analytics and ad hosts. Stylesheets and scripts are kept, since the sites\
+# need them to lay out and load their content (like Academia.edu's infinite\
+# scroll)
+BLOCKED_URLS = [
+	"*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+	"*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+	"*.mp4", "*.webm", "*.mp3",
+	"*google-analytics.com*", "*googletagmanager.com*", "*googlesyndication.com*", "*doubleclick.net*",
+	"*facebook.net*", "*hotjar.com*", "*scorecardresearch.com*", "*quantserve.com*"
+]
+
+
+
+def set_default_profile (profile):
+	'''
+	Change the profile of the browsers started without an explicit one
+	(like the ones of the pools).
+
+	Parameters
+	----------
+	profile : str
+		One of `PROFILES`.
+	'''
+
+	global default_profile
+	if profile not in PROFILES:
+		raise ValueError(f"Unknown browser profile: {profile}")
+	default_profile = profile
+
+
+
+def new_driver (profile=None):
+	'''
+	Create a new Google Chrome driver configured the way the scripts expect.
+
+	Parameters
+	----------
+	profile : str, optional
+		One of `PROFILES`. Defaults to `default_profile`.
+
+	Returns
+	-------
+	driver : selenium.webdriver.Chrome
+		A freshly started driver that waits up to 10 seconds when looking
+		for elements.
+	'''
+
+	profile = default_profile if profile is None else profile
+	if profile not in PROFILES:
+		raise ValueError(f"Unknown browser profile: {profile}")
+
+	options = webdriver.ChromeOptions()
+	if profile == "lean":
+		options.add_argument("--headless=new")
+		options.add_argument("--window-size={},{}".format(*LEAN_WINDOW_SIZE))
+		options.add_argument("--disable-extensions")
+		options.add_argument("--disable-gpu")
+		options.add_argument("--disable-dev-shm-usage")
+		options.add_argument("--no-first-run")
+		options.add_argument("--mute-audio")
+		# Don't even download images (the blocked URLs below miss the ones\
+		# without an extension)
+		options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+
+	# We'll use Google Chrome
+	driver = webdriver.Chrome(options=options)
+
+	if profile == "lean":
+		# Block the requests we don't need through the DevTools protocol
+		driver.execute_cdp_cmd("Network.enable", {})
+		driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+
+	# Make the driver wait 10 seconds
+	driver.implicitly_wait(IMPLICIT_WAIT)
+
+	return driver
+
+
+
+class DriverPool (object):
+	'''
+	A pool of warm Selenium drivers.
+
+	Drivers are created lazily (only when there's no idle driver available)
+	and are reused across calls until they fail a health check or have
+	served `max_pages` pages, at which point they are quit and replaced.
+
+	Parameters
+	----------
+	factory : callable
+		Function with no arguments that returns a new driver.
+	size : int
+		Maximum number of drivers alive at the same time.
+	max_pages : int
+		Number of leases after which a driver is recycled. Each lease is
+		counted as one page, since every scraping function loads a single
+		URL per lease.
+	'''
+
+	def __init__(self, factory=new_driver, size=1, max_pages=50):
+		self.factory = factory
+		self.size = size
+		self.max_pages = max_pages
+		# Drivers waiting to be handed out
+		self._idle = []
+		# Number of pages served by each live driver (keyed by `id(driver)`)
+		self._pages = {}
+		# Semaphore so that no more than `size` drivers are leased at once
+		self._slots = threading.BoundedSemaphore(size)
+		self._lock = threading.Lock()
+
+
+	def _is_healthy (self, driver):
+		'''
+		Check if a driver still responds to commands.
+		'''
+
+		# Any WebDriver command will do; if the browser crashed or the\
+		# session was closed this raises an exception
+		try:
+			driver.current_url
+			return True
+		except:
+			return False
+
+
+	def _discard (self, driver):
+		'''
+		Quit a driver and forget about it.
+		'''
+
+		self._pages.pop(id(driver), None)
+		try:
+			driver.quit()
+		except:
+			pass
+
+
+	def _take (self):
+		'''
+		Get an idle, healthy driver, or create a new one if there's none.
+		'''
+
+		while True:
+			with self._lock:
+				driver = self._idle.pop() if self._idle else None
+			# No idle drivers left, so start a new one
+			if driver is None:
+				with tracing.phase("browser_start"):
+					driver = self.factory()
+				with self._lock:
+					self._pages[id(driver)] = 0
+				return driver
+			# Reuse the idle driver only if it's still alive
+			if self._is_healthy(driver):
+				return driver
+			self._discard(driver)
+
+
+	def _give_back (self, driver, broken=False):
+		'''
+		Return a driver to the pool, recycling it if needed.
+		'''
+
+		with self._lock:
+			self._pages[id(driver)] = self._pages.get(id(driver), 0) + 1
+			worn_out = self._pages[id(driver)] >= self.max_pages
+		# Drivers that raised an error or served too many pages are replaced\
+		# by a fresh one the next time a driver is needed
+		if broken or worn_out:
+			self._discard(driver)
+		else:
+			with self._lock:
+				self._idle.append(driver)
+
+
+	@contextmanager
+	def acquire (self):
+		'''
+		Lease a driver for the duration of a `with` block.
+
+		Yields
+		------
+		driver : selenium.webdriver.Chrome
+			A warm driver. It is returned to the pool when the block exits.
+		'''
+
+		self._slots.acquire()
+		try:
+			driver = self._take()
+			try:
+				yield driver
+			except:
+				# Don't trust a driver that was in use when something went\
+				# wrong (it may be stuck in a half-loaded page)
+				self._give_back(driver, broken=not self._is_healthy(driver))
+				raise
+			else:
+				self._give_back(driver)
+		finally:
+			self._slots.release()
+
+
+	def close (self):
+		'''
+		Quit every idle driver in the pool.
+		'''
+
+		with self._lock:
+			idle, self._idle = self._idle, []
+		for driver in idle:
+			self._discard(driver)
+
+
+	def __enter__ (self):
+		return self
+
+
+	def __exit__ (self, *exc_info):
+		self.close()
@@ -0,0 +1,134 @@
+'''
+File with the two ways the scripts look for elements in a page open in a
+driver: waiting until an element shows up, or checking right now whether it's
+there.
+
+Every driver waits up to `IMPLICIT_WAIT` seconds when looking for elements,
+which is what we want right after loading a page, but not when an element
+may legitimately be missing (the "next page" link in the last page, the
+counter of publications of an author without any...): then every miss costs
+the whole wait. The `*_now` functions turn the implicit wait off for a single
+lookup, and `wait_for` waits explicitly, so the intent is clear at each call.
+'''
+
+from contextlib import contextmanager
+
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+from driver_pool import IMPLICIT_WAIT
+
+
+
+@contextmanager
+def no_implicit_wait (driver):
+	'''
+	Turn off the implicit wait of a driver inside a `with` statement.
+	'''
+
+	# Selenium 4 can tell us the current wait; older versions can't, but\
+	# then it's the one every driver is created with
+	try:
+		previous = driver.timeouts.implicit_wait
+	except Exception:
+		previous = IMPLICIT_WAIT
+	driver.implicitly_wait(0)
+	try:
+		yield driver
+	finally:
+		driver.implicitly_wait(previous)
+
+
+
+def find_all_now (driver, by, value, scope=None):
+	'''
+	Find the elements that are in the page right now, without waiting.
+
+	Parameters
+	----------
+	driver : selenium.webdriver.Chrome
+		The driver.
+	by : str
+		How to find the elements (a `selenium.webdriver.common.by.By`).
+	value : str
+		The id, class name, tag... of the elements.
+	scope : selenium.webdriver.remote.webelement.WebElement, optional
+		Only look inside this element.
+
+	Returns
+	-------
+	list
+		The elements found (maybe none).
+	'''
+
+	with no_implicit_wait(driver):
+		return (scope or driver).find_elements(by, value)
+
+
+
+def find_now (driver, by, value, scope=None):
+	'''
+	Like `find_all_now`, but for a single element.
+
+	Returns
+	-------
+	selenium.webdriver.remote.webelement.WebElement
+		The first element found, or `None` if there's none.
+	'''
+
+	elems = find_all_now(driver, by, value, scope)
+
+	return elems[0] if elems else None
+
+
+
+def is_present (driver, by, value, scope=None):
+	'''
+	Check, without waiting, if there's an element in the page.
+	'''
+
+	return len(find_all_now(driver, by, value, scope)) > 0
+
+
+
+def wait_for (driver, by, value, timeout=IMPLICIT_WAIT):
+	'''
+	Wait until an element is in the page.
+
+	Parameters
+	----------
+	driver : selenium.webdriver.Chrome
+		The driver.
+	by : str
+		How to find the element (a `selenium.webdriver.common.by.By`).
+	value : str
+		The id, class name, tag... of the element.
+	timeout : float
+		Maximum number of seconds to wait.
+
+	Returns
+	-------
+	selenium.webdriver.remote.webelement.WebElement
+		The element.
+
+	Raises
+	------
+	selenium.common.exceptions.TimeoutException
+		If the element didn't show up in time.
+	'''
+
+	# The explicit wait polls on its own, so the implicit one would only\
+	# make each poll slower
+	with no_implicit_wait(driver):
+		return WebDriverWait(driver, timeout).until(EC.presence_of_element_located((by, value)))
+
+
+
+def wait_for_all (driver, by, value, timeout=IMPLICIT_WAIT):
+	'''
+	Like `wait_for`, but return every matching element once there's at
+	least one.
+	'''
+
+	with no_implicit_wait(driver):
+		return WebDriverWait(driver, timeout).until(EC.presence_of_all_elements_located((by, value)))
@@ -0,0 +1,153 @@
+'''
+File with the pieces needed to extract information from the source of a page
+with several alternative strategies.
+
+Sites like ResearchGate change their HTML every now and then, so the same
+information can be in different places depending on the page. Instead of
+asking the browser for one element after the other (each a round trip, and a
+10 second wait when it isn't there), we grab the page's source once, parse it
+and try a registry of strategies locally. The strategy that worked last is
+tried first the next time, since pages fetched close together almost always
+share the same layout.
+'''
+
+import re
+import threading
+
+
+# A single step of a path like "div[2]"
+_STEP = re.compile(r"^([a-z0-9]+|\*)(?:\[(\d+)\])?$")
+
+
+def compile_path (path):
+	'''
+	Compile a simple XPath-like path of child elements, like
+	"div/div/div[2]/div[1]", so that it can be followed many times without
+	being parsed again.
+
+	Parameters
+	----------
+	path : str
+		Steps separated by "/". Each step is a tag name (or "*") with an
+		optional 1-based position among the siblings with that tag.
+
+	Returns
+	-------
+	tuple
+		The compiled steps, as `(tag, index)` tuples (`index` is 0-based).
+	'''
+
+	steps = []
+	for step in path.strip("/").split("/"):
+		match = _STEP.match(step)
+		if match is None:
+			raise ValueError(f"Invalid path step: {step!r}")
+		tag, position = match.groups()
+		steps.append((tag, int(position) - 1 if position else 0))
+
+	return tuple(steps)
+
+
+
+def select_path (elem, steps):
+	'''
+	Follow a compiled path from an element.
+
+	Parameters
+	----------
+	elem : fetch_backend.Element
+		The element where the path starts.
+	steps : tuple
+		A path compiled with `compile_path`.
+
+	Returns
+	-------
+	fetch_backend.Element
+		The element at the end of the path, or `None` if there's none.
+	'''
+
+	for tag, index in steps:
+		if elem is None:
+			return None
+		children = [child for child in elem.children
+			if not isinstance(child, str) and (tag == "*" or child.tag == tag)]
+		elem = children[index] if index < len(children) else None
+
+	return elem
+
+
+
+class StrategyRegistry (object):
+	'''
+	A list of alternative strategies to extract the same information from a
+	parsed page.
+
+	A strategy is a function that receives the root of the parsed page and
+	returns the extracted value, or raises an exception (or returns `None`)
+	if the page doesn't have the layout it expects.
+	'''
+
+	def __init__(self):
+		# `(name, function)` tuples, in the order they are tried
+		self._strategies = []
+		# Number of times each strategy was the one that worked
+		self.wins = {}
+		self._lock = threading.Lock()
+
+
+	def register (self, name):
+		'''
+		Decorator that adds a strategy to the registry.
+
+		Parameters
+		----------
+		name : str
+			Name of the strategy (to know which one worked).
+		'''
+
+		def decorator (function):
+			self._strategies.append((name, function))
+			self.wins[name] = 0
+			return function
+
+		return decorator
+
+
+	def extract (self, root):
+		'''
+		Try the strategies until one of them works.
+
+		Parameters
+		----------
+		root : fetch_backend.Element
+			The parsed page.
+
+		Returns
+		-------
+		(name, value) : tuple
+			The name of the strategy that worked and the value it extracted,
+			or `(None, None)` if none of them worked.
+		'''
+
+		with self._lock:
+			strategies = list(self._strategies)
+
+		for i, (name, function) in enumerate(strategies):
+			try:
+				value = function(root)
+			except Exception:
+				value = None
+			if value is None:
+				continue
+
+			with self._lock:
+				self.wins[name] += 1
+				# Move the winning strategy to the front, so that it's tried\
+				# first the next time
+				if i > 0:
+					self._strategies.remove((name, function))
+					self._strategies.insert(0, (name, function))
+
+			return (name, value)
+
+		return (None, None)
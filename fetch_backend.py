@@ -0,0 +1,547 @@
+'''
+File with the pieces needed to scrape pages without opening a browser.
+
+Most of the information the scripts read (Google Scholar's profile cards and
+citation tables, ResearchGate's member lists, Academia.edu's member pages) is
+already in the HTML sent by the server, so rendering it in Google Chrome is
+wasted work. This file offers:
+
+* a tiny HTML parser that builds a tree of `Element`s which can be searched by
+  id, class and tag (similar to what we do with Selenium);
+* `HttpBackend`, which downloads pages over pooled keep-alive connections;
+* `SeleniumBackend`, which loads pages in a (pooled) browser for the few cases
+  where JavaScript is really needed;
+* `FallbackBackend`, which tries one backend and falls back to another.
+
+Every backend has a `fetch(url)` method returning a `Page`.
+'''
+
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, urljoin
+import http.client
+import threading
+import gzip
+import zlib
+
+import tracing
+
+
+# Tags that never have a closing tag, and thus never have children
+VOID_TAGS = {
+	"area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+	"meta", "param", "source", "track", "wbr"
+}
+
+# Headers sent with every request made by `HttpBackend`
+DEFAULT_HEADERS = {
+	"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/73.0.3683.68 Safari/537.36",
+	"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+	"Accept-Language": "en-US,en;q=0.9",
+	"Accept-Encoding": "gzip, deflate",
+	"Connection": "keep-alive"
+}
+
+# Status codes of the redirects followed by `HttpBackend`
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Status codes of the pages a browser may get past (bot checks, JavaScript\
+# challenges, rate limits), which `FallbackBackend` fetches again. Other\
+# errors (like 404 or 410) are the site's real answer, and a browser\
+# would only get them again, much slower
+FALLBACK_STATUSES = (403, 429, 503)
+
+
+
+class TooManyRedirects (http.client.HTTPException):
+	'''
+	Raised when a page redirects more times than a backend follows (it's an
+	`HTTPException`, so `FallbackBackend` tries its fallback instead).
+	'''
+
+
+
+class Element (object):
+	'''
+	A single HTML element of a parsed page.
+
+	Parameters
+	----------
+	tag : str
+		The name of the tag, in lower case.
+	attrs : dict
+		The attributes of the element.
+	parent : Element
+		The element that contains this one (`None` for the root).
+	'''
+
+	__slots__ = ("tag", "attrs", "parent", "children", "_text")
+
+	def __init__(self, tag, attrs=None, parent=None):
+		self.tag = tag
+		self.attrs = attrs or {}
+		self.parent = parent
+		# Child elements and strings, in document order
+		self.children = []
+		self._text = None
+
+
+	def get_attribute (self, name):
+		'''
+		Return the value of an attribute, or `None` if it's not set.
+		'''
+
+		return self.attrs.get(name)
+
+
+	@property
+	def classes (self):
+		'''
+		The list of classes of the element.
+		'''
+
+		return (self.attrs.get("class") or "").split()
+
+
+	@property
+	def text (self):
+		'''
+		All the text inside the element, with whitespace collapsed (like
+		Selenium's `WebElement.text`).
+		'''
+
+		if self._text is None:
+			parts = []
+			stack = [self]
+			# Walk the tree depth-first, in document order
+			while stack:
+				node = stack.pop()
+				if isinstance(node, str):
+					parts.append(node)
+				elif node.tag not in ("script", "style"):
+					stack.extend(reversed(node.children))
+			self._text = " ".join(" ".join(parts).split())
+
+		return self._text
+
+
+	def iter (self):
+		'''
+		Iterate over every element under this one, in document order.
+		'''
+
+		stack = [child for child in reversed(self.children) if not isinstance(child, str)]
+		while stack:
+			node = stack.pop()
+			yield node
+			stack.extend(child for child in reversed(node.children) if not isinstance(child, str))
+
+
+	def find_all (self, tag=None, class_name=None, id=None):
+		'''
+		Find all the elements under this one that match every given
+		criterion.
+
+		Parameters
+		----------
+		tag : str, optional
+			Name of the tag.
+		class_name : str, optional
+			One of the classes of the element.
+		id : str, optional
+			The id of the element.
+
+		Returns
+		-------
+		list
+			The matching elements, in document order.
+		'''
+
+		found = []
+		for elem in self.iter():
+			if tag is not None and elem.tag != tag:
+				continue
+			if id is not None and elem.attrs.get("id") != id:
+				continue
+			if class_name is not None and class_name not in elem.classes:
+				continue
+			found.append(elem)
+
+		return found
+
+
+	def find (self, tag=None, class_name=None, id=None):
+		'''
+		Like `find_all`, but return only the first match (or `None`).
+		'''
+
+		for elem in self.iter():
+			if tag is not None and elem.tag != tag:
+				continue
+			if id is not None and elem.attrs.get("id") != id:
+				continue
+			if class_name is not None and class_name not in elem.classes:
+				continue
+			return elem
+
+		return None
+
+
+	def __repr__ (self):
+		return f"<Element {self.tag} {self.attrs}>"
+
+
+
+class _TreeBuilder (HTMLParser):
+	'''
+	Parser that turns an HTML string into a tree of `Element`s.
+	'''
+
+	def __init__(self):
+		super().__init__(convert_charrefs=True)
+		self.root = Element("#document")
+		self._stack = [self.root]
+
+
+	def handle_starttag (self, tag, attrs):
+		parent = self._stack[-1]
+		elem = Element(tag, {name: (value if value is not None else "") for name, value in attrs}, parent)
+		parent.children.append(elem)
+		# Void elements can't contain anything, so don't descend into them
+		if tag not in VOID_TAGS:
+			self._stack.append(elem)
+
+
+	def handle_startendtag (self, tag, attrs):
+		parent = self._stack[-1]
+		parent.children.append(Element(tag, {name: (value if value is not None else "") for name, value in attrs}, parent))
+
+
+	def handle_endtag (self, tag):
+		# Real-world HTML often forgets to close tags, so close everything\
+		# up to the matching open tag (and ignore stray closing tags)
+		for i in range(len(self._stack) - 1, 0, -1):
+			if self._stack[i].tag == tag:
+				del self._stack[i:]
+				break
+
+
+	def handle_data (self, data):
+		self._stack[-1].children.append(data)
+
+
+
+def parse_html (source):
+	'''
+	Parse an HTML string.
+
+	Parameters
+	----------
+	source : str
+		The HTML source code of a page.
+
+	Returns
+	-------
+	root : Element
+		The (artificial) root element of the document.
+	'''
+
+	with tracing.phase("parse"):
+		builder = _TreeBuilder()
+		builder.feed(source)
+		builder.close()
+
+	return builder.root
+
+
+
+class Page (object):
+	'''
+	A fetched page.
+
+	Parameters
+	----------
+	url : str
+		The final URL of the page (after following redirects).
+	status : int
+		The HTTP status code of the response.
+	html : str
+		The HTML source of the page.
+	headers : http.client.HTTPMessage, optional
+		The headers of the response (if there was one).
+	'''
+
+	def __init__(self, url, status, html, headers=None):
+		self.url = url
+		self.status = status
+		self.html = html
+		self.headers = headers
+		self._root = None
+
+
+	@property
+	def root (self):
+		'''
+		The parsed document (parsed only when first needed).
+		'''
+
+		if self._root is None:
+			self._root = parse_html(self.html)
+
+		return self._root
+
+
+
+class HttpBackend (object):
+	'''
+	Fetch pages with plain HTTP requests, reusing connections.
+
+	Connections are kept alive and pooled per host, so a run that reads
+	hundreds of pages from the same site only opens a handful of them.
+
+	Parameters
+	----------
+	headers : dict, optional
+		Extra headers to send with every request.
+	timeout : float
+		Seconds to wait for the server before giving up.
+	max_redirects : int
+		How many redirects to follow before giving up.
+	'''
+
+	def __init__(self, headers=None, timeout=30, max_redirects=5):
+		self.headers = dict(DEFAULT_HEADERS)
+		if headers:
+			self.headers.update(headers)
+		self.timeout = timeout
+		self.max_redirects = max_redirects
+		# Idle connections, keyed by `(scheme, host)`
+		self._idle = {}
+		self._lock = threading.Lock()
+
+
+	def _connect (self, scheme, host):
+		'''
+		Get an idle connection to the host, or open a new one.
+		'''
+
+		with self._lock:
+			conns = self._idle.get((scheme, host))
+			if conns:
+				return conns.pop()
+		if scheme == "https":
+			return http.client.HTTPSConnection(host, timeout=self.timeout)
+		return http.client.HTTPConnection(host, timeout=self.timeout)
+
+
+	def _release (self, scheme, host, conn):
+		'''
+		Put a connection back in the pool so it can be reused.
+		'''
+
+		with self._lock:
+			self._idle.setdefault((scheme, host), []).append(conn)
+
+
+	def _request (self, url, headers):
+		'''
+		Make a single GET request (no redirects).
+
+		Returns
+		-------
+		(status, response_headers, body) : tuple
+		'''
+
+		parts = urlsplit(url)
+		path = parts.path or "/"
+		if parts.query:
+			path += "?" + parts.query
+
+		# A pooled connection may have been closed by the server in the\
+		# meantime, so retry once with a brand new connection
+		for attempt in range(2):
+			conn = self._connect(parts.scheme, parts.netloc)
+			try:
+				conn.request("GET", path, headers=headers)
+				response = conn.getresponse()
+				body = response.read()
+			except (http.client.HTTPException, ConnectionError):
+				conn.close()
+				if attempt == 1:
+					raise
+				continue
+			# Only reuse the connection if the server allows it
+			if response.will_close:
+				conn.close()
+			else:
+				self._release(parts.scheme, parts.netloc, conn)
+			return response.status, response.headers, body
+
+
+	def fetch (self, url, headers=None):
+		'''
+		Download a page.
+
+		Parameters
+		----------
+		url : str
+			The URL of the page.
+		headers : dict, optional
+			Headers to send on top of the backend's own.
+
+		Returns
+		-------
+		page : Page
+			The downloaded page.
+
+		Raises
+		------
+		TooManyRedirects
+			If the page redirects more than `max_redirects` times.
+		'''
+
+		request_headers = dict(self.headers)
+		if headers:
+			request_headers.update(headers)
+
+		for _ in range(self.max_redirects + 1):
+			with tracing.phase("http_fetch", url=url):
+				status, response_headers, body = self._request(url, request_headers)
+			# Follow redirects
+			if status in REDIRECT_STATUSES and response_headers.get("Location"):
+				url = urljoin(url, response_headers["Location"])
+				continue
+			break
+		# Don't mistake the last redirect for the page
+		else:
+			raise TooManyRedirects(f"{url} redirected more than {self.max_redirects} times")
+
+		# Undo the compression, if the server used any
+		encoding = (response_headers.get("Content-Encoding") or "").lower()
+		if encoding == "gzip":
+			body = gzip.decompress(body)
+		elif encoding == "deflate":
+			body = zlib.decompress(body)
+
+		charset = response_headers.get_content_charset() or "utf-8"
+
+		return Page(url, status, body.decode(charset, errors="replace"), response_headers)
+
+
+	def close (self):
+		'''
+		Close every pooled connection.
+		'''
+
+		with self._lock:
+			idle, self._idle = self._idle, {}
+		for conns in idle.values():
+			for conn in conns:
+				conn.close()
+
+
+
+class SeleniumBackend (object):
+	'''
+	Fetch pages by rendering them in a browser.
+
+	Parameters
+	----------
+	pool : driver_pool.DriverPool
+		The pool from which to lease drivers.
+	load : callable, optional
+		Function called as `load(driver, url)` to open a page (for example,
+		to log in again when a session has expired). By default, the page is
+		just opened with `driver.get`.
+	'''
+
+	def __init__(self, pool, load=None):
+		self.pool = pool
+		self.load = load
+
+
+	def fetch (self, url, headers=None):
+		'''
+		Load a page in a browser and return its rendered HTML.
+
+		The `headers` argument is accepted for compatibility with
+		`HttpBackend`, but is ignored.
+		'''
+
+		with self.pool.acquire() as driver:
+			if self.load is not None:
+				self.load(driver, url)
+			else:
+				with tracing.phase("driver_get", url=url):
+					driver.get(url)
+			# There's no way to get the status code through Selenium, so\
+			# assume everything went fine
+			return Page(driver.current_url, 200, driver.page_source)
+
+
+	def close (self):
+		self.pool.close()
+
+
+
+def needs_fallback (page):
+	'''
+	Check if a page is one a browser may get past (its status is in
+	`FALLBACK_STATUSES`), the default check of `FallbackBackend`.
+	'''
+
+	return page.status in FALLBACK_STATUSES
+
+
+
+class FallbackBackend (object):
+	'''
+	Fetch pages with one backend and, if the page isn't usable, with
+	another one.
+
+	Parameters
+	----------
+	primary : object
+		The backend to try first (usually an `HttpBackend`).
+	fallback : object
+		The backend to use when `needs_js(page)` is true (usually a
+		`SeleniumBackend`).
+	needs_js : callable, optional
+		Function that receives the `Page` returned by the primary backend
+		and returns `True` if it has to be fetched again with the fallback.
+		By default, only the statuses in `FALLBACK_STATUSES` trigger the
+		fallback (see `needs_fallback`). The primary backend failing to
+		connect always triggers it.
+	'''
+
+	def __init__(self, primary, fallback, needs_js=None):
+		self.primary = primary
+		self.fallback = fallback
+		self.needs_js = needs_js or needs_fallback
+
+
+	def fetch (self, url, headers=None):
+		'''
+		Fetch a page, falling back to the second backend if needed.
+
+		Parameters
+		----------
+		url : str
+			The URL of the page.
+		headers : dict, optional
+			Extra headers for the primary backend.
+		'''
+
+		try:
+			page = self.primary.fetch(url, headers)
+		except (http.client.HTTPException, OSError):
+			page = None
+
+		if page is None or self.needs_js(page):
+			page = self.fallback.fetch(url, headers)
+
+		return page
+
+
+	def close (self):
+		self.primary.close()
+		self.fallback.close()
@@ -20,6 +20,57 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import StaleElementReferenceException
+from contextlib import contextmanager
+from driver_pool import DriverPool, set_default_profile, PROFILES
+from fetch_backend import HttpBackend, SeleniumBackend, FallbackBackend
+from crawl_engine import CrawlEngine
+from response_cache import ResponseCache, CachedBackend
+from metrics_store import MetricsStore
+from profile_table import ProfileTable
+from identity_index import IdentityIndex
+import tracing
+from element_lookup import find_now, find_all_now, wait_for
+from rate_limiter import RateLimiter, ThrottledBackend, BlockedError, raise_if_blocked, BLOCKED_RETRIES
+from result_stream import ResultSink, school_totals
+import argparse
+
+
+# Root of every Google Scholar URL we build (can be pointed to a local\
+# server with saved pages to test the scraper offline)
+SCHOLAR_URL = "https://scholar.google.pt"
+
+# Largest number of publications Google Scholar lists in a single page of a\
+# profile (through the `cstart` and `pagesize` URL parameters)
+PUBS_PAGE_SIZE = 100
+
+# Pool of warm drivers shared by every function in this file, so that we\
+# don't have to start a new browser for every page we visit
+pool = DriverPool()
+
+
+@contextmanager
+def lease_driver (driver=None):
+	'''
+	Use the given driver, or lease one from the shared pool if none was
+	given.
+
+	Parameters
+	----------
+	driver : selenium.webdriver.Chrome, optional
+		A driver the caller already holds. It is used as is and is not
+		returned to the pool.
+
+	Yields
+	------
+	driver : selenium.webdriver.Chrome
+		The driver to use inside the `with` block.
+	'''
+
+	if driver is not None:
+		yield driver
+	else:
+		with pool.acquire() as driver:
+			yield driver
 
 
 # Credit for this class goes to https://stackoverflow.com/a/35536565
@@ -45,15 +96,15 @@ class wait_for_more_than_n_elements (object):
 			return False
 
 
-def get_author_pubs (target_url):
+def count_loaded_pubs (driver):
 	'''
-	Extracts the number of publications found in a single user profile.
+	Count the publications of the profile currently open in a driver,
+	clicking the "SHOW MORE" button until all of them are loaded.
 
 	Parameters
 	----------
-	target_url : str
-		The URL of the profile from which we'll extract the number of
-		published documents.
+	driver : selenium.webdriver.Chrome
+		A driver that already has the profile page open.
 
 	Returns
 	-------
@@ -61,18 +112,14 @@ def get_author_pubs (target_url):
 		The number of published documents by the present author.
 	'''
 
-	# We'll use Google Chrome
-	driver = webdriver.Chrome()
-	# Make the driver wait 10 seconds
-	driver.implicitly_wait(10)
-	# Open the target URL
-	driver.get(target_url)
-	# Find the "SHOW MORE" button by its id
-	elem = driver.find_element_by_id("gsc_bpf_more")
+	# Wait for the "SHOW MORE" button, which is there once the list of\
+	# publications is
+	elem = wait_for(driver, By.ID, "gsc_bpf_more")
 	# If the author has less than 21 publications, try to extract the exact\
-	# number; if it raises any exception, assume the author has 0 publications
+	# number; authors without publications don't have the counter at all,\
+	# so don't wait for it
 	try:
-		pubs = int(driver.find_element_by_id("gsc_a_nn").text.split("–")[-1])
+		pubs = int(find_now(driver, By.ID, "gsc_a_nn").text.split("–")[-1])
 	except:
 		pubs = 0
 
@@ -82,7 +129,8 @@ def get_author_pubs (target_url):
 		# Create an object to make the driver wait 10 seconds
 		wait = WebDriverWait(driver, 10)
 		# Wait 3 seconds until the button is clickable
-		elem = wait.until( EC.element_to_be_clickable((By.ID, "gsc_bpf_more")) )
+		with tracing.phase("wait_clickable"):
+			elem = wait.until( EC.element_to_be_clickable((By.ID, "gsc_bpf_more")) )
 		# Click the button (load more publications)
 		elem.click()
 		# Get the number of currently shown publications
@@ -90,32 +138,281 @@ def get_author_pubs (target_url):
 		# Click the "SHOW MORE" button only after all the publications have\
 		# loaded since the previous click
 		wait = WebDriverWait(driver, 10)
-		wait.until(wait_for_more_than_n_elements((By.CLASS_NAME, "gsc_a_tr"), pubs) )
+		with tracing.phase("wait_show_more"):
+			wait.until(wait_for_more_than_n_elements((By.CLASS_NAME, "gsc_a_tr"), pubs) )
 
 	if pubs > 20:
 		# Wait for the page to finish loading the last batch of publications
 		wait = WebDriverWait(driver, 10)
-		wait.until(wait_for_more_than_n_elements((By.CLASS_NAME, "gsc_a_tr"), pubs) )
+		with tracing.phase("wait_show_more"):
+			wait.until(wait_for_more_than_n_elements((By.CLASS_NAME, "gsc_a_tr"), pubs) )
 		# To get the total number of publications, just extract the number from the\
 		# <span> element at the end of the page, next to the now disabled "SHOW MORE"\
 		# button
 		pubs = int(driver.find_element_by_id("gsc_a_nn").text.split("–")[-1])
-	# Close the currently open browser window (the driver)
-	driver.quit()
 
 	return pubs
 
 
 
-def get_page_profiles (target_url):
+def parse_pubs_rows (root):
 	'''
-	Return a list with the URLs for each user profile in the current
-	page of results.
+	Count the publications listed in a parsed page of a profile.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed profile page.
+
+	Returns
+	-------
+	int
+		The number of publications in the page.
+	'''
+
+	# Profiles without publications still have a single row, with a\
+	# `gsc_a_e` cell saying there are no articles, so ignore it
+	return len([row for row in root.find_all("tr", class_name="gsc_a_tr") if row.find(class_name="gsc_a_e") is None])
+
+
+
+def count_pubs_paged (profile, backend, first_page=None):
+	'''
+	Count the publications of a profile by requesting its list of
+	publications directly, in pages as big as possible, instead of
+	clicking the "SHOW MORE" button.
+
+	Parameters
+	----------
+	profile : str
+		The URL for the user profile.
+	backend : object
+		A backend from `fetch_backend` used to fetch the pages.
+	first_page : fetch_backend.Element, optional
+		The first page of publications (`cstart=0`), already parsed, if the
+		caller has fetched it.
+
+	Returns
+	-------
+	pubs : int
+		The number of published documents by the present author.
+	'''
+
+	pubs = 0
+	# Index of the first publication of the current page
+	cstart = 0
+	while True:
+		if cstart == 0 and first_page is not None:
+			root = first_page
+		else:
+			root = backend.fetch(profile + f"&cstart={cstart}&pagesize={PUBS_PAGE_SIZE}").root
+		page_pubs = parse_pubs_rows(root)
+		pubs += page_pubs
+		# A page that isn't full is the last one
+		if page_pubs < PUBS_PAGE_SIZE:
+			break
+		cstart += PUBS_PAGE_SIZE
+
+	return pubs
+
+
+
+def parse_profile_stats (cells):
+	'''
+	Extract the citation metrics from the texts of the `gsc_rsb_std` cells
+	of a profile's "Cited by" table.
+
+	The table has two columns ("All" and "Since ...") and three rows
+	(citations, h-index and i10-index), so we want the 1st, 3rd and 5th
+	cells.
+
+	Parameters
+	----------
+	cells : list
+		The texts of the cells, in document order.
+
+	Returns
+	-------
+	stats : dict
+		A dictionary with the keys `citations`, `h_index` and `i10_index`.
+		Metrics that couldn't be scraped are assumed to be zero.
+
+	Raises
+	------
+	ValueError
+		If there's no table at all. Every profile has one (even without
+		citations), so the page isn't a profile (it may be a block page
+		that wasn't detected), and its zeros can't be trusted.
+	'''
+
+	if not cells:
+		raise ValueError("The page has no \"Cited by\" table")
+
+	stats = {}
+	for key, index in (("citations", 0), ("h_index", 2), ("i10_index", 4)):
+		try:
+			stats[key] = int(cells[index].strip())
+		except:
+			# If we couldn't scrape the metric, assume it's zero
+			stats[key] = 0
+
+	return stats
+
+
+
+def scrape_author_profile (profile, driver=None, backend=None, count_pubs=True):
+	'''
+	Scrape the number of publications and the citation metrics of a single
+	user profile, visiting it only once.
+
+	Parameters
+	----------
+	profile : str
+		The URL for the user profile.
+	driver : selenium.webdriver.Chrome, optional
+		The driver to use. If not given, one is leased from the shared pool.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the profile is fetched and
+		parsed with it, and the publications are counted by requesting the
+		list of publications in pages (see `count_pubs_paged`).
+	count_pubs : bool
+		Whether to count the publications. If `False`, the (slow) loading of
+		every publication is skipped and `publications` is `None`.
+
+	Returns
+	-------
+	author : dict
+		A dictionary with the keys `publications`, `citations`, `h_index`
+		and `i10_index`.
+	'''
+
+	if backend is not None:
+		# Ask for the first page of publications as big as possible, so that\
+		# most authors need a single request
+		root = backend.fetch(profile + f"&cstart=0&pagesize={PUBS_PAGE_SIZE}").root
+		author = parse_profile_stats([cell.text for cell in root.find_all(class_name="gsc_rsb_std")])
+		author["publications"] = count_pubs_paged(profile, backend, first_page=root) if count_pubs else None
+
+		return author
+
+	# Use a warm driver from the pool (or the one given by the caller)
+	with lease_driver(driver) as driver:
+		# Open the target URL
+		with tracing.phase("driver_get", url=profile):
+			driver.get(profile)
+		# Don't read a CAPTCHA as a profile without citations
+		raise_if_blocked(driver.current_url, 200, driver.page_source)
+		# The metrics are read before loading the publications, which\
+		# changes the page
+		author = parse_profile_stats([cell.text for cell in driver.find_elements_by_class_name("gsc_rsb_std")])
+		author["publications"] = count_loaded_pubs(driver) if count_pubs else None
+
+	return author
+
+
+
+def get_author_pubs (target_url, driver=None, backend=None):
+	'''
+	Extracts the number of publications found in a single user profile.
 
 	Parameters
 	----------
 	target_url : str
-		The URL of the page from which will be extracted profile URLs.
+		The URL of the profile from which we'll extract the number of
+		published documents.
+	driver : selenium.webdriver.Chrome, optional
+		The driver to use. If not given, one is leased from the shared pool.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the publications are
+		counted by requesting the list of publications in pages instead of
+		clicking the "SHOW MORE" button.
+
+	Returns
+	-------
+	pubs : int
+		The number of published documents by the present author.
+	'''
+
+	if backend is not None:
+		return count_pubs_paged(target_url, backend)
+
+	return scrape_author_profile(target_url, driver)["publications"]
+
+
+
+def parse_page_cards (root):
+	'''
+	Extract the URL and the "Cited by" count of each user profile from a
+	parsed page of results.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of results.
+
+	Returns
+	-------
+	list
+		A list of `(profile_url, cited_by)` tuples. `cited_by` is 0 for
+		authors without citations.
+	'''
+
+	cards = []
+	base_url = SCHOLAR_URL + "/citations?hl=en&user="
+	elem = root.find(id="gsc_sa_ccl")
+	if elem is None:
+		return cards
+	for profile in elem.find_all(class_name="gsc_1usr"):
+		profile_url = base_url + profile.find(class_name="gs_ai_pho").get_attribute("href").split("=")[-1]
+		# The card shows "Cited by N" (or nothing, without citations)
+		try:
+			cited_by = int(profile.find(class_name="gs_ai_cby").text.split()[-1])
+		except:
+			cited_by = 0
+		cards.append((profile_url, cited_by))
+
+	return cards
+
+
+
+def parse_page_authors (root):
+	'''
+	Extract the Scholar user id and the name of each author from a parsed
+	page of results.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of results.
+
+	Returns
+	-------
+	list
+		A list of `(user_id, name)` tuples.
+	'''
+
+	authors = []
+	elem = root.find(id="gsc_sa_ccl")
+	if elem is None:
+		return authors
+	for profile in elem.find_all(class_name="gsc_1usr"):
+		user_id = profile.find(class_name="gs_ai_pho").get_attribute("href").split("=")[-1]
+		name = profile.find(class_name="gs_ai_name")
+		if name is not None:
+			authors.append((user_id, name.text))
+
+	return authors
+
+
+
+def parse_page_profiles (root):
+	'''
+	Extract the URLs for each user profile from a parsed page of results.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of results.
 
 	Returns
 	-------
@@ -126,39 +423,81 @@ def get_page_profiles (target_url):
 	# List to contain the scraped profile URLs
 	profiles_list = []
 	# Each profile URL starts with this
-	base_url = "https://scholar.google.pt/citations?hl=en&user="
-	# We'll use Google Chrome
-	driver = webdriver.Chrome()
-	# Make the driver wait 10 seconds
-	driver.implicitly_wait(10)
-	# Open the target URL
-	driver.get(target_url)
-	# Find the "SHOW MORE" button by its id
-	elem = driver.find_element_by_id("gsc_sa_ccl")
+	base_url = SCHOLAR_URL + "/citations?hl=en&user="
+	# The container of the results
+	elem = root.find(id="gsc_sa_ccl")
+	if elem is None:
+		return profiles_list
 	# Loop through the results in the page and extract the desired URLs
-	for profile in elem.find_elements_by_class_name("gsc_1usr"):
+	for profile in elem.find_all(class_name="gsc_1usr"):
 		# Extract the profile's ID and suffix it to the base URL to\
 		# create the full profile URL
-		profile_url = base_url + profile.find_element_by_class_name("gs_ai_pho").get_attribute("href").split("=")[-1]
+		profile_url = base_url + profile.find(class_name="gs_ai_pho").get_attribute("href").split("=")[-1]
 		# Add the profile URL to the list
 		profiles_list.append(profile_url)
 
-	# Close the currently open browser window (the driver)
-	driver.quit()
-
 	return profiles_list
 
 
 
-def get_next_page_url (target_url):
+def get_page_profiles (target_url, driver=None, backend=None):
 	'''
-	Get the URL for the next page of profile results.
+	Return a list with the URLs for each user profile in the current
+	page of results.
 
 	Parameters
 	----------
 	target_url : str
-		The URL of the page from which will be extracted the URL for the
-		next page; the URL of the current page
+		The URL of the page from which will be extracted profile URLs.
+	driver : selenium.webdriver.Chrome, optional
+		The driver to use. If not given, one is leased from the shared pool.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the page is fetched and
+		parsed with it instead of being rendered by a driver.
+
+	Returns
+	-------
+	profiles_list : list
+		A list of URLs, that is, of strings, for the profiles of authors.
+	'''
+
+	# The profile cards are in the page's HTML, so there's no need for a\
+	# browser if we have a backend
+	if backend is not None:
+		return parse_page_profiles(backend.fetch(target_url).root)
+
+	# List to contain the scraped profile URLs
+	profiles_list = []
+	# Each profile URL starts with this
+	base_url = SCHOLAR_URL + "/citations?hl=en&user="
+	# Use a warm driver from the pool (or the one given by the caller)
+	with lease_driver(driver) as driver:
+		# Open the target URL
+		with tracing.phase("driver_get", url=target_url):
+			driver.get(target_url)
+		# Find the "SHOW MORE" button by its id
+		elem = wait_for(driver, By.ID, "gsc_sa_ccl")
+		# Loop through the results in the page and extract the desired URLs
+		for profile in elem.find_elements_by_class_name("gsc_1usr"):
+			# Extract the profile's ID and suffix it to the base URL to\
+			# create the full profile URL
+			profile_url = base_url + profile.find_element_by_class_name("gs_ai_pho").get_attribute("href").split("=")[-1]
+			# Add the profile URL to the list
+			profiles_list.append(profile_url)
+
+	return profiles_list
+
+
+
+def parse_next_page_url (root):
+	'''
+	Extract the URL for the next page of profile results from a parsed
+	page of results.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of results.
 
 	Returns
 	-------
@@ -167,36 +506,77 @@ def get_next_page_url (target_url):
 		just return `None` instead.
 	'''
 
-	# This the base of the URL for the next page of results. What is\
-	# scraped is suffixed to this
-	base_url = "https://scholar.google.pt"
-	# We'll use Google Chrome
-	driver = webdriver.Chrome()
-	# Make the driver wait 10 seconds
-	driver.implicitly_wait(10)
-	# Open the target URL
-	driver.get(target_url)
-	# Find the "SHOW MORE" button by its id
-	# elem = driver.find_element(By.CLASS_NAME("gs_btnPR gs_in_ib gs_btn_half gs_btn_lsb gs_btn_srt gsc_pgn_pnx"))
-	elem = driver.find_elements_by_tag_name("button")[-1]
 	# try/except clause in case the page doesn't have buttons at all
 	try:
+		# The last <button> of the page is the "next page" one
+		elem = root.find_all("button")[-1]
 		# Find the last <button> and extract the desired URL
 		if elem.get_attribute("disabled") == None:
 			next_url = elem.get_attribute("onclick")[17:-1].replace("\\x3d", "=").replace("\\x26", "&")
-			return_url = base_url + next_url
+			return_url = SCHOLAR_URL + next_url
 		# If the button is disabled, there's no next URL
 		else:
 			return_url = None
 	except:
 		return_url = None
 
-	# Close the currently open browser window (the driver)
-	driver.quit()
+	return return_url
+
+
+
+def get_next_page_url (target_url, driver=None, backend=None):
+	'''
+	Get the URL for the next page of profile results.
+
+	Parameters
+	----------
+	target_url : str
+		The URL of the page from which will be extracted the URL for the
+		next page; the URL of the current page
+	driver : selenium.webdriver.Chrome, optional
+		The driver to use. If not given, one is leased from the shared pool.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the page is fetched and
+		parsed with it instead of being rendered by a driver.
+
+	Returns
+	-------
+	return_url : str
+		The URL for the next page. If the current page was the last one,
+		just return `None` instead.
+	'''
+
+	if backend is not None:
+		return parse_next_page_url(backend.fetch(target_url).root)
+
+	# This the base of the URL for the next page of results. What is\
+	# scraped is suffixed to this
+	base_url = SCHOLAR_URL
+	# Use a warm driver from the pool (or the one given by the caller)
+	with lease_driver(driver) as driver:
+		# Open the target URL
+		with tracing.phase("driver_get", url=target_url):
+			driver.get(target_url)
+		# Find the "SHOW MORE" button by its id
+		# elem = driver.find_element(By.CLASS_NAME("gs_btnPR gs_in_ib gs_btn_half gs_btn_lsb gs_btn_srt gsc_pgn_pnx"))
+		# try/except clause in case the page doesn't have buttons at all\
+		# (the page is already loaded, so there's no point in waiting for\
+		# them)
+		try:
+			elem = find_all_now(driver, By.TAG_NAME, "button")[-1]
+			# Find the last <button> and extract the desired URL
+			if elem.get_attribute("disabled") == None:
+				next_url = elem.get_attribute("onclick")[17:-1].replace("\\x3d", "=").replace("\\x26", "&")
+				return_url = base_url + next_url
+			# If the button is disabled, there's no next URL
+			else:
+				return_url = None
+		except:
+			return_url = None
 
 	return return_url
 
-def get_citations (profile):
+def get_citations (profile, driver=None, backend=None):
 	'''
 	Get the number of citations for a single user profile.
 
@@ -204,89 +584,336 @@ def get_citations (profile):
 	----------
 	profile : str
 		The URL for the user profile.
+	driver : selenium.webdriver.Chrome, optional
+		The driver to use. If not given, one is leased from the shared pool.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the page is fetched and
+		parsed with it instead of being rendered by a driver.
 
 	Returns
 	-------
 	citations : int
 		The citations for the target user.
+
+	Raises
+	------
+	rate_limiter.BlockedError
+		If Google Scholar blocked us instead of showing the profile.
+	ValueError
+		If the page has no citations table (see `parse_profile_stats`).
 	'''
 
-	# We'll use Google Chrome
-	driver = webdriver.Chrome()
-	# Make the driver wait 10 seconds
-	driver.implicitly_wait(10)
-	# Open the target URL
-	driver.get(profile)
+	return scrape_author_profile(profile, driver, backend, count_pubs=False)["citations"]
 
-	try:
-		citations = int(driver.find_elements_by_class_name("gsc_rsb_std")[0].text.strip())
-	except:
-		# If we couldn't scrape the citations, assume it's zero
-		citations = 0
 
-	driver.quit()
+def crawl_schools (schools, backend, per_host=4, identities=None, sink=None, store=None):
+	'''
+	Scrape the publications and citations of the authors of several schools
+	concurrently, with the asynchronous crawl engine: pages of results,
+	profiles and pages of publications are all fetched in parallel (up to
+	`per_host` at a time).
 
-	return citations
+	Parameters
+	----------
+	schools : list
+		The schools (institutions) to search for, like "isep.ipp".
+	backend : object
+		A backend from `fetch_backend`, safe to use from several threads.
+	per_host : int
+		Maximum number of requests in flight to Google Scholar.
+	identities : identity_index.IdentityIndex, optional
+		If given, the authors found are linked in it.
+	sink : result_stream.ResultSink, optional
+		If given, every page of results and every profile (once all its
+		publications are counted) is written to it.
+	store : metrics_store.MetricsStore, optional
+		If given, every profile (once all its publications are counted) is
+		saved in it, and the authors no longer listed by a school whose
+		pages of results were all scraped are forgotten.
 
+	Returns
+	-------
+	(results, school_citations) : tuple
+		Dictionaries of the type `school: publications` and
+		`school: citations`.
+	'''
 
-# The following code is run only if this file itself is being executed\
-# instead of imported by another file
-if __name__ == "__main__":
-	# The schools (institutions) to search for
-	schools = ["isep.ipp", "iscap.ipp", "ese.ipp", "esmae.ipp", "estg.ipp", "ess.ipp", "esht.ipp", "esmad.ipp"]
-	# Holds key-value pairs of the type school-number_of_published_documents
 	results = {}
 	school_citations = {}
-	# String to be written into a text file with the published documents\
-	# per school
-	write_string = ""
-	# String to be written into a text file with the citations per school
-	write_string_citations = ""
-	
-	# Find the number of published documents by each school
+	# Metrics of the profiles whose publications are still being counted,\
+	# and the "Cited by" count of their cards (to tell if they change), by\
+	# `(school_name, profile)`: an author listed by two schools counts for\
+	# both (like in the serial scraper), so their pages are fetched for each
+	authors = {}
+	cited_by = {}
+	# Profiles listed by each school, and the school of each page of results
+	school_profiles = {}
+	results_pages = {}
+	engine = CrawlEngine(backend, per_host=per_host)
+
+	# Each kind of page has its own callback, which updates the running\
+	# sums of its school and adds the pages found in it to the frontier
+	def on_pubs_page (engine, page, school_name, profile, cstart):
+		page_pubs = parse_pubs_rows(page.root)
+		results[school_name] += page_pubs
+		authors[(school_name, profile)]["publications"] += page_pubs
+		# A full page means there may be more publications
+		if page_pubs == PUBS_PAGE_SIZE:
+			next_cstart = cstart + PUBS_PAGE_SIZE
+			next_url = profile + f"&cstart={next_cstart}&pagesize={PUBS_PAGE_SIZE}"
+			engine.add(next_url, on_pubs_page, key=(school_name, next_url),
+				school_name=school_name, profile=profile, cstart=next_cstart)
+		else:
+			author = authors.pop((school_name, profile))
+			fingerprint = cited_by.get((school_name, profile))
+			if store is not None:
+				store.save("scholar", school_name, profile, author, None if fingerprint is None else str(fingerprint))
+			if sink is not None:
+				sink.profile("scholar", school_name, profile, author, cited_by=fingerprint)
+
+	def on_profile (engine, page, school_name, profile):
+		author = parse_profile_stats([cell.text for cell in page.root.find_all(class_name="gsc_rsb_std")])
+		school_citations[school_name] += author["citations"]
+		author["publications"] = 0
+		authors[(school_name, profile)] = author
+		# The profile page is also the first page of publications
+		on_pubs_page(engine, page, school_name, profile, 0)
+
+	def on_results_page (engine, page, school_name):
+		if identities is not None:
+			identities.link_many("scholar", parse_page_authors(page.root), school_name)
+		cards = parse_page_cards(page.root)
+		if sink is not None:
+			sink.page("scholar", school_name, page.url, profiles=len(cards))
+		for profile, profile_cited_by in cards:
+			cited_by[(school_name, profile)] = profile_cited_by
+			school_profiles[school_name].append(profile)
+			profile_url = profile + f"&cstart=0&pagesize={PUBS_PAGE_SIZE}"
+			engine.add(profile_url, on_profile, key=(school_name, profile_url),
+				school_name=school_name, profile=profile)
+		next_page = parse_next_page_url(page.root)
+		if next_page is not None:
+			results_pages[next_page] = school_name
+			engine.add(next_page, on_results_page, school_name=school_name)
+
+	# Start with the first page of results of every school
 	for school in schools:
-		# Create the school name/dictionary key
 		school_name = school.split(".")[0].upper()
-		# Add the key-value pair to the dictionary
 		results[school_name] = 0
 		school_citations[school_name] = 0
+		school_profiles[school_name] = []
+		first_page = f"{SCHOLAR_URL}/citations?view_op=search_authors&hl=en&mauthors={school}"
+		results_pages[first_page] = school_name
+		engine.add(first_page, on_results_page, school_name=school_name)
+
+	engine.crawl()
 
-		# The current page is, at first, the first page of results for the\
-		# current school
-		curr_page = f"https://scholar.google.pt/citations?view_op=search_authors&hl=en&mauthors={school}"
+	# Don't let failed pages go unnoticed
+	incomplete_schools = set()
+	for url, error in engine.errors:
+		print("Failed to scrape", url, "-", error)
+		if url in results_pages:
+			incomplete_schools.add(results_pages[url])
 
-		# While we haven't reached the end, extract the number of publications\
-		# of each author in the current page and add it to the running sum in\
-		# the respective school's dictionary key
-		while curr_page != None:
-			# Get a list with the URLs for each profile in the page
-			page_profiles = get_page_profiles(curr_page)
+	# Authors no longer listed don't count for the school anymore (unless\
+	# some of its pages of results couldn't be scraped)
+	if store is not None:
+		for school_name, profiles in school_profiles.items():
+			if school_name not in incomplete_schools:
+				store.forget_missing("scholar", school_name, profiles)
 
-			# Loop through the author pages to extract the number of published\
-			# documents (update the running sum)
-			for author_profile in page_profiles:
-				pubs = get_author_pubs(author_profile)
-				results[school_name] += pubs
-				cites = get_citations(author_profile)
-				school_citations[school_name] += cites
-				print(school_citations[school_name])
+	return (results, school_citations)
 
-			# The current page is now the next page (call this function to get\
-			# the URL for said page)
-			curr_page = get_next_page_url(curr_page)
 
-		# print(f"{school_name}'s authors have {results[school_name]} publications.")
-		print(f"{school_name}'s authors have {school_citations[school_name]} citations.")
 
-		# Update the string to be written to a text file
-		# write_string += f"{school_name}: {results[school_name]} publications\n"
-		write_string_citations += f"{school_name}: {school_citations[school_name]} citations\n"
+# The schools (institutions) to search for
+SCHOOLS = ["isep.ipp", "iscap.ipp", "ese.ipp", "esmae.ipp", "estg.ipp", "ess.ipp", "esht.ipp", "esmad.ipp"]
 
 
-	# Write the string to a new text file
+
+# The following code is run only if this file itself is being executed\
+# instead of imported by another file
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Scrape publications and citations of IPP's schools from Google Scholar.")
+	parser.add_argument("--backend", choices=["http", "selenium"], default="http",
+		help="fetch pages with plain HTTP requests (falling back to a browser when needed) or always with a browser")
+	parser.add_argument("--per-host", type=int, default=0,
+		help="crawl with the asynchronous engine, with up to this many requests in flight (needs --backend http)")
+	parser.add_argument("--cache", default="page_cache",
+		help="directory of the on-disk cache of fetched pages")
+	parser.add_argument("--no-cache", action="store_true",
+		help="always fetch pages from the network")
+	parser.add_argument("--store", default="metrics.sqlite3",
+		help="SQLite file where the metrics of every profile (and the identities of the authors across platforms) are kept")
+	parser.add_argument("--incremental", action="store_true",
+		help="only scrape profiles that are new, changed or older than --max-age, and compute the totals from the store")
+	parser.add_argument("--max-age", type=float, default=7 * 24,
+		help="hours after which a stored profile is scraped again (with --incremental)")
+	parser.add_argument("--output", default="GS_results.ndjson",
+		help="NDJSON file where every profile and page of results is written as soon as it's scraped")
+	parser.add_argument("--records", default="GS_profiles.cols",
+		help="file where the metrics of every profile are saved by column (Parquet if it ends with .parquet)")
+	parser.add_argument("--browser", choices=PROFILES, default="lean",
+		help="profile of the browsers: lean (headless, without images, fonts or trackers) or full (a normal window)")
+	parser.add_argument("--trace",
+		help="record how long every phase of the run takes, and write the trace to this JSON file")
+	args = parser.parse_args()
+	if args.trace:
+		tracing.enable()
+	# Browsers of the pool are started (when needed) with this profile
+	set_default_profile(args.browser)
+	if args.incremental and args.per_host > 0:
+		parser.error("--incremental can't be used with --per-host")
+
+	# Cache of fetched pages, so that re-runs don't fetch them again
+	cache = None if args.no_cache else ResponseCache(args.cache)
+	# Store with the metrics of every profile scraped
+	store = MetricsStore(args.store)
+	max_age = args.max_age * 3600
+	# Index of the authors' identities across the platforms
+	identities = IdentityIndex(args.store)
+	# Every profile is written to the output as soon as it's scraped, and\
+	# the totals of each school are computed from it at the end
+	sink = ResultSink(args.output)
+
+	# Requests to Google Scholar follow limits that adapt to how much it\
+	# puts up with. Blocked pages are put back in the frontier of the\
+	# asynchronous engine, or asked for again after a pause by the serial\
+	# loop
+	limiter = RateLimiter()
+	retries = 0 if args.per_host > 0 else BLOCKED_RETRIES
+
+	# Pages that only need to be read are fetched with plain HTTP requests;\
+	# if a request fails, the page is loaded in a browser instead
+	if args.backend == "http":
+		backend = FallbackBackend(ThrottledBackend(HttpBackend(), limiter, retries),
+			ThrottledBackend(SeleniumBackend(pool), limiter, retries))
+	# Pages rendered in a browser can be cached too, as long as they are\
+	# parsed from their source
+	elif cache is not None:
+		backend = ThrottledBackend(SeleniumBackend(pool), limiter, retries)
+	else:
+		backend = None
+	if cache is not None:
+		backend = CachedBackend(backend, cache)
+
+	schools = SCHOOLS
+	# Profiles that couldn't be scraped (they're left out of the totals)
+	not_scraped = []
+	
+	# With the asynchronous engine every school is crawled at once
+	if args.per_host > 0 and backend is not None:
+		crawl_schools(schools, backend, per_host=args.per_host, identities=identities, sink=sink, store=store)
+
+	else:
+		# Find the number of published documents by each school
+		for school in schools:
+			# Create the school name/dictionary key
+			school_name = school.split(".")[0].upper()
+			tracing.set_context(school=school_name)
+
+			# The current page is, at first, the first page of results for the\
+			# current school
+			curr_page = f"{SCHOLAR_URL}/citations?view_op=search_authors&hl=en&mauthors={school}"
+			# Profiles found for the school in this run
+			seen_profiles = []
+
+			# While we haven't reached the end, extract the number of publications\
+			# of each author in the current page and add it to the running sum in\
+			# the respective school's dictionary key
+			while curr_page != None:
+				# Get a list with the URLs for each profile in the page, along\
+				# with their "Cited by" counts (which tell us if a profile has\
+				# changed) and the URL for the next page
+				if backend is not None:
+					# Read everything from a single fetch of the page
+					root = backend.fetch(curr_page).root
+					page_cards = parse_page_cards(root)
+					next_page = parse_next_page_url(root)
+					# Link the authors to their identities on the other\
+					# platforms
+					identities.link_many("scholar", parse_page_authors(root), school_name)
+				else:
+					page_cards = [(profile, None) for profile in get_page_profiles(curr_page)]
+					next_page = get_next_page_url(curr_page)
+				sink.page("scholar", school_name, curr_page, profiles=len(page_cards))
+
+				# Loop through the author pages to extract the number of published\
+				# documents (update the running sum)
+				for author_profile, cited_by in page_cards:
+					seen_profiles.append(author_profile)
+					fingerprint = None if cited_by is None else str(cited_by)
+					# In incremental mode, skip the profiles we already have\
+					# recent and unchanged metrics for
+					if args.incremental and not store.needs_refresh("scholar", author_profile, max_age, fingerprint):
+						sink.profile("scholar", school_name, author_profile, store.metrics_of("scholar", author_profile), stored=True)
+						continue
+					# Get the publications and citations with a single visit\
+					# to the profile
+					try:
+						with tracing.phase("profile", url=author_profile):
+							author = scrape_author_profile(author_profile, backend=backend)
+					# A profile we were blocked from isn't an author without\
+					# publications or citations, so leave it out (and out of\
+					# the store, so that an incremental run scrapes it)
+					except (BlockedError, ValueError) as error:
+						print("Couldn't scrape", author_profile, "-", error)
+						not_scraped.append(author_profile)
+						continue
+					store.save("scholar", school_name, author_profile, author, fingerprint)
+					sink.profile("scholar", school_name, author_profile, author, cited_by=cited_by)
+
+				# The current page is now the next page
+				curr_page = next_page
+
+			# Authors no longer listed don't count for the school anymore
+			store.forget_missing("scholar", school_name, seen_profiles)
+
+	# The totals of each school come from the profiles written to the output\
+	# (in incremental mode, the ones that weren't scraped again were written\
+	# with their stored metrics)
+	sink.close()
+	totals = school_totals(args.output, "scholar")
+	# String to be written into a text file with the published documents\
+	# per school
+	write_string = ""
+	# String to be written into a text file with the citations per school
+	write_string_citations = ""
+	for school in schools:
+		school_name = school.split(".")[0].upper()
+		school_total = totals.get(school_name, {})
+		print(f"{school_name}'s authors have {school_total.get('publications', 0)} publications.")
+		print(f"{school_name}'s authors have {school_total.get('citations', 0)} citations.")
+		write_string += f"{school_name}: {school_total.get('publications', 0)} publications\n"
+		write_string_citations += f"{school_name}: {school_total.get('citations', 0)} citations\n"
+
+	# Write the strings to new text files
 	with open("GS_docs_escola.txt", "w") as f:
 		f.write(write_string)
-	print(results)
 
 	with open("GS_citations.txt", "w") as f:
-		f.write(write_string_citations)
\ No newline at end of file
+		f.write(write_string_citations)
+	print(sink.records, "records written to", args.output)
+
+	if not_scraped:
+		print(len(not_scraped), "profiles couldn't be scraped and are missing from the totals (run again with --incremental to scrape them).")
+	print("Rate limits:", limiter.stats())
+
+	# Quit the browsers that were kept warm in the pool and close any open\
+	# connections
+	if backend is not None:
+		backend.close()
+	pool.close()
+
+	# Keep the metrics of every profile (not just the totals), so that\
+	# they can be analyzed later
+	ProfileTable.from_store(store, "scholar").save(args.records)
+	store.close()
+	identities.close()
+	if cache is not None:
+		print("Page cache:", cache.stats())
+
+	# Where the time went
+	if args.trace:
+		tracing.tracer.export(args.trace)
+		tracing.tracer.print_summary()
\ No newline at end of file
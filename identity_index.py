@@ -0,0 +1,249 @@
+'''
+File with a persistent index of the identities of each author across the
+platforms (a Google Scholar user id, a ResearchGate account key, ...).
+
+Authors are keyed by a hash of their normalized name and affiliation, so
+linking a new identity, or finding the other identities of an author, is a
+single indexed lookup instead of comparing every name with every other name.
+The normalization is deliberately simple: accents, case, punctuation,
+initials and particles like "da" or "dos" are dropped, and only the first and
+last names are kept, which is how the same person is usually written on the
+different platforms ("Maria J. Silva" and "Maria João da Silva" are both
+"maria silva").
+'''
+
+import hashlib
+import re
+import sqlite3
+import unicodedata
+
+
+# Particles that are left out of the names
+NAME_PARTICLES = {"da", "das", "de", "do", "dos", "e", "del", "della", "di", "van", "von"}
+
+
+
+def normalize_name (name):
+	'''
+	Normalize an author's name: first and last names, in lower case, without
+	accents, initials or particles.
+
+	Parameters
+	----------
+	name : str
+		The name, as shown on a platform.
+
+	Returns
+	-------
+	str
+		The normalized name (empty if there's nothing left).
+	'''
+
+	# Decompose the accented characters and drop the accents
+	name = unicodedata.normalize("NFKD", name)
+	name = "".join(char for char in name if not unicodedata.combining(char)).lower()
+	words = [word for word in re.split(r"[^a-z0-9]+", name)
+		if len(word) > 1 and word not in NAME_PARTICLES]
+	if len(words) > 2:
+		words = [words[0], words[-1]]
+
+	return " ".join(words)
+
+
+
+def author_key (name, affiliation):
+	'''
+	The key of an author in the index: a hash of the normalized name and
+	affiliation.
+
+	Parameters
+	----------
+	name : str
+		The author's name.
+	affiliation : str
+		The author's school, like "ISEP".
+
+	Returns
+	-------
+	str
+		The key (hexadecimal).
+	'''
+
+	key = normalize_name(name) + "\n" + affiliation.strip().upper()
+
+	return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+
+class IdentityIndex (object):
+	'''
+	The identities of each author across the platforms, kept in a SQLite
+	database (it can share the file of a `MetricsStore`).
+
+	Parameters
+	----------
+	path : str
+		Path of the database file (created if needed).
+	'''
+
+	def __init__(self, path="metrics.sqlite3"):
+		self.path = path
+		# `timeout` so that several processes can share the same file
+		self.conn = sqlite3.connect(path, timeout=30)
+		self.conn.execute('''
+			CREATE TABLE IF NOT EXISTS identities (
+				author_key TEXT NOT NULL,
+				platform TEXT NOT NULL,
+				platform_id TEXT NOT NULL,
+				name TEXT,
+				affiliation TEXT,
+				PRIMARY KEY (platform, platform_id)
+			)
+		''')
+		self.conn.execute("CREATE INDEX IF NOT EXISTS identities_author ON identities (author_key)")
+		self.conn.commit()
+
+
+	def link (self, platform, platform_id, name, affiliation):
+		'''
+		Add (or update) the identity of an author on a platform.
+
+		Parameters
+		----------
+		platform : str
+			"scholar", "researchgate" or "academia".
+		platform_id : str
+			The author's id on the platform (like a Scholar `user=` id or a
+			ResearchGate `data-account-key`).
+		name : str
+			The author's name, as shown on the platform.
+		affiliation : str
+			The author's school, like "ISEP".
+
+		Returns
+		-------
+		str
+			The key of the author.
+		'''
+
+		key = author_key(name, affiliation)
+		self.conn.execute(
+			"INSERT OR REPLACE INTO identities (author_key, platform, platform_id, name, affiliation) VALUES (?, ?, ?, ?, ?)",
+			(key, platform, platform_id, name, affiliation))
+		self.conn.commit()
+
+		return key
+
+
+	def link_many (self, platform, identities, affiliation):
+		'''
+		Add the identities of several authors of the same school at once.
+
+		Parameters
+		----------
+		platform : str
+			The platform of the identities.
+		identities : iterable
+			`(platform_id, name)` tuples.
+		affiliation : str
+			The school of the authors.
+		'''
+
+		self.conn.executemany(
+			"INSERT OR REPLACE INTO identities (author_key, platform, platform_id, name, affiliation) VALUES (?, ?, ?, ?, ?)",
+			[(author_key(name, affiliation), platform, platform_id, name, affiliation)
+				for platform_id, name in identities])
+		self.conn.commit()
+
+
+	def lookup (self, name, affiliation):
+		'''
+		Find the identities of an author.
+
+		Parameters
+		----------
+		name : str
+			The author's name (on any platform).
+		affiliation : str
+			The author's school.
+
+		Returns
+		-------
+		dict
+			Dictionary of the type `platform: platform_id` (empty if the
+			author isn't in the index).
+		'''
+
+		rows = self.conn.execute(
+			"SELECT platform, platform_id FROM identities WHERE author_key = ?", (author_key(name, affiliation),))
+
+		return dict(rows.fetchall())
+
+
+	def identities_of (self, platform, platform_id):
+		'''
+		Find the identities on every platform of the author with a given
+		identity.
+
+		Returns
+		-------
+		dict
+			Dictionary of the type `platform: platform_id` (empty if the
+			identity isn't in the index).
+		'''
+
+		rows = self.conn.execute('''
+			SELECT other.platform, other.platform_id FROM identities AS this
+			JOIN identities AS other ON other.author_key = this.author_key
+			WHERE this.platform = ? AND this.platform_id = ?
+		''', (platform, platform_id))
+
+		return dict(rows.fetchall())
+
+
+	def missing_platforms (self, name, affiliation, platforms):
+		'''
+		The platforms on which an author hasn't been linked yet, so that the
+		search for the author can skip the others.
+
+		Parameters
+		----------
+		name : str
+			The author's name.
+		affiliation : str
+			The author's school.
+		platforms : iterable
+			The platforms to check.
+
+		Returns
+		-------
+		list
+			The platforms from `platforms` without an identity of the author.
+		'''
+
+		linked = self.lookup(name, affiliation)
+
+		return [platform for platform in platforms if platform not in linked]
+
+
+	def join (self, platform_a, platform_b):
+		'''
+		Pair the identities of the authors linked on two platforms.
+
+		Returns
+		-------
+		list
+			`(author_key, platform_a_id, platform_b_id)` tuples.
+		'''
+
+		rows = self.conn.execute('''
+			SELECT a.author_key, a.platform_id, b.platform_id FROM identities AS a
+			JOIN identities AS b ON b.author_key = a.author_key
+			WHERE a.platform = ? AND b.platform = ?
+		''', (platform_a, platform_b))
+
+		return rows.fetchall()
+
+
+	def close (self):
+		self.conn.close()
@@ -0,0 +1,155 @@
+'''
+File with an append-only journal of the work done by a script, so that a run
+that crashes can be resumed without redoing what was already scraped.
+
+Every completed unit of work (a school's list of members, a profile, a page)
+is written as one JSON line as soon as it's done. Lines are flushed right away
+but only forced to disk (`fsync`) every few records or seconds, which keeps
+writing after every profile cheap. When replaying, a last line cut short by a
+crash is simply ignored.
+'''
+
+import json
+import os
+import time
+
+
+
+class Journal (object):
+	'''
+	An append-only journal of JSON records.
+
+	Parameters
+	----------
+	path : str
+		Path of the journal file.
+	resume : bool
+		If `True`, keep the records already in the file (new records are
+		appended); otherwise, start a new, empty journal.
+	sync_every : int
+		Force the records to disk after this many records...
+	sync_interval : float
+		... or after this many seconds since the last time, whatever
+		comes first.
+	'''
+
+	def __init__(self, path, resume=False, sync_every=20, sync_interval=5.0):
+		self.path = path
+		self.sync_every = sync_every
+		self.sync_interval = sync_interval
+		# Records already in the journal (only when resuming)
+		self.records = list(replay(path)) if resume else []
+		if resume:
+			# Drop a half-written last line, if there's one (even if it's the\
+			# only line), so that the new records start on a line of their own
+			self._truncate_partial_line()
+		self._file = open(path, "a" if resume else "w", encoding="utf-8")
+		self._unsynced = 0
+		self._last_sync = time.monotonic()
+
+
+	def _truncate_partial_line (self):
+		'''
+		Cut the file after its last complete line.
+		'''
+
+		try:
+			f = open(self.path, "rb+")
+		except FileNotFoundError:
+			return
+
+		with f:
+			data = f.read()
+			if data and not data.endswith(b"\n"):
+				f.truncate(data.rfind(b"\n") + 1)
+
+
+	def append (self, kind, **fields):
+		'''
+		Write a record to the journal.
+
+		Parameters
+		----------
+		kind : str
+			The type of record (like "profile" or "members").
+		**fields
+			The contents of the record (must be serializable to JSON).
+		'''
+
+		record = dict(fields, kind=kind)
+		self._file.write(json.dumps(record) + "\n")
+		self._file.flush()
+		self.records.append(record)
+		self._unsynced += 1
+		if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+			self.sync()
+
+
+	def sync (self):
+		'''
+		Force every record written so far to disk.
+		'''
+
+		self._file.flush()
+		os.fsync(self._file.fileno())
+		self._unsynced = 0
+		self._last_sync = time.monotonic()
+
+
+	def of_kind (self, kind):
+		'''
+		Get the records of a given type.
+
+		Returns
+		-------
+		list
+			The records, in the order they were written.
+		'''
+
+		return [record for record in self.records if record["kind"] == kind]
+
+
+	def close (self):
+		self.sync()
+		self._file.close()
+
+
+	def __enter__ (self):
+		return self
+
+
+	def __exit__ (self, *exc_info):
+		self.close()
+
+
+
+def replay (path):
+	'''
+	Read the records of a journal.
+
+	Parameters
+	----------
+	path : str
+		Path of the journal file. A missing file has no records.
+
+	Yields
+	------
+	record : dict
+		Each complete record, in the order they were written.
+	'''
+
+	try:
+		f = open(path, encoding="utf-8")
+	except FileNotFoundError:
+		return
+
+	with f:
+		for line in f:
+			# A line without a newline at the end was being written when\
+			# the script stopped, so it can't be trusted
+			if not line.endswith("\n"):
+				break
+			try:
+				yield json.loads(line)
+			except ValueError:
+				break
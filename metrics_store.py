@@ -0,0 +1,192 @@
+'''
+File with a small SQLite store of the metrics scraped for each profile (or
+page), along with when they were fetched.
+
+With it, a run doesn't need to visit every profile again: only the profiles
+that are new, that haven't been fetched for a while, or whose cheap
+"fingerprint" (for example, the citations shown in a list of results) has
+changed. The totals of each school are then computed from the store.
+'''
+
+import sqlite3
+import time
+
+
+# Metrics that can be stored for a profile (not every platform has all of\
+# them)
+METRICS = ("publications", "citations", "h_index", "i10_index", "reads", "views")
+
+
+
+class MetricsStore (object):
+	'''
+	Per-profile metrics kept in a SQLite database.
+
+	Parameters
+	----------
+	path : str
+		Path of the database file (created if needed).
+	'''
+
+	def __init__(self, path="metrics.sqlite3"):
+		self.path = path
+		# `timeout` so that several processes can share the same file
+		self.conn = sqlite3.connect(path, timeout=30)
+		self.conn.execute(f'''
+			CREATE TABLE IF NOT EXISTS profiles (
+				platform TEXT NOT NULL,
+				school TEXT NOT NULL,
+				profile TEXT NOT NULL,
+				fetched_at REAL NOT NULL,
+				fingerprint TEXT,
+				{", ".join(metric + " INTEGER" for metric in METRICS)},
+				PRIMARY KEY (platform, profile)
+			)
+		''')
+		self.conn.commit()
+
+
+	def save (self, platform, school, profile, metrics, fingerprint=None):
+		'''
+		Store (or replace) the metrics of a profile.
+
+		Parameters
+		----------
+		platform : str
+			"scholar", "researchgate" or "academia".
+		school : str
+			The school the profile belongs to, like "ISEP".
+		profile : str
+			The URL of the profile (or page).
+		metrics : dict
+			The scraped metrics; the keys must be in `METRICS`.
+		fingerprint : str, optional
+			A cheap value that changes when the profile changes.
+		'''
+
+		unknown = set(metrics) - set(METRICS)
+		if unknown:
+			raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+
+		columns = ["platform", "school", "profile", "fetched_at", "fingerprint"] + list(metrics)
+		values = [platform, school, profile, time.time(), fingerprint] + list(metrics.values())
+		self.conn.execute(
+			f"INSERT OR REPLACE INTO profiles ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+			values)
+		self.conn.commit()
+
+
+	def needs_refresh (self, platform, profile, max_age, fingerprint=None):
+		'''
+		Check if a profile has to be scraped (again).
+
+		Parameters
+		----------
+		platform : str
+			The platform of the profile.
+		profile : str
+			The URL of the profile (or page).
+		max_age : float
+			Seconds after which stored metrics are considered stale.
+		fingerprint : str, optional
+			The profile's current fingerprint. If given and different from
+			the stored one, the profile has changed.
+
+		Returns
+		-------
+		bool
+			`True` if the profile is new, stale or has changed.
+		'''
+
+		row = self.conn.execute(
+			"SELECT fetched_at, fingerprint FROM profiles WHERE platform = ? AND profile = ?",
+			(platform, profile)).fetchone()
+		if row is None:
+			return True
+		fetched_at, stored_fingerprint = row
+		if time.time() - fetched_at > max_age:
+			return True
+
+		return fingerprint is not None and fingerprint != stored_fingerprint
+
+
+	def metrics_of (self, platform, profile):
+		'''
+		Get the stored metrics of a profile.
+
+		Parameters
+		----------
+		platform : str
+			The platform of the profile.
+		profile : str
+			The URL of the profile (or page).
+
+		Returns
+		-------
+		dict
+			The metrics that were scraped for the profile, or `None` if it
+			isn't in the store.
+		'''
+
+		row = self.conn.execute(
+			f"SELECT {', '.join(METRICS)} FROM profiles WHERE platform = ? AND profile = ?",
+			(platform, profile)).fetchone()
+		if row is None:
+			return None
+
+		return {metric: value for metric, value in zip(METRICS, row) if value is not None}
+
+
+	def forget_missing (self, platform, school, profiles):
+		'''
+		Delete the profiles of a school that are not in the given list (for
+		example, members that left the school).
+
+		Parameters
+		----------
+		platform : str
+			The platform of the profiles.
+		school : str
+			The school.
+		profiles : iterable
+			The URLs of the school's current profiles.
+		'''
+
+		keep = set(profiles)
+		stored = self.conn.execute(
+			"SELECT profile FROM profiles WHERE platform = ? AND school = ?", (platform, school)).fetchall()
+		self.conn.executemany(
+			"DELETE FROM profiles WHERE platform = ? AND profile = ?",
+			[(platform, profile) for (profile,) in stored if profile not in keep])
+		self.conn.commit()
+
+
+	def school_totals (self, platform, metric):
+		'''
+		Sum a metric over the stored profiles of each school.
+
+		Parameters
+		----------
+		platform : str
+			The platform of the profiles.
+		metric : str
+			One of `METRICS`.
+
+		Returns
+		-------
+		totals : dict
+			Dictionary of the type `school: total`.
+		'''
+
+		if metric not in METRICS:
+			raise ValueError(f"Unknown metric: {metric}")
+
+		rows = self.conn.execute(
+			f"SELECT school, COALESCE(SUM({metric}), 0) FROM profiles WHERE platform = ? GROUP BY school",
+			(platform,))
+
+		return dict(rows.fetchall())
+
+
+	def close (self):
+		self.conn.close()
@@ -0,0 +1,369 @@
+'''
+File with a compact, column-oriented table of per-profile metrics, and the
+per-school aggregations we compute over it.
+
+The scrapers keep their metrics in a `MetricsStore` while they run, and build
+the table from it at the end of a run (so it also has the profiles skipped by
+--incremental or --resume). A profile going in or out of the table is a
+small slotted record, but the table itself is kept by column: the metrics as
+packed integer arrays (8 bytes per value, not a Python object each), and the
+platforms and schools as codes into a short list of names. Aggregating a
+metric per school sorts the row numbers by school and value a single time
+(in plain Python, since numpy isn't a dependency), and then the totals,
+distributions and percentiles of every school come out of contiguous slices
+of the sorted values.
+
+The table is saved in a small binary format of our own (a JSON header
+followed by the raw arrays), or as a Parquet file if `pyarrow` is installed.
+'''
+
+from array import array
+import bisect
+import json
+import struct
+import sys
+
+from metrics_store import METRICS
+from tracing import percentile
+
+# `pyarrow` is optional: it's only needed to read and write Parquet files
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+
+# Value stored for metrics that a profile doesn't have (for example, the\
+# h-index of a ResearchGate profile). It's left out of the aggregations
+MISSING = -1
+
+# First bytes of a file in our binary format
+MAGIC = b"PTAB1\n"
+
+# Percentiles computed by default for every school
+DEFAULT_PERCENTILES = (25, 50, 75, 90, 99)
+
+
+
+class ProfileRecord (object):
+	'''
+	The metrics of a single profile (or page).
+
+	Parameters
+	----------
+	platform : str
+		"scholar", "researchgate" or "academia".
+	school : str
+		The school the profile belongs to.
+	profile : str
+		The URL of the profile (or page).
+	**metrics
+		The metrics (keys from `METRICS`); the ones not given are `None`.
+	'''
+
+	__slots__ = ("platform", "school", "profile") + METRICS
+
+	def __init__(self, platform, school, profile, **metrics):
+		unknown = set(metrics) - set(METRICS)
+		if unknown:
+			raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+		self.platform = platform
+		self.school = school
+		self.profile = profile
+		for metric in METRICS:
+			setattr(self, metric, metrics.get(metric))
+
+
+	def metrics (self):
+		'''
+		The metrics the profile has, as a dictionary.
+		'''
+
+		return {metric: getattr(self, metric) for metric in METRICS if getattr(self, metric) is not None}
+
+
+	def __repr__ (self):
+		return f"ProfileRecord({self.platform!r}, {self.school!r}, {self.profile!r}, **{self.metrics()!r})"
+
+
+
+class ProfileTable (object):
+	'''
+	A column-oriented table of profile records.
+	'''
+
+	def __init__(self):
+		# Names of the platforms and schools; the columns hold their index
+		self.platforms = []
+		self.schools = []
+		self._codes = {"platform": {}, "school": {}}
+		self.platform_codes = array("H")
+		self.school_codes = array("H")
+		self.profiles = []
+		self.columns = {metric: array("q") for metric in METRICS}
+
+
+	def __len__ (self):
+		return len(self.profiles)
+
+
+	def _code (self, kind, names, value):
+		'''
+		The code of a platform or school name, adding it if it's new.
+		'''
+
+		codes = self._codes[kind]
+		if value not in codes:
+			codes[value] = len(names)
+			names.append(value)
+
+		return codes[value]
+
+
+	def append (self, record):
+		'''
+		Add a record to the table.
+
+		Parameters
+		----------
+		record : ProfileRecord
+			The record.
+		'''
+
+		self.platform_codes.append(self._code("platform", self.platforms, record.platform))
+		self.school_codes.append(self._code("school", self.schools, record.school))
+		self.profiles.append(record.profile)
+		for metric in METRICS:
+			value = getattr(record, metric)
+			self.columns[metric].append(MISSING if value is None else value)
+
+
+	def __iter__ (self):
+		for i, profile in enumerate(self.profiles):
+			metrics = {metric: self.columns[metric][i] for metric in METRICS if self.columns[metric][i] != MISSING}
+			yield ProfileRecord(self.platforms[self.platform_codes[i]], self.schools[self.school_codes[i]], profile, **metrics)
+
+
+	@classmethod
+	def from_store (cls, store, platform=None):
+		'''
+		Build a table with the profiles in a `MetricsStore`.
+
+		Parameters
+		----------
+		store : metrics_store.MetricsStore
+			The store.
+		platform : str, optional
+			Only take the profiles of this platform.
+
+		Returns
+		-------
+		ProfileTable
+			The table.
+		'''
+
+		query = f"SELECT platform, school, profile, {', '.join(METRICS)} FROM profiles"
+		params = ()
+		if platform is not None:
+			query += " WHERE platform = ?"
+			params = (platform,)
+
+		table = cls()
+		for row in store.conn.execute(query, params):
+			metrics = {metric: value for metric, value in zip(METRICS, row[3:]) if value is not None}
+			table.append(ProfileRecord(row[0], row[1], row[2], **metrics))
+
+		return table
+
+
+	def group_by_school (self, metric, platform=None, percentiles=DEFAULT_PERCENTILES, bins=None):
+		'''
+		Aggregate a metric per school.
+
+		Parameters
+		----------
+		metric : str
+			One of `METRICS`.
+		platform : str, optional
+			Only take the profiles of this platform.
+		percentiles : tuple
+			The percentiles (0 to 100) to compute.
+		bins : list, optional
+			Increasing edges of the bins of the distribution. A value `v`
+			falls in bin `i` if `bins[i] <= v < bins[i + 1]`, and in the last
+			bin if it's at least the last edge (values below the first edge
+			are counted in the first bin). Defaults to 0, 1 and powers of ten.
+
+		Returns
+		-------
+		summary : dict
+			Dictionary of the type `school: statistics`, where the statistics
+			are the number of profiles with the metric ("count"), "total",
+			"mean", "min", "max", a "p<N>" entry per percentile and the
+			"distribution" (number of profiles per bin).
+		'''
+
+		if metric not in METRICS:
+			raise ValueError(f"Unknown metric: {metric}")
+
+		values = self.columns[metric]
+		platform_code = self._codes["platform"].get(platform) if platform is not None else None
+		if platform is not None and platform_code is None:
+			return {}
+
+		# Keep the rows with the metric (of the platform), ordered by school\
+		# and then by value, so that each school is a sorted slice
+		rows = [i for i in range(len(values)) if values[i] != MISSING
+			and (platform_code is None or self.platform_codes[i] == platform_code)]
+		school_codes = self.school_codes
+		rows.sort(key=lambda i: (school_codes[i], values[i]))
+		sorted_values = array("q", (values[i] for i in rows))
+		sorted_schools = array("H", (school_codes[i] for i in rows))
+
+		if bins is None:
+			largest = max(sorted_values, default=0)
+			bins = [0]
+			while bins[-1] <= largest:
+				bins.append(max(1, bins[-1] * 10))
+
+		summary = {}
+		start = 0
+		while start < len(sorted_values):
+			code = sorted_schools[start]
+			# End of this school's slice
+			end = bisect.bisect_right(sorted_schools, code, start)
+			summary[self.schools[code]] = _describe(sorted_values[start:end], percentiles, bins)
+			start = end
+
+		return summary
+
+
+	def save (self, path):
+		'''
+		Save the table to a file: Parquet if the path ends with ".parquet"
+		(needs `pyarrow`), our own binary format otherwise.
+		'''
+
+		if path.endswith(".parquet"):
+			if pyarrow is None:
+				raise ImportError("Writing Parquet files needs pyarrow")
+			data = {
+				"platform": [self.platforms[code] for code in self.platform_codes],
+				"school": [self.schools[code] for code in self.school_codes],
+				"profile": self.profiles
+			}
+			for metric in METRICS:
+				data[metric] = [None if value == MISSING else value for value in self.columns[metric]]
+			pyarrow.parquet.write_table(pyarrow.table(data), path)
+			return
+
+		header = json.dumps({
+			"rows": len(self),
+			"platforms": self.platforms,
+			"schools": self.schools,
+			"profiles": self.profiles,
+			"metrics": list(METRICS),
+			"byteorder": sys.byteorder
+		}).encode("utf-8")
+		with open(path, "wb") as f:
+			f.write(MAGIC)
+			f.write(struct.pack("<Q", len(header)))
+			f.write(header)
+			self.platform_codes.tofile(f)
+			self.school_codes.tofile(f)
+			for metric in METRICS:
+				self.columns[metric].tofile(f)
+
+
+	@classmethod
+	def load (cls, path):
+		'''
+		Load a table saved with `save`.
+		'''
+
+		table = cls()
+
+		if path.endswith(".parquet"):
+			if pyarrow is None:
+				raise ImportError("Reading Parquet files needs pyarrow")
+			data = pyarrow.parquet.read_table(path).to_pydict()
+			for i, profile in enumerate(data["profile"]):
+				metrics = {metric: data[metric][i] for metric in METRICS
+					if metric in data and data[metric][i] is not None}
+				table.append(ProfileRecord(data["platform"][i], data["school"][i], profile, **metrics))
+			return table
+
+		with open(path, "rb") as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError(f"{path} isn't a profile table")
+			(header_size,) = struct.unpack("<Q", f.read(8))
+			header = json.loads(f.read(header_size))
+			rows = header["rows"]
+			table.platforms = header["platforms"]
+			table.schools = header["schools"]
+			table._codes = {
+				"platform": {name: code for code, name in enumerate(table.platforms)},
+				"school": {name: code for code, name in enumerate(table.schools)}
+			}
+			table.profiles = header["profiles"]
+			columns = [table.platform_codes, table.school_codes] + [table.columns[metric] for metric in header["metrics"]]
+			for column in columns:
+				column.fromfile(f, rows)
+				if header["byteorder"] != sys.byteorder:
+					column.byteswap()
+
+		return table
+
+
+
+def _describe (values, percentiles, bins):
+	'''
+	The statistics of a school's sorted values (see
+	`ProfileTable.group_by_school`).
+	'''
+
+	total = sum(values)
+	stats = {
+		"count": len(values),
+		"total": total,
+		"mean": total / len(values),
+		"min": values[0],
+		"max": values[-1]
+	}
+	for p in percentiles:
+		stats[f"p{p:g}"] = percentile(values, p)
+
+	# The values are sorted, so the number of values in each bin is the\
+	# distance between the positions of its edges
+	edges = [0] + [bisect.bisect_left(values, edge) for edge in bins[1:]] + [len(values)]
+	stats["distribution"] = {
+		f"{bins[i]}-{bins[i + 1]}" if i + 1 < len(bins) else f"{bins[i]}+": edges[i + 1] - edges[i]
+		for i in range(len(bins))
+	}
+
+	return stats
+
+
+
+if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Summarize a metric per school from a table of profiles.")
+	parser.add_argument("table",
+		help="file saved by one of the scrapers (or a SQLite store, if it ends with .sqlite3)")
+	parser.add_argument("metric", choices=METRICS)
+	parser.add_argument("--platform",
+		help="only take the profiles of this platform")
+	args = parser.parse_args()
+
+	if args.table.endswith(".sqlite3"):
+		from metrics_store import MetricsStore
+		store = MetricsStore(args.table)
+		table = ProfileTable.from_store(store)
+		store.close()
+	else:
+		table = ProfileTable.load(args.table)
+
+	for school, stats in table.group_by_school(args.metric, platform=args.platform).items():
+		print(school, json.dumps(stats))
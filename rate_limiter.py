@@ -0,0 +1,360 @@
+'''
+File with a per-host rate limiter that finds the fastest pace a site puts up
+with, and backs off as soon as the site starts blocking us.
+
+Google Scholar and ResearchGate throttle clients that ask for too much, and
+they do it by answering with a 429, by redirecting to a CAPTCHA or by
+showing an interstitial page instead of the one we asked for. Parsed as if
+nothing happened, those pages look like profiles without any citations, so
+they are detected here (`detect_block`) and turned into a `BlockedError`,
+which the callers handle by trying the page again later instead of counting
+it as a zero.
+
+Each host has its own limits: how many requests may be in flight at once and
+how long to wait between the start of two requests. They follow the AIMD
+rule (additive increase, multiplicative decrease) used by TCP to share a
+link: every successful request raises the concurrency a little (about one
+more request per round of requests) and the rate of requests a little,
+while a block halves both and pauses the host for a while. The pace ends up
+oscillating just below the point where the site starts blocking us.
+'''
+
+from urllib.parse import urlsplit
+import threading
+import time
+
+import tracing
+
+
+# Limits each site starts with: requests in flight, maximum requests in\
+# flight, and seconds between the start of two requests (also the shortest\
+# delay the limiter goes down to). A host also matches the entries for its\
+# parent domains. Sites not listed here use `DEFAULT_LIMITS`, whose delay is\
+# short but not zero, so that halving the rate after a block slows them too
+HOST_LIMITS = {
+	"scholar.google.pt": (1, 4, 1.0),
+	"www.researchgate.net": (2, 6, 0.5),
+	"academia.edu": (2, 8, 0.2)
+}
+DEFAULT_LIMITS = (2, 8, 0.05)
+
+# What a successful request adds to the concurrency (divided by the current\
+# concurrency, so about this much per round of requests) and to the rate\
+# (requests per second, the inverse of the delay), and what a block\
+# multiplies them by
+CONCURRENCY_INCREASE = 1.0
+RATE_INCREASE = 0.1
+DECREASE = 0.5
+
+# Longest delay the limiter goes up to
+MAX_DELAY = 60.0
+
+# Seconds a host is paused after a block (doubled with each block in a row,\
+# unless the site tells us how long to wait), and the longest pause
+BLOCK_COOLDOWN = 30.0
+MAX_COOLDOWN = 15 * 60.0
+
+# Times a script scraping one page at a time asks again for a blocked page\
+# (after its host's pause) before leaving it out
+BLOCKED_RETRIES = 3
+
+# Signs that a page is a block and not the page we asked for: parts of the\
+# URL we are redirected to, and pieces of the HTML of CAPTCHAs and\
+# interstitials (only pieces that ordinary pages don't have: the scripts of\
+# Cloudflare's "challenge-platform" are in many pages that loaded fine)
+BLOCKED_STATUSES = {429}
+BLOCKED_URL_MARKERS = ("/sorry/", "/captcha", "/cdn-cgi/challenge")
+BLOCKED_PAGE_MARKERS = (
+	"gs_captcha_f",
+	"id=\"captcha-form\"",
+	"unusual traffic from your computer network",
+	"cf-browser-verification",
+	"id=\"challenge-form\"",
+	"<title>Just a moment...</title>",
+	"Please verify you are a human"
+)
+# Pieces of Cloudflare's challenge pages that are only a sign of a block\
+# when the page comes with one of these statuses
+CHALLENGE_STATUSES = {403, 503}
+CHALLENGE_PAGE_MARKERS = ("cf-chl", "cf_chl")
+
+# Outcomes of a request, as told to `HostLimiter.release`
+OK = "ok"
+BLOCKED = "blocked"
+ERROR = "error"
+
+
+
+class BlockedError (Exception):
+	'''
+	Raised when a site answers with a block (a 429, a CAPTCHA, an
+	interstitial...) instead of the page we asked for.
+
+	Parameters
+	----------
+	url : str
+		The URL we asked for.
+	reason : str
+		How the block was detected.
+	retry_after : float, optional
+		Seconds the site asked us to wait, if it did.
+	'''
+
+	def __init__(self, url, reason, retry_after=None):
+		super().__init__(f"{url} was blocked ({reason})")
+		self.url = url
+		self.reason = reason
+		self.retry_after = retry_after
+
+
+
+def detect_block (url, status, html):
+	'''
+	Check if a response is a block instead of the page we asked for.
+
+	Parameters
+	----------
+	url : str
+		The final URL of the response (after following redirects).
+	status : int
+		The HTTP status code.
+	html : str
+		The HTML of the response.
+
+	Returns
+	-------
+	str
+		How the block was detected, or `None` if the page isn't a block.
+	'''
+
+	if status in BLOCKED_STATUSES:
+		return f"HTTP {status}"
+	for marker in BLOCKED_URL_MARKERS:
+		if marker in url:
+			return f"redirected to {url}"
+	for marker in BLOCKED_PAGE_MARKERS:
+		if marker in html:
+			return f"page with {marker!r}"
+	if status in CHALLENGE_STATUSES:
+		for marker in CHALLENGE_PAGE_MARKERS:
+			if marker in html:
+				return f"HTTP {status} page with {marker!r}"
+
+	return None
+
+
+
+def raise_if_blocked (url, status, html):
+	'''
+	Raise a `BlockedError` if a response is a block (see `detect_block`).
+	'''
+
+	reason = detect_block(url, status, html)
+	if reason is not None:
+		raise BlockedError(url, reason)
+
+
+
+def retry_after (page):
+	'''
+	The seconds a page's `Retry-After` header asks us to wait (`None` if
+	there's no such header, or if it's a date).
+	'''
+
+	headers = getattr(page, "headers", None)
+	try:
+		return float(headers.get("Retry-After"))
+	except (AttributeError, TypeError, ValueError):
+		return None
+
+
+
+class HostLimiter (object):
+	'''
+	The limits of a single host, adjusted with every request.
+
+	Parameters
+	----------
+	concurrency : float
+		Requests in flight at first.
+	max_concurrency : int
+		Maximum requests in flight.
+	delay : float
+		Seconds between the start of two requests at first, and the
+		shortest delay the limiter goes down to.
+	'''
+
+	def __init__(self, concurrency, max_concurrency, delay):
+		self.concurrency = float(concurrency)
+		self.max_concurrency = max_concurrency
+		self.delay = delay
+		self.min_delay = delay
+		self.in_flight = 0
+		# Requests made and blocks seen
+		self.requests = 0
+		self.blocks = 0
+		# Blocks in a row, and when the host can be asked again
+		self._streak = 0
+		self._paused_until = 0.0
+		self._next_start = 0.0
+		self._cond = threading.Condition()
+
+
+	def acquire (self):
+		'''
+		Wait until a request can be made to the host.
+		'''
+
+		with self._cond:
+			while True:
+				now = time.monotonic()
+				wait = max(self._paused_until, self._next_start) - now
+				if wait <= 0 and self.in_flight < int(self.concurrency):
+					break
+				# Wake up when the delay is over, or when a request ends
+				self._cond.wait(wait if wait > 0 else None)
+			self.in_flight += 1
+			self.requests += 1
+			self._next_start = now + self.delay
+
+
+	def release (self, outcome=OK, retry_after=None):
+		'''
+		Report how a request ended, and adjust the limits.
+
+		Parameters
+		----------
+		outcome : str
+			`OK`, `BLOCKED` or `ERROR` (like a timeout, which says nothing
+			about the pace).
+		retry_after : float, optional
+			With a block, the seconds the site asked us to wait.
+		'''
+
+		with self._cond:
+			self.in_flight -= 1
+			now = time.monotonic()
+			if outcome == OK:
+				self._streak = 0
+				self.concurrency = min(self.max_concurrency, self.concurrency + CONCURRENCY_INCREASE / self.concurrency)
+				if self.delay > self.min_delay:
+					self.delay = max(self.min_delay, 1 / (1 / self.delay + RATE_INCREASE))
+			elif outcome == BLOCKED:
+				self.blocks += 1
+			# The requests that were in flight when the host was paused\
+			# were made at the old pace, so they don't make it back off again
+			if outcome == BLOCKED and now >= self._paused_until:
+				self._streak += 1
+				self.concurrency = max(1.0, self.concurrency * DECREASE)
+				self.delay = min(MAX_DELAY, self.delay / DECREASE)
+				cooldown = retry_after if retry_after is not None else BLOCK_COOLDOWN * 2 ** (self._streak - 1)
+				self._paused_until = now + min(MAX_COOLDOWN, cooldown)
+			self._cond.notify_all()
+
+
+
+class RateLimiter (object):
+	'''
+	The limits of every host.
+
+	Parameters
+	----------
+	limits : dict, optional
+		The limits each site starts with, as a dictionary of the type
+		`host: (concurrency, max_concurrency, delay)`. Defaults to
+		`HOST_LIMITS`.
+	default_limits : tuple
+		The limits of the hosts that aren't in `limits`.
+	'''
+
+	def __init__(self, limits=None, default_limits=DEFAULT_LIMITS):
+		self.limits = HOST_LIMITS if limits is None else limits
+		self.default_limits = default_limits
+		self._hosts = {}
+		self._lock = threading.Lock()
+
+
+	def host (self, url):
+		'''
+		The limiter of a URL's host (created when the host is first seen).
+		'''
+
+		host = urlsplit(url).hostname or ""
+		with self._lock:
+			if host not in self._hosts:
+				limits = self.default_limits
+				# Try the host, then its parent domains
+				labels = host.split(".")
+				for i in range(len(labels)):
+					domain = ".".join(labels[i:])
+					if domain in self.limits:
+						limits = self.limits[domain]
+						break
+				self._hosts[host] = HostLimiter(*limits)
+			return self._hosts[host]
+
+
+	def stats (self):
+		'''
+		The current limits of every host.
+
+		Returns
+		-------
+		dict
+			Dictionary of the type `host: statistics` (requests, blocks,
+			concurrency and delay).
+		'''
+
+		with self._lock:
+			return {host: {"requests": limiter.requests, "blocks": limiter.blocks,
+				"concurrency": round(limiter.concurrency, 2), "delay": round(limiter.delay, 2)}
+				for host, limiter in self._hosts.items()}
+
+
+
+class ThrottledBackend (object):
+	'''
+	Wrap a backend from `fetch_backend` so that its requests follow the
+	limits of a `RateLimiter`, and blocks are raised as `BlockedError`s.
+
+	Parameters
+	----------
+	backend : object
+		The backend that actually fetches the pages.
+	limiter : RateLimiter
+		The limits (it can be shared by several backends).
+	retries : int
+		Times a blocked page is asked for again (once its host's pause is
+		over) before raising. Callers that can put the page back in their
+		own queue should use 0.
+	'''
+
+	def __init__(self, backend, limiter, retries=0):
+		self.backend = backend
+		self.limiter = limiter
+		self.retries = retries
+
+
+	def fetch (self, url, headers=None):
+		host = self.limiter.host(url)
+		for attempt in range(self.retries + 1):
+			with tracing.phase("wait_throttle", url=url):
+				host.acquire()
+			try:
+				page = self.backend.fetch(url, headers)
+			except BaseException:
+				host.release(ERROR)
+				raise
+			reason = detect_block(page.url, page.status, page.html)
+			if reason is None:
+				host.release(OK)
+				return page
+			# Blocks are counted in the host's statistics (see\
+			# `RateLimiter.stats`), and reported by the caller if it gives up
+			host.release(BLOCKED, retry_after(page))
+
+		raise BlockedError(url, reason, retry_after(page))
+
+
+	def close (self):
+		self.backend.close()
\ No newline at end of file
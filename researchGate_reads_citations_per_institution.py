@@ -25,13 +25,370 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import StaleElementReferenceException
-import pickle
 import io
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from multiprocessing.util import Finalize
+from driver_pool import DriverPool, new_driver, set_default_profile, PROFILES
+from fetch_backend import HttpBackend, SeleniumBackend, FallbackBackend, needs_fallback, parse_html
+from extractors import StrategyRegistry, compile_path, select_path
+from response_cache import ResponseCache, CachedBackend
+from metrics_store import MetricsStore
+from profile_table import ProfileTable
+from identity_index import IdentityIndex
+from journal import Journal
+import tracing
+from element_lookup import find_all_now, wait_for, wait_for_all
+from rate_limiter import RateLimiter, ThrottledBackend, BlockedError, raise_if_blocked, BLOCKED_RETRIES
+from result_stream import ResultSink, school_totals
 # Python file with the credentials for our ResearchGate account
 import researchGate_id
 
 
-def get_profiles (source):
+# Root of every ResearchGate URL we build (can be pointed to a local server\
+# with saved pages to test the scraper offline)
+RESEARCHGATE_URL = "https://www.researchgate.net"
+
+
+def log_in (driver):
+	'''
+	Log into our ResearchGate account with the given driver.
+
+	Parameters
+	----------
+	driver : selenium.webdriver.Chrome
+		The driver to log in with.
+	'''
+
+	# Log in page
+	driver.get(RESEARCHGATE_URL + "/login")
+	# Type the user and password
+	wait_for(driver, By.ID, "input-login").send_keys(username)
+	driver.find_element_by_id("input-password").send_keys(password)
+	# Actually log in
+	driver.find_element_by_class_name("nova-c-button__label").find_element(By.XPATH, "./..").click()
+
+
+
+def is_login_page (url):
+	'''
+	Check if a URL is ResearchGate's log in page, which is where we end up
+	when our session has expired.
+	'''
+
+	return "/login" in url
+
+
+
+def is_login_form (page):
+	'''
+	Check if a fetched page is ResearchGate's log in page (even if it was
+	shown at the URL we asked for), so that it's never cached or parsed as
+	the page we wanted.
+
+	Parameters
+	----------
+	page : fetch_backend.Page
+		The page.
+	'''
+
+	return is_login_page(page.url) or 'id="input-login"' in page.html
+
+
+
+class SessionManager (object):
+	'''
+	Log into ResearchGate once and share the session's cookies with every
+	driver and HTTP backend (even across processes, through a file), so
+	that we only log in again when the session expires.
+
+	Parameters
+	----------
+	path : str
+		File where the cookies are saved.
+	'''
+
+	def __init__(self, path="researchGate_cookies.json"):
+		self.path = path
+		self._cookies = None
+		self._lock = threading.Lock()
+
+
+	def _load (self):
+		'''
+		Read the cookies saved in the file (`None` if there's none).
+		'''
+
+		try:
+			with open(self.path, encoding="utf-8") as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+
+	def _log_in (self):
+		'''
+		Log in with a new driver, and save the session's cookies.
+		'''
+
+		driver = new_driver()
+		try:
+			log_in(driver)
+			cookies = driver.get_cookies()
+		finally:
+			driver.quit()
+		# Write to a temporary file first so that other processes never read\
+		# a half-written file
+		tmp_path = f"{self.path}.{os.getpid()}.tmp"
+		with open(tmp_path, "w", encoding="utf-8") as f:
+			json.dump(cookies, f)
+		os.replace(tmp_path, self.path)
+
+		return cookies
+
+
+	def cookies (self):
+		'''
+		Get the session's cookies, logging in only if there's no saved
+		session.
+
+		Returns
+		-------
+		list
+			The cookies, as dictionaries (like `driver.get_cookies()`).
+		'''
+
+		with self._lock:
+			if self._cookies is None:
+				self._cookies = self._load() or self._log_in()
+			return self._cookies
+
+
+	def refresh (self, expired_cookies):
+		'''
+		Get a new session after finding out the given cookies have expired.
+
+		If another driver or process has already logged in again (the saved
+		cookies are not the expired ones), its session is used instead of
+		logging in once more.
+
+		Parameters
+		----------
+		expired_cookies : list
+			The cookies that were found to be expired.
+
+		Returns
+		-------
+		list
+			The new cookies.
+		'''
+
+		with self._lock:
+			saved = self._load()
+			if saved is not None and saved != expired_cookies:
+				self._cookies = saved
+			else:
+				self._cookies = self._log_in()
+			return self._cookies
+
+
+	def inject (self, driver, cookies=None):
+		'''
+		Add the session's cookies to a driver.
+
+		Parameters
+		----------
+		driver : selenium.webdriver.Chrome
+			The driver.
+		cookies : list, optional
+			The cookies to add. Defaults to the current session's.
+		'''
+
+		# Cookies can only be set for the domain of the current page
+		driver.get(RESEARCHGATE_URL)
+		for cookie in cookies or self.cookies():
+			driver.add_cookie({key: value for key, value in cookie.items() if key in ("name", "value", "domain", "path", "secure", "httpOnly", "expiry")})
+
+
+	def cookie_header (self, cookies=None):
+		'''
+		The value of the `Cookie` header for HTTP requests.
+		'''
+
+		return "; ".join(f"{cookie['name']}={cookie['value']}" for cookie in cookies or self.cookies())
+
+
+
+class AuthenticatedBackend (object):
+	'''
+	Wrap a backend from `fetch_backend` so that requests carry the
+	session's cookies, logging in again if a request ends up in the log in
+	page.
+
+	Parameters
+	----------
+	backend : object
+		The backend that actually fetches the pages.
+	sessions : SessionManager
+		Where the cookies come from.
+	'''
+
+	def __init__(self, backend, sessions):
+		self.backend = backend
+		self.sessions = sessions
+
+
+	def fetch (self, url, headers=None):
+		cookies = self.sessions.cookies()
+		request_headers = dict(headers or {}, Cookie=self.sessions.cookie_header(cookies))
+		page = self.backend.fetch(url, request_headers)
+		# Our session has expired, so get a new one and try again
+		if is_login_form(page) and not is_login_page(url):
+			cookies = self.sessions.refresh(cookies)
+			request_headers["Cookie"] = self.sessions.cookie_header(cookies)
+			page = self.backend.fetch(url, request_headers)
+
+		return page
+
+
+	def close (self):
+		self.backend.close()
+
+
+
+# Number of pages of members fetched at the same time by `get_profiles()`
+LISTING_FETCHERS = 8
+
+# Shared session (set when the script runs); if there's none, every driver\
+# logs in on its own
+sessions = None
+
+
+def new_logged_in_driver ():
+	'''
+	Create a new driver that is already logged into our account (used as
+	the factory of driver pools).
+
+	Returns
+	-------
+	driver : selenium.webdriver.Chrome
+		The logged in driver.
+	'''
+
+	driver = new_driver()
+	# Reuse the shared session instead of going through the log in page
+	if sessions is not None:
+		sessions.inject(driver)
+	else:
+		log_in(driver)
+
+	return driver
+
+
+
+def get_logged_in (driver, url):
+	'''
+	Open a page in a logged in driver, logging in again (through the shared
+	session) if the session has expired.
+
+	Parameters
+	----------
+	driver : selenium.webdriver.Chrome
+		The driver.
+	url : str
+		The URL of the page.
+	'''
+
+	with tracing.phase("driver_get", url=url):
+		driver.get(url)
+	if is_login_page(driver.current_url) and not is_login_page(url):
+		with tracing.phase("log_in"):
+			if sessions is not None:
+				sessions.inject(driver, sessions.refresh(sessions.cookies()))
+			else:
+				log_in(driver)
+		with tracing.phase("driver_get", url=url):
+			driver.get(url)
+
+
+
+def parse_last_page (root):
+	'''
+	Extract the number of pages of members from a parsed page of members.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of members.
+
+	Returns
+	-------
+	last_page : int
+		The number of the last page of members.
+	'''
+
+	try:
+		last_page = int(root.find_all(class_name="navi-page-link")[-1].text.strip())
+	except:
+		last_page = 1
+
+	return last_page
+
+
+
+def parse_member_ids (root):
+	'''
+	Extract the profile ids of the members listed in a parsed page of
+	members.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of members.
+
+	Returns
+	-------
+	list
+		The `data-account-key` of each member in the page, in order.
+	'''
+
+	# We are only interested in the <li> elements that are actually about\
+	# user profiles
+	return [user.get_attribute("data-account-key") for user in root.find_all("li", class_name="people-item")]
+
+
+
+def parse_member_names (root):
+	'''
+	Extract the profile id and the name of the members listed in a parsed
+	page of members.
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed page of members.
+
+	Returns
+	-------
+	dict
+		Dictionary of the type `data-account-key: name`.
+	'''
+
+	names = {}
+	for user in root.find_all("li", class_name="people-item"):
+		name = user.find(class_name="display-name")
+		if name is not None:
+			names[user.get_attribute("data-account-key")] = name.text
+
+	return names
+
+
+
+def get_profiles (source, backend=None, driver=None, fetchers=LISTING_FETCHERS, names=None):
 	'''
 	Scrape the URLs of the user profiles for a given ResearchGate
 	institution.
@@ -40,6 +397,18 @@ def get_profiles (source):
 	----------
 	source : str
 		A string with the URL for the institution.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the pages of members are
+		fetched and parsed with it instead of being rendered by a driver.
+	driver : selenium.webdriver.Chrome, optional
+		A driver that is already logged in. If not given, a new one is
+		created (and quit at the end).
+	fetchers : int
+		With a backend, how many pages of members are fetched at the same
+		time once the number of pages is known.
+	names : dict, optional
+		With a backend, if given, it's updated with the names of the
+		members (see `parse_member_names`).
 
 	Returns
 	-------
@@ -52,20 +421,41 @@ def get_profiles (source):
 	# List to hold the profile URLs
 	user_urls = []
 
+	# Base URL for a profile page (we'll scrape the id of the profile\
+	# to be appended to this)
+	user_base_url = RESEARCHGATE_URL + "/profile/"
+
+	# The lists of members are in the pages' HTML, so there's no need for a\
+	# browser if we have a backend
+	if source != "" and backend is not None:
+		first_page = backend.fetch(source).root
+		last_page = parse_last_page(first_page)
+		user_urls.extend(user_base_url + user_id for user_id in parse_member_ids(first_page))
+		if names is not None:
+			names.update(parse_member_names(first_page))
+
+		# Once we know how many pages there are, every page is independent\
+		# of the others, so fetch them all at once
+		def page_member_ids (page_num):
+			root = backend.fetch(source.split("=")[0] + "=" + str(page_num)).root
+			if names is not None:
+				names.update(parse_member_names(root))
+			return parse_member_ids(root)
+
+		with ThreadPoolExecutor(max(1, fetchers)) as executor:
+			# `map()` returns the results in the order of the pages
+			for user_ids in executor.map(page_member_ids, range(2, last_page + 1)):
+				user_urls.extend(user_base_url + user_id for user_id in user_ids)
+
+		return user_urls
+
 	# If we passed a string with a valid URL, scrape data
-	if source != "":
-		# We'll use Google Chrome
-		driver = webdriver.Chrome()
-		# Make the driver wait 10 seconds when needed
-		driver.implicitly_wait(10)
-		# Log into an account
-		# Log in page
-		driver.get("https://www.researchgate.net/login")
-		# Type the user and password
-		driver.find_element_by_id("input-login").send_keys(username)
-		driver.find_element_by_id("input-password").send_keys(password)
-		# Actually log in
-		driver.find_element_by_class_name("nova-c-button__label").find_element(By.XPATH, "./..").click()
+	elif source != "":
+		# Only quit the driver at the end if it was created here
+		own_driver = driver is None
+		if own_driver:
+			# We'll use Google Chrome, logged into our account
+			driver = new_logged_in_driver()
 
 		# We'll start at the URL given as input to the function call
 		curr_page = source
@@ -73,15 +463,14 @@ def get_profiles (source):
 		driver.implicitly_wait(10)
 		# Get the actual first page of results (the string with the URL\
 		# passed to the function call initially)
-		driver.get(curr_page)
+		get_logged_in(driver, curr_page)
 
-		# Base URL for a profile page (we'll scrape the id of the profile\
-		# to be appended to this)
-		user_base_url = "https://www.researchgate.net/profile/"
-
-		# Find the number of result pages available
+		# Find the number of result pages available: once the members are\
+		# listed, the links to the other pages are either there or not (a\
+		# school with a single page of members has none)
 		try:
-			last_page = int(driver.find_elements_by_class_name("navi-page-link")[-1].text.strip())
+			wait_for_all(driver, By.CLASS_NAME, "people-item")
+			last_page = int(find_all_now(driver, By.CLASS_NAME, "navi-page-link")[-1].text.strip())
 		except:
 			last_page = 1
 
@@ -112,10 +501,11 @@ def get_profiles (source):
 			# Make the driver wait 10 seconds
 			driver.implicitly_wait(10)
 			# Open the new page
-			driver.get(curr_page)
+			get_logged_in(driver, curr_page)
 
 		# When the loop finishes, close the driver
-		driver.quit()
+		if own_driver:
+			driver.quit()
 
 		# Print the number of scraped profiles
 		# print("Number of profiles scraped:", len(user_urls))
@@ -129,7 +519,87 @@ def get_profiles (source):
 
 
 
-def get_school_reads_citations (profiles_list):
+# Strategies to extract a profile's reads and citations from its source. The\
+# source code of ResearchGate changes every now and then, and thus the\
+# information can be found in different elements
+profile_strategies = StrategyRegistry()
+
+# Paths (under the "about" section) of the reads and citations in the first\
+# layout, compiled only once
+ABOUT_READS_PATH = compile_path("div/div/div[2]/div/div/div[2]/div[1]")
+ABOUT_CITATIONS_PATH = compile_path("div/div/div[2]/div/div/div[3]/div[1]")
+
+
+@profile_strategies.register("about-section")
+def about_section_metrics (root):
+	'''
+	Reads and citations in the "about" section of the profile.
+	'''
+
+	about = root.find(id="about")
+	profile_reads = int(select_path(about, ABOUT_READS_PATH).text.strip())
+	profile_citations = int(select_path(about, ABOUT_CITATIONS_PATH).text.strip())
+
+	return (profile_reads, profile_citations)
+
+
+@profile_strategies.register("box-layout")
+def box_layout_metrics (root):
+	'''
+	Reads and citations in the boxes of the profile's layout, nested five
+	<div>s deep.
+	'''
+
+	items = root.find_all(class_name="application-box-layout__item")
+	values = []
+	for item in (items[3], items[1]):
+		for _ in range(5):
+			item = item.find("div")
+		values.append(int(item.text.strip()))
+
+	return tuple(values)
+
+
+
+def extract_profile_metrics (root):
+	'''
+	Extract the reads and citations of a parsed profile page, trying every
+	known layout (starting with the one that worked last).
+
+	Parameters
+	----------
+	root : fetch_backend.Element
+		The parsed profile page.
+
+	Returns
+	-------
+	tuple
+		`(reads, citations)`, or `None` if the page has none of the known
+		layouts.
+	'''
+
+	with tracing.phase("extract"):
+		return profile_strategies.extract(root)[1]
+
+
+
+def needs_browser (page):
+	'''
+	Check if a page fetched with plain HTTP has to be loaded in a browser
+	instead: when the request was refused in a way a browser may get past
+	(see `fetch_backend.needs_fallback`), or when it's a profile whose
+	metrics aren't in the HTML sent by the server. Other errors (like a
+	profile that no longer exists) are kept.
+	'''
+
+	if page.status != 200:
+		return needs_fallback(page)
+
+	return "/profile/" in page.url and extract_profile_metrics(page.root) is None
+
+
+
+def get_school_reads_citations (profiles_list, driver=None, on_profile=None, backend=None, skip_blocked=True):
 	'''
 	Scrape the totals for two variables about the members of a given school:
 	how many times their publications were read and how many the members have
@@ -139,6 +609,19 @@ def get_school_reads_citations (profiles_list):
 	----------
 	profiles_list : list
 		A list of URLs for the profiles of all the members of a single school.
+	driver : selenium.webdriver.Chrome, optional
+		A driver that is already logged in. If not given, a new one is
+		created (and quit at the end).
+	on_profile : callable, optional
+		Function called as `on_profile(profile, reads, citations)` for every
+		profile whose metrics were scraped.
+	backend : object, optional
+		A backend from `fetch_backend`. If given, the profiles are fetched
+		with it instead of being opened in a driver.
+	skip_blocked : bool
+		Whether to leave out the profiles ResearchGate blocked us from
+		(instead of raising `rate_limiter.BlockedError`). They aren't
+		counted as zeros, and `on_profile` isn't called for them.
 
 	Returns
 	-------
@@ -147,21 +630,11 @@ def get_school_reads_citations (profiles_list):
 		and total citations of its members.
 	'''
 
-	# We'll use Google Chrome
-	driver = webdriver.Chrome()
-	# Make the driver wait 10 seconds when needed
-	driver.implicitly_wait(10)
-	# Log into an account
-	# Log in page
-	driver.get("https://www.researchgate.net/login")
-	# Type the user and password
-	driver.find_element_by_id("input-login").send_keys(username)
-	driver.find_element_by_id("input-password").send_keys(password)
-	# Actually log in
-	driver.find_element_by_class_name("nova-c-button__label").find_element(By.XPATH, "./..").click()
-
-	# Make the driver wait 10 seconds
-	driver.implicitly_wait(10)
+	# Only quit the driver at the end if it was created here
+	own_driver = driver is None and backend is None
+	if own_driver:
+		# We'll use Google Chrome, logged into our account
+		driver = new_logged_in_driver()
 
 	# Running sums of the reads and citations
 	total_reads = 0
@@ -169,150 +642,415 @@ def get_school_reads_citations (profiles_list):
 
 	# Scrape information from each profile of the input list
 	for profile in profiles_list:
-		# Go to that profile
-		driver.get(profile)
-
-		# The try/except work mainly as follows: if the reads and\
-		# citations information is available in the profile, then scrape\
-		# it; otherwise ignore the profile and move on. However, sometimes\
-		# the source code of ResearchGate changes and thus the information\
-		# can be found in different elements: hence the nested `try` clause\
-		# to try to scrape both cases before ignoring the current profile
+		# Get the source of the profile, either from the backend or by\
+		# going to that profile, and parse it
 		try:
-			profile_reads = int(driver.find_element(By.XPATH, '//*[@id="about"]/div/div/div[2]/div/div/div[2]/div[1]').text.strip())
-			profile_citations = int(driver.find_element(By.XPATH, '//*[@id="about"]/div/div/div[2]/div/div/div[3]/div[1]').text.strip())
+			if backend is not None:
+				root = backend.fetch(profile).root
+			else:
+				get_logged_in(driver, profile)
+				html = driver.page_source
+				raise_if_blocked(driver.current_url, 200, html)
+				root = parse_html(html)
+		except BlockedError as error:
+			if not skip_blocked:
+				raise
+			print("Couldn't scrape", profile, "-", error)
+			continue
+
+		# If the reads and citations information is available in the\
+		# profile, then scrape it; otherwise ignore the profile and move on
+		metrics = extract_profile_metrics(root)
+		if metrics is not None:
+			profile_reads, profile_citations = metrics
 			total_reads += profile_reads
 			total_citations += profile_citations
-
-		except:
-			# If the first possible HTML elements were not found, try the\
-			# second ones; if they are also not found, ignore this profile\
-			# and move on
-			try:
-				profile_reads = int(driver.find_elements_by_class_name("application-box-layout__item")[3].\
-					find_element_by_tag_name("div").find_element_by_tag_name("div").find_element_by_tag_name("div").\
-					find_element_by_tag_name("div").find_element_by_tag_name("div").text.strip())
-				profile_citations = int(driver.find_elements_by_class_name("application-box-layout__item")[1].\
-					find_element_by_tag_name("div").find_element_by_tag_name("div").find_element_by_tag_name("div").\
-					find_element_by_tag_name("div").find_element_by_tag_name("div").text.strip())
-				total_reads += profile_reads
-				total_citations += profile_citations
-			
-			except:
-				pass
-
-		print(total_reads, total_citations)
+			if on_profile is not None:
+				on_profile(profile, profile_reads, profile_citations)
 
 	# Close the browser window
-	driver.quit()
+	if own_driver:
+		driver.quit()
 
 	return (total_reads, total_citations)
 
 
 
+# Number of profiles handed to a worker process at a time when running\
+# with `--workers`
+PROFILES_PER_TASK = 25
+
+# Each worker process has its own logged in driver (and HTTP backend),\
+# created once when the process starts
+worker_driver = None
+worker_backend = None
+worker_fetchers = LISTING_FETCHERS
+
+
+def init_worker (user, passwd, backend_name, cache_dir=None, cookies_path=None, fetchers=LISTING_FETCHERS, browser="lean"):
+	'''
+	Prepare a worker process of the pool used with `--workers`: create a
+	driver, logged into our account, that will be used for every task the
+	process runs.
+
+	Parameters
+	----------
+	user : str
+		The username of our account.
+	passwd : str
+		The password of our account.
+	backend_name : str
+		The value of the `--backend` option.
+	cache_dir : str, optional
+		The directory of the page cache, if the cache is used.
+	cookies_path : str, optional
+		The file with the session shared by every process. If not given,
+		the worker logs in on its own.
+	fetchers : int
+		Number of pages of members fetched at the same time.
+	browser : str
+		The profile of the worker's browser (see `driver_pool.PROFILES`).
+	'''
+
+	global username, password, sessions, worker_driver, worker_backend, worker_fetchers
+	# The credentials and the session are module-level variables used by\
+	# `log_in()` and `new_logged_in_driver()`
+	username = user
+	password = passwd
+	worker_fetchers = fetchers
+	set_default_profile(browser)
+	if cookies_path is not None:
+		sessions = SessionManager(cookies_path)
+	worker_driver = new_logged_in_driver()
+	if backend_name == "http":
+		limiter = RateLimiter()
+		worker_backend = ThrottledBackend(HttpBackend(), limiter, BLOCKED_RETRIES)
+		if sessions is not None:
+			worker_backend = AuthenticatedBackend(worker_backend, sessions)
+		# Like in the main process, the pages that need a browser are\
+		# loaded in one (only started if a page needs it)
+		worker_backend = FallbackBackend(worker_backend,
+			ThrottledBackend(SeleniumBackend(DriverPool(factory=new_logged_in_driver, size=1), load=get_logged_in), limiter, BLOCKED_RETRIES),
+			needs_js=needs_browser)
+		if cache_dir is not None:
+			worker_backend = CachedBackend(worker_backend, ResponseCache(cache_dir), session=user, reject=is_login_form)
+	# Quit the browser when the process exits
+	Finalize(worker_driver, worker_driver.quit, exitpriority=16)
+
+
+
+def profiles_task (source):
+	'''
+	Scrape the profile URLs (and the names of the members) of a single school
+	in a worker process.
+	'''
+
+	names = {}
+	try:
+		user_urls = get_profiles(source, backend=worker_backend, driver=worker_driver, fetchers=worker_fetchers, names=names)
+	# The error is sent back as a string, so that the main process can\
+	# report it (see `school_profiles`)
+	except BlockedError as error:
+		return (None, str(error))
+
+	return (user_urls, names)
+
+
+
+def reads_citations_task (job):
+	'''
+	Scrape the reads and citations of a batch of profiles of a single
+	school in a worker process.
+
+	Parameters
+	----------
+	job : tuple
+		`(school, profiles_list)`.
+
+	Returns
+	-------
+	(school, reads, citations, scraped) : tuple
+		`scraped` is a list of `(profile, reads, citations)` tuples, one for
+		each profile whose metrics were scraped.
+	'''
+
+	school, profiles_list = job
+	scraped = []
+	reads, citations = get_school_reads_citations(profiles_list, driver=worker_driver, backend=worker_backend,
+		on_profile=lambda *metrics: scraped.append(metrics))
+
+	return (school, reads, citations, scraped)
+
+
+
+# List with the names of the schools
+SCHOOLS = [
+	"ISEP",
+	"ISCAP",
+	"ESE",
+	"ESMAE",
+	"ESTG",
+	"ESS",
+	"ESHT",
+	"ESMAD"
+]
+
+# URLs from where we'll extract the profiles for each school. If a school\
+# has an empty string, it means that school is not present in ResearchGate
+SCHOOL_PAGES = [
+	"https://www.researchgate.net/institution/Instituto_Superior_de_Engenharia_do_Porto/members?page=1",
+	"https://www.researchgate.net/institution/Instituto_Superior_de_Contabilidade_e_Administracao_do_Porto/members?page=1",
+	"",
+	"https://www.researchgate.net/institution/Polytechnic_Institute_of_Porto/department/Escola_Superior_de_Musica_e_das_Artes_do_Espetaculo/members?page=1",
+	"https://www.researchgate.net/institution/Polytechnic_Institute_of_Porto/department/Escola_Superior_de_Tecnologia_e_Gestao_de_Felgueiras/members?page=1",
+	"https://www.researchgate.net/institution/Polytechnic_Institute_of_Porto/department/Escola_Superior_de_Tecnologia_da_Saude_do_Porto/members?page=1",
+	"",
+	""
+]
+
+
+
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Scrape reads and citations of IPP's schools from ResearchGate.")
+	parser.add_argument("--backend", choices=["http", "selenium"], default="http",
+		help="fetch the lists of members with plain HTTP requests (falling back to a browser when needed) or always with a browser")
+	parser.add_argument("--workers", type=int, default=1,
+		help="number of processes (each with its own logged in browser) to split the schools and profiles across")
+	parser.add_argument("--cache", default="page_cache",
+		help="directory of the on-disk cache of fetched pages")
+	parser.add_argument("--no-cache", action="store_true",
+		help="always fetch pages from the network")
+	parser.add_argument("--store", default="metrics.sqlite3",
+		help="SQLite file where the metrics of every profile (and the identities of the authors across platforms) are kept")
+	parser.add_argument("--incremental", action="store_true",
+		help="only scrape profiles that are new or older than --max-age, and compute the totals from the store")
+	parser.add_argument("--max-age", type=float, default=7 * 24,
+		help="hours after which a stored profile is scraped again (with --incremental)")
+	parser.add_argument("--records", default="RG_profiles.cols",
+		help="file where the metrics of every profile are saved by column (Parquet if it ends with .parquet)")
+	parser.add_argument("--output", default="RG_results.ndjson",
+		help="NDJSON file where every profile and list of members is written as soon as it's scraped")
+	parser.add_argument("--journal", default="researchGate.journal",
+		help="file where every completed school and profile is recorded")
+	parser.add_argument("--resume", action="store_true",
+		help="replay the journal of a previous run and skip the work already done")
+	parser.add_argument("--cookies", default="researchGate_cookies.json",
+		help="file where the session is saved, so that we log in only once (even across runs and workers)")
+	parser.add_argument("--fetchers", type=int, default=LISTING_FETCHERS,
+		help="number of pages of members of a school fetched at the same time")
+	parser.add_argument("--browser", choices=PROFILES, default="lean",
+		help="profile of the browsers: lean (headless, without images, fonts or trackers) or full (a normal window)")
+	parser.add_argument("--trace",
+		help="record how long every phase of the run takes, and write the trace to this JSON file")
+	args = parser.parse_args()
+	if args.trace:
+		tracing.enable()
+	# Every browser (even the one used to log in) is started with this\
+	# profile
+	set_default_profile(args.browser)
+
 	# Import our account's credentials from a Python file in the same\
 	# directory
 	username = researchGate_id.user
 	password = researchGate_id.password
 
-	# List with the names of the schools
-	schools = [
-		"ISEP",
-		"ISCAP",
-		"ESE",
-		"ESMAE",
-		"ESTG",
-		"ESS",
-		"ESHT",
-		"ESMAD"
-	]
-
-	# URLs from where we'll extract the profiles for each school. If a school\
-	# has an empty string, it means that school is not present in ResearchGate
-	school_pages = [
-		"https://www.researchgate.net/institution/Instituto_Superior_de_Engenharia_do_Porto/members?page=1",
-		"https://www.researchgate.net/institution/Instituto_Superior_de_Contabilidade_e_Administracao_do_Porto/members?page=1",
-		"",
-		"https://www.researchgate.net/institution/Polytechnic_Institute_of_Porto/department/Escola_Superior_de_Musica_e_das_Artes_do_Espetaculo/members?page=1",
-		"https://www.researchgate.net/institution/Polytechnic_Institute_of_Porto/department/Escola_Superior_de_Tecnologia_e_Gestao_de_Felgueiras/members?page=1",
-		"https://www.researchgate.net/institution/Polytechnic_Institute_of_Porto/department/Escola_Superior_de_Tecnologia_da_Saude_do_Porto/members?page=1",
-		"",
-		""
-	]
-
-	# List to hold lists of profiles for each school
-	school_urls = []
-
-	# Counter to keep track of which school we are looking at (by using the\
-	# index of the `schools` list)
-	counter = 0
-	# Create a dictionary of the type `school: list_of_profiles` (this\
-	# dictionary will be written to the first .pickle file)
-	scraped_data = {school: [] for school in schools}
+	schools = SCHOOLS
+	school_pages = SCHOOL_PAGES
+
+	# Log in once (or reuse the session saved by a previous run) and share\
+	# the session with every driver, HTTP request and worker
+	sessions = SessionManager(args.cookies)
+	sessions.cookies()
+
+	# Requests to ResearchGate follow limits that adapt to how much it puts\
+	# up with, and blocked pages are asked for again after a pause
+	limiter = RateLimiter()
+
+	# The lists of members are fetched with plain HTTP requests (carrying\
+	# our session's cookies); if a request fails, the page is loaded in a\
+	# logged in browser instead (which logs in again if the session expired)
+	if args.backend == "http":
+		backend = FallbackBackend(AuthenticatedBackend(ThrottledBackend(HttpBackend(), limiter, BLOCKED_RETRIES), sessions),
+			ThrottledBackend(SeleniumBackend(DriverPool(factory=new_logged_in_driver, size=args.fetchers), load=get_logged_in), limiter, BLOCKED_RETRIES),
+			needs_js=needs_browser)
+	# Pages rendered in a browser can be cached too, as long as they are\
+	# parsed from their source
+	elif not args.no_cache:
+		backend = ThrottledBackend(SeleniumBackend(DriverPool(factory=new_logged_in_driver, size=args.fetchers), load=get_logged_in), limiter, BLOCKED_RETRIES)
+	else:
+		backend = None
+
+	# Cache of fetched pages, so that re-runs don't fetch them again (pages\
+	# seen while logged in are kept apart from anyone else's, and the log in\
+	# page is never cached in place of the page we asked for)
+	cache = None if args.no_cache else ResponseCache(args.cache)
+	if cache is not None:
+		backend = CachedBackend(backend, cache, session=username, reject=is_login_form)
+
+	# Pool of processes, each with its own logged in browser, to split the\
+	# work across
+	if args.workers > 1:
+		workers = multiprocessing.Pool(args.workers, initializer=init_worker,
+			initargs=(username, password, args.backend, None if args.no_cache else args.cache, args.cookies, args.fetchers, args.browser))
+
+	# Journal where every completed school and profile is recorded, so that\
+	# a run that crashes can be resumed
+	journal = Journal(args.journal, resume=args.resume)
+	# Every profile is written to the output as soon as it's scraped, and\
+	# the totals of each school are computed from it at the end
+	sink = ResultSink(args.output)
+	# Index of the authors' identities across the platforms
+	identities = IdentityIndex(args.store)
+
+	# Create a dictionary of the type `school: list_of_profiles` with the\
+	# schools already done in a previous run (if resuming)
+	scraped_profiles = {record["school"]: record["profiles"] for record in journal.of_kind("members")}
+	# Schools whose profiles are still to be scraped, along with their pages
+	pending = [(school, school_page) for school, school_page in zip(schools, school_pages) if school not in scraped_profiles]
+
+	# Scrape the profiles of every school, each in a worker process if we\
+	# have them (the results come back in the same order as the schools)
+	if args.workers > 1:
+		all_profiles = workers.map(profiles_task, [school_page for _, school_page in pending])
+	else:
+		# A school whose list of members we were blocked from comes back as\
+		# `(None, error)`, so that the other schools are still scraped
+		def school_profiles (school_page):
+			names = {}
+			try:
+				return (get_profiles(school_page, backend=backend, names=names), names)
+			except BlockedError as error:
+				return (None, str(error))
+		all_profiles = (school_profiles(school_page) for _, school_page in pending)
 	
 	# Loop through the schools' pages and scrape the URLs for the profiles\
 	# of their members
-	for school_page in school_pages:
-		# Scrape profiles for the current school
-		user_profiles = get_profiles(school_page)
-		# Add the newly-scraped profiles to the list of scraped data
-		school_urls.append(user_profiles)
-		print(schools[counter], "has", len(user_profiles), "members.")
+	failed_schools = set()
+	for (school, _), (user_profiles, names) in zip(pending, all_profiles):
+		# Leave out the schools we were blocked from (they aren't in the\
+		# journal as done, so a run with --resume lists them again)
+		if user_profiles is None:
+			print("Couldn't list the members of", school, "-", names)
+			journal.append("members_failed", school=school, error=names)
+			failed_schools.add(school)
+			continue
 		# Update the dictionary with the list of profiles for the current\
-		# school
-		scraped_data[schools[counter]] = user_profiles
-		# Increment the counter since we are moving to the next school
-		counter += 1
-
-	# Write the dictionary of schools and profiles to a new .pickle file
-	with open("scraped_profiles.pickle", "wb") as f:
-		pickle.dump(scraped_data, f, pickle.HIGHEST_PROTOCOL)
-
-	# Load the dictionary of profiles from the created .pickle file (this\
-	# block is unnecessary if the whole script is run at once, but in our\
-	# use case that's not how it hapenned)
-	with open('scraped_profiles.pickle', 'rb') as f:
-		scraped_profiles = pickle.load(f)
-
-	# Create dictionaries of the type `school: total_reads` and\
-	# `school: total_citations`
-	total_reads = {school: 0 for school in schools}
-	total_citations = {school: 0 for school in schools}
-
-	# Create another counter to keep track of which school we are\
-	# currently scraping
-	counter = 0
-	# Single string to contain the schools and their reads and citations\
-	# This string will be built as the information is scraped and will be\
-	# written to a new .txt file
-	write_string = ""
+		# school, and record it in the journal
+		scraped_profiles[school] = user_profiles
+		journal.append("members", school=school, profiles=user_profiles)
+		# Link the members to their identities on the other platforms
+		identities.link_many("researchgate", names.items(), school)
+
+	for school, school_page in zip(schools, school_pages):
+		if school in failed_schools:
+			continue
+		print(school, "has", len(scraped_profiles[school]), "members.")
+		# Schools without a page aren't on ResearchGate, so there's no page\
+		# to write
+		if school_page:
+			sink.page("researchgate", school, school_page, members=len(scraped_profiles[school]))
+
+	# Add the profiles scraped in a previous run (if resuming) to the output\
+	# again, since it was started over
+	done_profiles = set()
+	for record in journal.of_kind("profile"):
+		sink.profile("researchgate", record["school"], record["profile"],
+			{"reads": record["reads"], "citations": record["citations"]}, resumed=True)
+		done_profiles.add(record["profile"])
+
+	# Store with the metrics of every profile scraped
+	store = MetricsStore(args.store)
+	max_age = args.max_age * 3600
 
-	# Loop through the schools (their members' profiles) and scrape the\
-	# required information
+	def save_profile (school, profile, reads, citations):
+		store.save("researchgate", school, profile, {"reads": reads, "citations": citations})
+		journal.append("profile", school=school, profile=profile, reads=reads, citations=citations)
+		sink.profile("researchgate", school, profile, {"reads": reads, "citations": citations})
+
+	# Members that left a school don't count for it anymore and, in\
+	# incremental mode, only the profiles that are new or stale are scraped
+	profiles_to_scrape = {}
+	for school in schools:
+		# Nothing is known about the members of the schools that couldn't\
+		# be listed, so their stored profiles are kept as they are
+		if school in failed_schools:
+			profiles_to_scrape[school] = []
+			continue
+		store.forget_missing("researchgate", school, scraped_profiles[school])
+		# Profiles already done in a previous run are skipped
+		profiles_to_scrape[school] = [profile for profile in scraped_profiles[school] if profile not in done_profiles]
+		# In incremental mode, the profiles that aren't scraped again are\
+		# written to the output with their stored metrics
+		if args.incremental:
+			stale_profiles = []
+			for profile in profiles_to_scrape[school]:
+				if store.needs_refresh("researchgate", profile, max_age):
+					stale_profiles.append(profile)
+				else:
+					sink.profile("researchgate", school, profile, store.metrics_of("researchgate", profile), stored=True)
+			profiles_to_scrape[school] = stale_profiles
+		print(school, "has", len(profiles_to_scrape[school]), "profiles to scrape.")
+
+	# With worker processes, split every school's profiles into batches,\
+	# scrape the batches in parallel and merge the partial totals
+	if args.workers > 1:
+		jobs = [
+			(school, profiles_to_scrape[school][i:i + PROFILES_PER_TASK])
+			for school in schools
+			for i in range(0, len(profiles_to_scrape[school]), PROFILES_PER_TASK)
+		]
+		for school, reads, citations, scraped in workers.imap_unordered(reads_citations_task, jobs):
+			for profile, profile_reads, profile_citations in scraped:
+				save_profile(school, profile, profile_reads, profile_citations)
+		# Let the workers quit their browsers and exit
+		workers.close()
+		workers.join()
+	else:
+		for school in schools:
+			tracing.set_context(school=school)
+			# Scrape the reads and citations of a single school (every\
+			# profile is saved as soon as it's scraped)
+			get_school_reads_citations(profiles_to_scrape[school], backend=backend,
+				on_profile=lambda profile, reads, citations: save_profile(school, profile, reads, citations))
+	# Keep the metrics of every profile (not just the totals), so that\
+	# they can be analyzed later
+	ProfileTable.from_store(store, "researchgate").save(args.records)
+	store.close()
+	identities.close()
+
+	# The totals of each school come from the profiles written to the output
+	sink.close()
+	totals = school_totals(args.output, "researchgate")
+	# Single string to contain the schools and their reads and citations,\
+	# to be written to a new .txt file
+	write_string = ""
+	# Loop through the schools and write down their totals
 	for school in schools:
-		# Get the total reads and citations for a single school
-		scraped_reads_citations = get_school_reads_citations(scraped_profiles[school])
-		# Save the total reads in the proper dictionary
-		total_reads[schools[counter]] += scraped_reads_citations[0]
-		# Save the total citations in the proper dictionary
-		total_citations[schools[counter]] += scraped_reads_citations[1]
+		school_total = totals.get(school, {})
 		# Phrases with the scraped information which will be included in the\
 		# created .txt file
-		reads_write = schools[counter] + "'s documents have " + str(total_reads[schools[counter]]) + " reads.\n"
-		citations_write = schools[counter] + "'s researchers have " + str(total_citations[schools[counter]]) + " citations.\n\n"
+		reads_write = school + "'s documents have " + str(school_total.get("reads", 0)) + " reads.\n"
+		citations_write = school + "'s researchers have " + str(school_total.get("citations", 0)) + " citations.\n\n"
 		write_string += reads_write
 		write_string += citations_write
 		print(reads_write)
 		print(citations_write)
-		counter += 1
 
-	# Update the .pickle file with the newly-scraped information\
-	# (dictionaries)
-	with open("scraped_reads_citations.pickle", "wb") as f:
-		pickle.dump(total_reads, f, pickle.HIGHEST_PROTOCOL)
-		pickle.dump(total_citations, f, pickle.HIGHEST_PROTOCOL)
+	journal.close()
+	# Close the connections (and browsers) used to fetch the pages
+	if backend is not None:
+		backend.close()
 
 	# Finally, write the scraped information to the new .txt file
 	with open("RG_reads_citations.txt", "w") as f:
-		f.write(write_string)
\ No newline at end of file
+		f.write(write_string)
+	print(sink.records, "records written to", args.output)
+
+	if cache is not None:
+		print("Page cache:", cache.stats())
+	print("Rate limits:", limiter.stats())
+
+	# Where the time went
+	if args.trace:
+		tracing.tracer.export(args.trace)
+		tracing.tracer.print_summary()
\ No newline at end of file
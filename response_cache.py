@@ -0,0 +1,340 @@
+'''
+File with an on-disk cache of fetched pages, so that re-running a script
+(after a crash, or while developing) doesn't download every page again.
+
+Pages are stored one per file, named after a hash of their normalized URL and
+of the session they were fetched with (pages seen while logged in can differ
+from the public ones). Each site has its own time-to-live, and when the cache
+grows over its size limit the least recently used pages are deleted.
+
+Several processes (the `--workers` of a script) can share the same directory.
+Each one only keeps track of the pages it wrote itself, so the directory is
+scanned again every time a process has written a fraction of the size limit
+(`RESCAN_FRACTION`), and before evicting: the cache can only go over its limit
+by that fraction per process, between scans.
+'''
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import hashlib
+import json
+import os
+import threading
+import time
+
+from fetch_backend import Page
+from rate_limiter import detect_block
+
+
+# How long (in seconds) a cached page is considered fresh, per site. Sites\
+# not listed here use the cache's default TTL
+DEFAULT_TTLS = {
+	"scholar.google.pt": 3 * 24 * 3600,
+	"www.researchgate.net": 24 * 3600,
+	"academia.edu": 24 * 3600
+}
+
+# Fraction of the size limit a process writes before scanning the directory\
+# again (to count the pages written by the other processes)
+RESCAN_FRACTION = 1 / 16
+
+
+def normalize_url (url):
+	'''
+	Normalize a URL so that equivalent URLs get the same cache entry:
+	lower case scheme and host, no default port, no fragment and sorted
+	query parameters.
+
+	Parameters
+	----------
+	url : str
+		The URL to normalize.
+
+	Returns
+	-------
+	str
+		The normalized URL.
+	'''
+
+	parts = urlsplit(url)
+	scheme = parts.scheme.lower()
+	host = parts.netloc.lower()
+	# Drop the port if it's the default one for the scheme
+	if (scheme == "http" and host.endswith(":80")) or (scheme == "https" and host.endswith(":443")):
+		host = host.rsplit(":", 1)[0]
+	query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+	return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+
+class ResponseCache (object):
+	'''
+	A content-addressed on-disk cache of pages.
+
+	Parameters
+	----------
+	directory : str
+		The directory where the pages are stored (created if needed).
+	max_bytes : int
+		Maximum size of the cache on disk. When it's exceeded, the least
+		recently used pages are deleted.
+	ttls : dict, optional
+		Time-to-live in seconds per host. A host also matches the entries
+		for its parent domains (so "iscap.academia.edu" uses the TTL of
+		"academia.edu"). Defaults to `DEFAULT_TTLS`.
+	default_ttl : float
+		Time-to-live of the pages of hosts that aren't in `ttls`.
+	'''
+
+	def __init__(self, directory="page_cache", max_bytes=512 * 1024 * 1024, ttls=None, default_ttl=24 * 3600):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.ttls = DEFAULT_TTLS if ttls is None else ttls
+		self.default_ttl = default_ttl
+		# Hit and miss counters (a page that has expired counts as a miss)
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		os.makedirs(directory, exist_ok=True)
+		self._scan()
+
+
+	def _scan (self):
+		'''
+		Read the size and time of last use of every page in the directory,
+		including the ones written by other processes (must be called with
+		the lock held, once the cache is created).
+		'''
+
+		# Size and time of last use of every page in the cache, keyed by\
+		# file name (the time of last use is kept on disk as the file's\
+		# modification time, so it survives restarts and is seen by the\
+		# other processes)
+		self._entries = {}
+		with os.scandir(self.directory) as entries:
+			for entry in entries:
+				if entry.name.endswith(".json"):
+					try:
+						stat = entry.stat()
+					# Deleted by another process meanwhile
+					except OSError:
+						continue
+					self._entries[entry.name] = [stat.st_size, stat.st_mtime]
+		self._size = sum(size for size, _ in self._entries.values())
+		# Bytes written by this process since the scan
+		self._written = 0
+
+
+	def _name (self, url, session):
+		'''
+		The file name of the cache entry for a URL and session.
+		'''
+
+		key = normalize_url(url) + "\n" + (session or "")
+
+		return hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+
+
+	def ttl (self, url):
+		'''
+		The time-to-live (in seconds) of the pages of a URL's host.
+		'''
+
+		host = urlsplit(url).hostname or ""
+		# Try the host, then its parent domains
+		labels = host.split(".")
+		for i in range(len(labels)):
+			domain = ".".join(labels[i:])
+			if domain in self.ttls:
+				return self.ttls[domain]
+
+		return self.default_ttl
+
+
+	def get (self, url, session=""):
+		'''
+		Get a cached page, if there's a fresh one.
+
+		Parameters
+		----------
+		url : str
+			The URL of the page.
+		session : str
+			Identifies who fetched the page (for example, the account we
+			were logged in with).
+
+		Returns
+		-------
+		page : fetch_backend.Page
+			The cached page, or `None` if it isn't cached or has expired.
+		'''
+
+		name = self._name(url, session)
+		path = os.path.join(self.directory, name)
+		try:
+			with open(path, encoding="utf-8") as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			with self._lock:
+				self.misses += 1
+			return None
+
+		if time.time() - entry["fetched_at"] > self.ttl(url):
+			with self._lock:
+				self.misses += 1
+			return None
+
+		# Mark the page as recently used
+		now = time.time()
+		with self._lock:
+			self.hits += 1
+			if name in self._entries:
+				self._entries[name][1] = now
+		try:
+			os.utime(path, (now, now))
+		except OSError:
+			pass
+
+		return Page(entry["url"], entry["status"], entry["html"])
+
+
+	def put (self, url, page, session=""):
+		'''
+		Store a page in the cache, evicting old pages if needed.
+
+		Parameters
+		----------
+		url : str
+			The URL that was requested (the page's own URL may differ after
+			redirects).
+		page : fetch_backend.Page
+			The page to store.
+		session : str
+			Identifies who fetched the page.
+		'''
+
+		name = self._name(url, session)
+		path = os.path.join(self.directory, name)
+		data = json.dumps({
+			"url": page.url,
+			"status": page.status,
+			"fetched_at": time.time(),
+			"html": page.html
+		}).encode("utf-8")
+
+		# Write to a temporary file first so that a crash never leaves a\
+		# half-written entry behind
+		tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(tmp_path, "wb") as f:
+			f.write(data)
+		os.replace(tmp_path, path)
+
+		with self._lock:
+			old = self._entries.get(name)
+			if old is not None:
+				self._size -= old[0]
+			self._entries[name] = [len(data), time.time()]
+			self._size += len(data)
+			self._written += len(data)
+			if self._size > self.max_bytes or self._written >= self.max_bytes * RESCAN_FRACTION:
+				self._scan()
+				self._evict()
+
+
+	def _evict (self):
+		'''
+		Delete the least recently used pages until the cache fits in its
+		size limit (must be called with the lock held, right after a
+		`_scan`).
+		'''
+
+		if self._size <= self.max_bytes:
+			return
+
+		for name, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+			if self._size <= self.max_bytes:
+				break
+			try:
+				os.remove(os.path.join(self.directory, name))
+			except OSError:
+				pass
+			del self._entries[name]
+			self._size -= size
+
+
+	def stats (self):
+		'''
+		Summary of the cache's use.
+
+		Returns
+		-------
+		dict
+			The number of hits and misses, the hit ratio, and the number of
+			pages and bytes currently stored.
+		'''
+
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_ratio": self.hits / lookups if lookups else 0.0,
+				"pages": len(self._entries),
+				"bytes": self._size
+			}
+
+
+
+class CachedBackend (object):
+	'''
+	Wrap a backend from `fetch_backend` so that pages are served from a
+	`ResponseCache` when possible.
+
+	Only successful (200) responses are cached, and never blocks (CAPTCHAs,
+	interstitials... see `rate_limiter.detect_block`), which would be served
+	instead of the page until they expire.
+
+	Parameters
+	----------
+	backend : object
+		The backend used on cache misses.
+	cache : ResponseCache
+		The cache.
+	session : str
+		Identifies who is fetching the pages (see `ResponseCache.get`).
+	reject : callable, optional
+		Function that receives a fetched page and returns `True` if it
+		mustn't be cached either (like a log in page shown when a session
+		has expired).
+	'''
+
+	def __init__(self, backend, cache, session="", reject=None):
+		self.backend = backend
+		self.cache = cache
+		self.session = session
+		self.reject = reject
+
+
+	def cacheable (self, page):
+		'''
+		Check if a fetched page can be cached.
+		'''
+
+		if page.status != 200 or detect_block(page.url, page.status, page.html) is not None:
+			return False
+
+		return self.reject is None or not self.reject(page)
+
+
+	def fetch (self, url, headers=None):
+		page = self.cache.get(url, self.session)
+		if page is None:
+			page = self.backend.fetch(url, headers)
+			if self.cacheable(page):
+				self.cache.put(url, page, self.session)
+
+		return page
+
+
+	def close (self):
+		self.backend.close()
@@ -0,0 +1,227 @@
+'''
+File to stream the results of a run to a file as they are scraped, one JSON
+record per line (NDJSON), instead of keeping them in memory until the end.
+
+There are two types of records:
+
+* "profile": the metrics of a profile (or of a department's page, on
+  Academia.edu), which are what the totals of each school add up;
+* "page": a page of results or of members, with what was found in it.
+
+Every record has its type, platform, school, URL and the time it was
+scraped, plus its metrics or findings. Records are written in batches, and
+flushed at least every few seconds, so other programs can read the file while
+the crawl is still running. The text summaries of each script are computed
+from the file once the run ends (`school_totals`).
+'''
+
+import json
+import threading
+import time
+
+from metrics_store import METRICS
+
+
+# Size (in characters) of the batches of records written at once, and\
+# seconds after which the records written so far are flushed anyway
+BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 5.0
+
+# Types of records
+PROFILE = "profile"
+PAGE = "page"
+
+
+
+class ResultSink (object):
+	'''
+	An NDJSON file where records are written as they come.
+
+	Parameters
+	----------
+	path : str
+		Path of the file (replaced, unless `append`).
+	append : bool
+		Whether to add to the records already in the file.
+	buffer_size : int
+		Size of the batches of records written at once.
+	flush_interval : float
+		Seconds after which the records written so far are flushed, even if
+		their batch isn't full.
+	'''
+
+	def __init__(self, path, append=False, buffer_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+		self.path = path
+		self.buffer_size = buffer_size
+		self.records = 0
+		self._file = open(path, "a" if append else "w", encoding="utf-8")
+		self._buffer = []
+		self._size = 0
+		self._lock = threading.Lock()
+		# Flush in the background too, so that records don't wait in the\
+		# buffer while a slow page is being scraped
+		self._closed = threading.Event()
+		self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True)
+		self._flusher.start()
+
+
+	def _flush_periodically (self, interval):
+		while not self._closed.wait(interval):
+			self.flush()
+
+
+	def _flush (self):
+		if self._buffer:
+			self._file.write("".join(self._buffer))
+			self._buffer = []
+			self._size = 0
+		self._file.flush()
+
+
+	def write (self, record):
+		'''
+		Write a record.
+
+		Parameters
+		----------
+		record : dict
+			The record (must be serializable to JSON).
+		'''
+
+		line = json.dumps(record, ensure_ascii=False) + "\n"
+		with self._lock:
+			self._buffer.append(line)
+			self._size += len(line)
+			self.records += 1
+			if self._size >= self.buffer_size:
+				self._flush()
+
+
+	def profile (self, platform, school, url, metrics, **fields):
+		'''
+		Write the metrics of a profile.
+
+		Parameters
+		----------
+		platform : str
+			"scholar", "researchgate" or "academia".
+		school : str
+			The school the profile belongs to, like "ISEP".
+		url : str
+			The URL of the profile (or page).
+		metrics : dict
+			The scraped metrics (the keys should be in
+			`metrics_store.METRICS`).
+		**fields
+			Anything else worth keeping, like `stored=True` for metrics
+			taken from the store instead of scraped.
+		'''
+
+		record = {"type": PROFILE, "platform": platform, "school": school, "url": url, "time": time.time()}
+		record.update(metrics)
+		record.update(fields)
+		self.write(record)
+
+
+	def page (self, platform, school, url, **fields):
+		'''
+		Write what was found in a page of results or of members (like the
+		number of profiles listed, or the views of its members).
+		'''
+
+		record = {"type": PAGE, "platform": platform, "school": school, "url": url, "time": time.time()}
+		record.update(fields)
+		self.write(record)
+
+
+	def flush (self):
+		with self._lock:
+			if not self._file.closed:
+				self._flush()
+
+
+	def close (self):
+		self._closed.set()
+		self._flusher.join()
+		with self._lock:
+			self._flush()
+			self._file.close()
+
+
+	def __enter__ (self):
+		return self
+
+
+	def __exit__ (self, *exc_info):
+		self.close()
+
+
+
+def read_records (path):
+	'''
+	Read the records of an NDJSON file, one at a time.
+
+	A last line that was cut in half (if the run was killed while writing
+	it) is skipped.
+
+	Yields
+	------
+	dict
+		The records, in the order they were written.
+	'''
+
+	with open(path, encoding="utf-8") as f:
+		for line in f:
+			try:
+				yield json.loads(line)
+			except ValueError:
+				if line.endswith("\n"):
+					raise
+
+
+
+def school_totals (path, platform):
+	'''
+	Add up the metrics of the profiles of each school in an NDJSON file.
+
+	A profile written more than once for the same school (scraped again
+	after a resume, for example) is counted once, with its last metrics. A
+	profile listed by two schools counts for both.
+
+	The totals are added up as the file is read, but the last metrics of
+	every profile are kept too (to take them out of the totals if the
+	profile shows up again), so the memory used grows with the number of
+	profiles in the file, not with the number of records.
+
+	Parameters
+	----------
+	path : str
+		The file.
+	platform : str
+		The platform of the profiles.
+
+	Returns
+	-------
+	dict
+		Dictionary of the type `school: {metric: total}`.
+	'''
+
+	totals = {}
+	# Last metrics of each profile, by `(school, url)`
+	latest = {}
+	for record in read_records(path):
+		if record["type"] != PROFILE or record["platform"] != platform:
+			continue
+		school = record["school"]
+		values = [record.get(metric) for metric in METRICS]
+		previous = latest.get((school, record["url"]), [None] * len(METRICS))
+		latest[(school, record["url"])] = values
+		sums = totals.setdefault(school, {})
+		# Replace the profile's previous metrics with the new ones
+		for metric, old, new in zip(METRICS, previous, values):
+			if old is not None:
+				sums[metric] -= old
+			if new is not None:
+				sums[metric] = sums.get(metric, 0) + new
+
+	return totals
\ No newline at end of file
@@ -0,0 +1,314 @@
+'''
+File to schedule the tasks of a distributed crawl so that the longest ones
+are done first.
+
+A run takes as long as its slowest worker, and a worker that picks up a
+Scholar author with hundreds of publications (or a big Academia.edu
+department) near the end of the run keeps every other worker waiting. So
+each task gets an estimate of how many seconds it takes, from cheap signals
+(the "Cited by" count of the author's card in the list of results, the
+metrics stored by a previous run...), and the estimate is its priority in
+the queue: workers always claim the longest task left (the "largest
+processing time first" rule). As the workers report how long their tasks
+took, the estimates are corrected and the tasks still waiting reordered.
+
+Reordering means reading every task waiting, so it's only done when the
+estimates changed enough to matter; otherwise only the tasks added since the
+last check are looked at.
+'''
+
+import math
+
+
+# Tasks that find more work (pages of results, of members, of a school) come\
+# before any other, since every other task depends on them
+DISCOVERY_PRIORITY = 1e9
+
+# Signals of the size of each type of task, from the best to the worst: the\
+# metrics of a previous run, or values found while discovering the task\
+# (in its payload)
+SIGNALS = {
+	"scholar_profile": ("publications", "cited_by"),
+	"academia_documents": ("reads",),
+	"academia_members": ("views",)
+}
+
+# Initial estimates of the cost of each type of task, per signal: seconds\
+# a task takes regardless of its size, and seconds per unit of size (like\
+# each publication of an author)
+DEFAULT_COSTS = {
+	("scholar_profile", "publications"): (2.0, 0.02),
+	("scholar_profile", "cited_by"): (2.0, 0.001),
+	("researchgate_profile", None): (3.0, 0.0),
+	("academia_members", "views"): (2.0, 0.0005),
+	("academia_documents", "reads"): (5.0, 0.001)
+}
+
+# Seconds of the tasks without an initial estimate
+DEFAULT_COST = 3.0
+
+# Timings needed before the estimates of a type of task (and signal) are\
+# fitted to them instead of using the initial ones
+MIN_SAMPLES = 5
+
+# Relative change of the estimates of any type of task (and signal) after\
+# which every task waiting is reordered
+REORDER_TOLERANCE = 0.05
+
+
+
+class CostModel (object):
+	'''
+	Estimate the seconds a task takes as a line on the size of the task,
+	fitted (by least squares) to the timings seen for each type of task and
+	signal.
+
+	Parameters
+	----------
+	defaults : dict
+		The initial estimates, as a dictionary of the type
+		`(kind, signal): (base_seconds, seconds_per_unit)`.
+	'''
+
+	def __init__(self, defaults=DEFAULT_COSTS):
+		self.defaults = dict(defaults)
+		# Running sums of the timings of each type of task and signal: n, x,\
+		# y, x² and xy
+		self._sums = {}
+
+
+	def observe (self, kind, signal, size, seconds):
+		'''
+		Record how long a task took.
+
+		Parameters
+		----------
+		kind : str
+			The type of the task.
+		signal : str
+			The name of the size signal (`None` if there's none).
+		size : float
+			The size of the task (0 if there's no signal).
+		seconds : float
+			How long the task took.
+		'''
+
+		sums = self._sums.setdefault((kind, signal), [0, 0.0, 0.0, 0.0, 0.0])
+		sums[0] += 1
+		sums[1] += size
+		sums[2] += seconds
+		sums[3] += size * size
+		sums[4] += size * seconds
+
+
+	def coefficients (self, kind, signal):
+		'''
+		The current `(base_seconds, seconds_per_unit)` of a type of task and
+		signal.
+		'''
+
+		sums = self._sums.get((kind, signal))
+		if sums is None or sums[0] < MIN_SAMPLES:
+			if (kind, signal) in self.defaults:
+				return self.defaults[(kind, signal)]
+			return (DEFAULT_COST, 0.0)
+
+		n, sum_x, sum_y, sum_xx, sum_xy = sums
+		mean_x = sum_x / n
+		mean_y = sum_y / n
+		variance = sum_xx / n - mean_x * mean_x
+		# Every task of the same size (or no signal): just the mean
+		if variance <= 1e-9:
+			return (mean_y, 0.0)
+		# Bigger tasks never take less time
+		slope = max(0.0, (sum_xy / n - mean_x * mean_y) / variance)
+
+		return (max(0.0, mean_y - slope * mean_x), slope)
+
+
+	def all_coefficients (self):
+		'''
+		The current coefficients of every type of task and signal with an
+		initial estimate or timings, as a dictionary of the type
+		`(kind, signal): (base_seconds, seconds_per_unit)`.
+		'''
+
+		return {key: self.coefficients(*key) for key in set(self.defaults) | set(self._sums)}
+
+
+	def estimate (self, kind, signal, size):
+		'''
+		Estimate the seconds a task takes.
+		'''
+
+		base, per_unit = self.coefficients(kind, signal)
+
+		return base + per_unit * size
+
+
+
+class Scheduler (object):
+	'''
+	Keep the tasks waiting in a queue ordered from the longest to the
+	shortest.
+
+	Parameters
+	----------
+	queue : work_queue.QueueBackend
+		The queue (only needed to `rebalance`).
+	store : metrics_store.MetricsStore, optional
+		Metrics from previous runs, used to size the tasks.
+	model : CostModel, optional
+		The estimates of the cost of the tasks.
+	discovery_kinds : iterable
+		The types of tasks that find more work.
+	platforms : dict, optional
+		The platform of each type of task (the store keeps the metrics of
+		each platform apart), as a dictionary of the type `kind: platform`.
+	'''
+
+	def __init__(self, queue, store=None, model=None, discovery_kinds=(), platforms=None):
+		self.queue = queue
+		self.store = store
+		self.model = model or CostModel()
+		self.discovery_kinds = set(discovery_kinds)
+		self.platforms = platforms or {}
+		# Signal of each task seen, as `task_id: (signal, size)`
+		self._signals = {}
+		# Highest ID of the tasks seen, and the coefficients of the model\
+		# when every task waiting was last reordered
+		self._last_id = 0
+		self._coefficients = None
+
+
+	def signal (self, kind, payload):
+		'''
+		The size of a task, from the best signal available: the metrics of a
+		previous run or, for a new profile, the "Cited by" count of the
+		author's card.
+
+		Returns
+		-------
+		(signal, size) : tuple
+			The name of the signal and the size (`(None, 0)` if there's no
+			signal).
+		'''
+
+		stored = None
+		if self.store is not None and kind in self.platforms:
+			stored = self.store.metrics_of(self.platforms[kind], payload["url"])
+		for signal in SIGNALS.get(kind, ()):
+			if stored and stored.get(signal) is not None:
+				return (signal, stored[signal])
+			if payload.get(signal) is not None:
+				return (signal, payload[signal])
+
+		return (None, 0)
+
+
+	def priority (self, kind, signal, size):
+		'''
+		The priority of a task in the queue.
+		'''
+
+		if kind in self.discovery_kinds:
+			return DISCOVERY_PRIORITY
+
+		return self.model.estimate(kind, signal, size)
+
+
+	def prioritized (self, tasks):
+		'''
+		Add their priorities to new tasks.
+
+		Parameters
+		----------
+		tasks : iterable
+			`(kind, payload)` tuples.
+
+		Returns
+		-------
+		list
+			`(kind, payload, priority)` tuples.
+		'''
+
+		return [(kind, payload, self.priority(kind, *self.signal(kind, payload))) for kind, payload in tasks]
+
+
+	def observe (self, kind, payload, metrics, seconds):
+		'''
+		Record how long a task took, for every signal of its size (the ones
+		scraped by the task itself are its real size).
+
+		Parameters
+		----------
+		kind : str
+			The type of the task.
+		payload : dict
+			The task's data.
+		metrics : dict
+			The metrics scraped by the task.
+		seconds : float
+			How long the task took.
+		'''
+
+		signals = SIGNALS.get(kind, ())
+		if not signals:
+			self.model.observe(kind, None, 0, seconds)
+		for signal in signals:
+			size = (metrics or {}).get(signal, payload.get(signal))
+			if size is not None:
+				self.model.observe(kind, signal, size, seconds)
+
+
+	def _estimates_changed (self, coefficients):
+		'''
+		Whether any coefficient moved more than `REORDER_TOLERANCE` since
+		every task waiting was last reordered.
+		'''
+
+		if self._coefficients is None:
+			return True
+		for key, values in coefficients.items():
+			previous = self._coefficients.get(key)
+			if previous is None:
+				return True
+			for value, old in zip(values, previous):
+				if not math.isclose(value, old, rel_tol=REORDER_TOLERANCE, abs_tol=1e-9):
+					return True
+
+		return False
+
+
+	def rebalance (self):
+		'''
+		Set the priorities of the tasks waiting in the queue from the
+		current estimates: of every task waiting if the estimates changed
+		(by more than `REORDER_TOLERANCE`), of the tasks added since the last
+		call otherwise.
+
+		Returns
+		-------
+		int
+			The number of tasks whose priority changed.
+		'''
+
+		coefficients = self.model.all_coefficients()
+		if self._estimates_changed(coefficients):
+			self._coefficients = coefficients
+			tasks = self.queue.pending()
+		else:
+			tasks = self.queue.pending(after=self._last_id)
+
+		priorities = {}
+		for task, priority in tasks:
+			self._last_id = max(self._last_id, task.id)
+			if task.id not in self._signals:
+				self._signals[task.id] = self.signal(task.kind, task.payload)
+			new_priority = self.priority(task.kind, *self._signals[task.id])
+			if not math.isclose(new_priority, priority):
+				priorities[task.id] = new_priority
+		if priorities:
+			self.queue.prioritize(priorities)
+
+		return len(priorities)
\ No newline at end of file
@@ -0,0 +1,95 @@
+'''
+File with what the tests share: the scripts and modules of the repository
+are imported straight from its root folder, and a local HTTP server stands
+in for the real sites so that everything runs offline.
+'''
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+
+class LocalServer (object):
+	'''
+	A local HTTP server, running in a background thread, that answers with
+	the pages it's given.
+
+	Parameters
+	----------
+	latency : float
+		Seconds to wait before answering every request.
+	'''
+
+	def __init__(self, latency=0.0):
+		self.latency = latency
+		# Pages of the type `path: (status, headers, body)`, and the function\
+		# that answers any other path (`None` for a 404)
+		self.pages = {}
+		self.default = None
+		# Requests answered, requests being answered and the most requests\
+		# answered at once
+		self.requests = 0
+		self.in_flight = 0
+		self.max_in_flight = 0
+		self._lock = threading.Lock()
+		server = self
+
+		class Handler (BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+			# Without it, every response waits for a delayed ACK (~40 ms)
+			disable_nagle_algorithm = True
+
+			def do_GET (self):
+				with server._lock:
+					server.requests += 1
+					server.in_flight += 1
+					server.max_in_flight = max(server.max_in_flight, server.in_flight)
+				try:
+					if server.latency:
+						time.sleep(server.latency)
+					if self.path in server.pages:
+						status, headers, body = server.pages[self.path]
+					elif server.default is not None:
+						status, headers, body = server.default(self.path)
+					else:
+						status, headers, body = (404, {}, "Not found")
+				finally:
+					with server._lock:
+						server.in_flight -= 1
+				data = body.encode("utf-8")
+				self.send_response(status)
+				self.send_header("Content-Type", "text/html; charset=utf-8")
+				self.send_header("Content-Length", str(len(data)))
+				for name, value in headers.items():
+					self.send_header(name, value)
+				self.end_headers()
+				self.wfile.write(data)
+
+			def log_message (self, *args):
+				pass
+
+		self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self._server.daemon_threads = True
+		self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+		self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+		self._thread.start()
+
+
+	def close (self):
+		self._server.shutdown()
+		self._server.server_close()
+
+
+
+@pytest.fixture
+def server ():
+	server = LocalServer()
+	yield server
+	server.close()
\ No newline at end of file
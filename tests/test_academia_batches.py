@@ -0,0 +1,72 @@
+'''
+File to test the JSON batches of Academia.edu's departments against the
+sample batches in `fixtures/academia`, served by the local server.
+'''
+
+import os
+
+import pytest
+
+pytest.importorskip("selenium")
+import academiaEdu_school_reads_profileViews as academia
+from fetch_backend import HttpBackend
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "academia")
+
+
+
+def serve_fixtures (server):
+	'''
+	Serve every sample batch at `/batches/<name>.json`.
+	'''
+
+	for name in os.listdir(FIXTURES):
+		if name.endswith(".json"):
+			with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+				server.pages["/batches/" + name] = (200, {"Content-Type": "application/json"}, f.read())
+
+
+
+@pytest.mark.parametrize("kind, views", [("documents", 3339), ("members", 1850)])
+def test_count_batched (server, kind, views):
+	serve_fixtures(server)
+	backend = HttpBackend()
+	template = server.url + "/batches/" + kind + "_batch_{page}.json"
+
+	assert academia.count_batched(server.url + "/Departments/ISEP", template, backend) == views
+	backend.close()
+
+
+
+def test_default_templates (server):
+	server.default = lambda path: (200, {}, '{"works": [], "more": false}')
+	server.pages["/Departments/ISEP/Documents?page=1&format=json"] = (200, {}, '{"works": [{"view_count": "1,234"}], "more": true}')
+	backend = HttpBackend()
+
+	assert academia.count_batched(server.url + "/Departments/ISEP/Documents", academia.DOCUMENTS_BATCH_URL, backend) == 1234
+	backend.close()
+
+
+
+def test_without_batches_falls_back_to_scrolling (server, monkeypatch):
+	# A page without a batch endpoint answers with a 404 (or with HTML)
+	server.pages["/Departments/ISEP/Documents"] = (200, {}, "<html><body>Documents</body></html>")
+	scrolled = []
+	monkeypatch.setattr(academia, "count_reads", lambda page, *args: scrolled.append(page) or 42)
+	backend = HttpBackend()
+	docs_page = server.url + "/Departments/ISEP/Documents"
+
+	assert academia.try_batched(docs_page, academia.DOCUMENTS_BATCH_URL, backend) is None
+	assert academia.count_department_reads(docs_page, academia.DOCUMENTS_BATCH_URL, backend) == 42
+	assert scrolled == [docs_page]
+	backend.close()
+
+
+
+def test_connection_errors_fall_back (monkeypatch):
+	# Nothing listens on the port, so the connection is refused
+	monkeypatch.setattr(academia, "count_reads", lambda page, *args: 7)
+	backend = HttpBackend(timeout=1)
+
+	assert academia.count_department_reads("http://127.0.0.1:9/Documents", academia.DOCUMENTS_BATCH_URL, backend) == 7
\ No newline at end of file
@@ -0,0 +1,53 @@
+'''
+File to test how Academia.edu's infinite scroll is waited for, with a fake
+driver instead of a browser.
+'''
+
+import pytest
+
+pytest.importorskip("selenium")
+import academiaEdu_school_reads_profileViews as academia
+
+
+
+class FakeDriver (object):
+	'''
+	Answers the scripts of `content_arrived`: a fixed number of elements, and
+	the resources loaded since the last check, taken from a list.
+	'''
+
+	def __init__(self, elements, resources):
+		self.elements = elements
+		self.resources = list(resources)
+
+	def execute_script (self, script, *args):
+		if script == academia.COUNT_ELEMENTS_JS:
+			return self.elements
+		return [0, self.resources.pop(0)]
+
+
+
+def test_new_elements_are_returned ():
+	expectation = academia.content_arrived(".js-view-count", 10, idle_time=0)
+
+	assert expectation(FakeDriver(15, [])) == 15
+
+
+
+def test_idle_once_nothing_is_loading ():
+	expectation = academia.content_arrived(".js-view-count", 10, idle_time=0)
+	driver = FakeDriver(10, [0, 0])
+
+	assert expectation(driver) is False
+	assert expectation(driver) == academia.IDLE
+
+
+
+def test_not_idle_while_resources_keep_loading ():
+	# The same number of resources loaded between checks is still activity\
+	# (the timings are cleared after each check)
+	expectation = academia.content_arrived(".js-view-count", 10, idle_time=0)
+	driver = FakeDriver(10, [250, 250, 250, 0])
+
+	assert [expectation(driver) for _ in range(4)] == [False, False, False, academia.IDLE]
+	assert "clearResourceTimings" in academia.NETWORK_STATE_JS
\ No newline at end of file
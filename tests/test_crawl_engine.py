@@ -0,0 +1,185 @@
+'''
+File to test the asynchronous crawl engine against a local server: what it
+finds, how many requests it makes to a host at once, and how fast it goes.
+'''
+
+import time
+
+from crawl_engine import CrawlEngine, MAX_BLOCKED_RETRIES
+from fetch_backend import HttpBackend
+from rate_limiter import BlockedError
+
+
+# Pages of results in the fake listing, and profiles in each page
+RESULT_PAGES = 5
+PROFILES_PER_PAGE = 8
+
+
+
+def listing (path):
+	'''
+	Pages of a fake listing of profiles: `/results/N` links to its profiles
+	and to the next page, and `/profile/N/M` has a count of publications.
+	'''
+
+	parts = path.strip("/").split("/")
+	if parts[0] == "results":
+		number = int(parts[1])
+		links = "".join(f'<a class="profile" href="/profile/{number}/{i}">x</a>' for i in range(PROFILES_PER_PAGE))
+		if number + 1 < RESULT_PAGES:
+			links += f'<a class="next" href="/results/{number + 1}">next</a>'
+		return (200, {}, f"<html><body>{links}</body></html>")
+	if parts[0] == "profile":
+		return (200, {}, f'<html><body><span class="pubs">{int(parts[2]) + 1}</span></body></html>')
+
+	return (404, {}, "Not found")
+
+
+
+def crawl_listing (server, backend, per_host=4):
+	'''
+	Crawl the fake listing, returning the engine and the publications found.
+	'''
+
+	def on_profile (engine, page):
+		return int(page.root.find(class_name="pubs").text)
+
+	def on_results (engine, page):
+		for link in page.root.find_all(tag="a"):
+			if "profile" in link.classes:
+				engine.add(server.url + link.get_attribute("href"), on_profile)
+			else:
+				engine.add(server.url + link.get_attribute("href"), on_results)
+
+	engine = CrawlEngine(backend, per_host=per_host)
+	engine.add(server.url + "/results/0", on_results)
+
+	return (engine, engine.crawl())
+
+
+
+def test_crawl_finds_every_page (server):
+	server.default = listing
+	backend = HttpBackend()
+	engine, results = crawl_listing(server, backend)
+	backend.close()
+
+	assert engine.errors == []
+	assert engine.pages == RESULT_PAGES * (PROFILES_PER_PAGE + 1)
+	assert sum(results) == RESULT_PAGES * sum(range(1, PROFILES_PER_PAGE + 1))
+
+
+
+def test_add_ignores_seen_urls (server):
+	engine = CrawlEngine(HttpBackend())
+
+	assert engine.add(server.url + "/a", lambda engine, page: None)
+	assert not engine.add(server.url + "/a", lambda engine, page: None)
+
+
+
+def test_per_host_limit (server):
+	server.default = listing
+	server.latency = 0.02
+	backend = HttpBackend()
+	crawl_listing(server, backend, per_host=3)
+	backend.close()
+
+	assert server.max_in_flight == 3
+
+
+
+def test_throughput (server):
+	# With a fixed latency per page, fetching several pages at once has to\
+	# be much faster than fetching one page at a time
+	server.default = listing
+	server.latency = 0.02
+	backend = HttpBackend()
+	start = time.perf_counter()
+	engine, _ = crawl_listing(server, backend, per_host=8)
+	seconds = time.perf_counter() - start
+	backend.close()
+
+	serial_seconds = engine.pages * server.latency
+	assert seconds < serial_seconds / 2
+
+
+
+def test_errors_are_kept (server):
+	server.pages["/broken"] = (200, {}, "<html><body></body></html>")
+
+	def on_page (engine, page):
+		return int(page.root.find(class_name="pubs").text)
+
+	engine = CrawlEngine(HttpBackend())
+	engine.add(server.url + "/broken", on_page)
+
+	assert engine.crawl() == []
+	assert [url for url, _ in engine.errors] == [server.url + "/broken"]
+
+
+
+def test_blocked_pages_are_retried ():
+	class BlockedBackend (object):
+		# Blocks every page the first time it's asked for, and one page always
+		def __init__(self):
+			self.calls = {}
+
+		def fetch (self, url, headers=None):
+			self.calls[url] = self.calls.get(url, 0) + 1
+			if url.endswith("/always") or self.calls[url] == 1:
+				raise BlockedError(url, "HTTP 429")
+			return url
+
+	backend = BlockedBackend()
+	engine = CrawlEngine(backend)
+	engine.add("http://example.org/once", lambda engine, page: page)
+	engine.add("http://example.org/always", lambda engine, page: page)
+
+	assert engine.crawl() == ["http://example.org/once"]
+	assert backend.calls["http://example.org/always"] == MAX_BLOCKED_RETRIES + 1
+	assert [url for url, _ in engine.errors] == ["http://example.org/always"]
+
+
+def test_add_with_keys (server):
+	server.pages["/profile"] = (200, {}, '<html><body><span class="pubs">3</span></body></html>')
+
+	def on_profile (engine, page, school):
+		return (school, int(page.root.find(class_name="pubs").text))
+
+	# A profile listed by two schools is fetched for each of them
+	backend = HttpBackend()
+	engine = CrawlEngine(backend)
+	assert engine.add(server.url + "/profile", on_profile, key=("ISEP", server.url + "/profile"), school="ISEP")
+	assert engine.add(server.url + "/profile", on_profile, key=("ISCAP", server.url + "/profile"), school="ISCAP")
+	assert not engine.add(server.url + "/profile", on_profile, key=("ISEP", server.url + "/profile"), school="ISEP")
+	results = engine.crawl()
+	backend.close()
+
+	assert sorted(results) == [("ISCAP", 3), ("ISEP", 3)]
+
+
+
+def test_busy_host_doesnt_starve_the_others ():
+	class SlowBackend (object):
+		# Records the order in which the pages are started
+		def __init__(self):
+			self.started = []
+
+		def fetch (self, url, headers=None):
+			self.started.append(url)
+			time.sleep(0.01)
+			return url
+
+	# The pages of the busy host are added first, and fill the frontier
+	backend = SlowBackend()
+	engine = CrawlEngine(backend, per_host=1, max_in_flight=2)
+	for i in range(5):
+		engine.add(f"http://busy.example.org/{i}", lambda engine, page: page)
+	engine.add("http://other.example.org/", lambda engine, page: page)
+	engine.crawl()
+
+	# The other host gets the free request instead of waiting for the busy\
+	# host's pages to be done
+	assert backend.started.index("http://other.example.org/") == 1
+	assert len(engine.results) == 6
\ No newline at end of file
@@ -0,0 +1,116 @@
+'''
+File to test the HTTP backend against a local server: redirects, status
+codes and the parsing of the pages it fetches.
+'''
+
+import pytest
+
+from fetch_backend import HttpBackend, FallbackBackend, TooManyRedirects
+
+
+
+def test_fetch_page (server):
+	server.pages["/page"] = (200, {}, '<html><body><div id="a" class="x y">Hello</div></body></html>')
+	backend = HttpBackend()
+	page = backend.fetch(server.url + "/page")
+	backend.close()
+
+	assert page.status == 200
+	assert page.url == server.url + "/page"
+	assert page.root.find(id="a").text == "Hello"
+	assert page.root.find(class_name="y") is not None
+
+
+
+@pytest.mark.parametrize("status", [301, 302, 303, 307, 308])
+def test_follows_redirects (server, status):
+	server.pages["/old"] = (status, {"Location": "/middle"}, "")
+	server.pages["/middle"] = (status, {"Location": server.url + "/new"}, "")
+	server.pages["/new"] = (200, {}, "<html><body>New</body></html>")
+	backend = HttpBackend()
+	page = backend.fetch(server.url + "/old")
+	backend.close()
+
+	assert page.status == 200
+	assert page.url == server.url + "/new"
+	assert server.requests == 3
+
+
+
+@pytest.mark.parametrize("status", [404, 429, 500])
+def test_error_statuses_are_returned (server, status):
+	server.pages["/page"] = (status, {"Retry-After": "7"}, "<html><body>Error</body></html>")
+	backend = HttpBackend()
+	page = backend.fetch(server.url + "/page")
+	backend.close()
+
+	assert page.status == status
+	assert page.headers["Retry-After"] == "7"
+
+
+
+def test_too_many_redirects (server):
+	server.default = lambda path: (302, {"Location": f"/loop{len(path)}"}, "")
+	backend = HttpBackend(max_redirects=3)
+	with pytest.raises(TooManyRedirects):
+		backend.fetch(server.url + "/loop")
+	backend.close()
+
+	assert server.requests == 4
+
+
+
+def test_redirects_up_to_the_limit (server):
+	server.pages["/a"] = (302, {"Location": "/b"}, "")
+	server.pages["/b"] = (302, {"Location": "/c"}, "")
+	server.pages["/c"] = (200, {}, "<html><body>C</body></html>")
+	backend = HttpBackend(max_redirects=2)
+	page = backend.fetch(server.url + "/a")
+	backend.close()
+
+	assert page.url == server.url + "/c"
+
+
+
+def test_connections_are_reused (server):
+	server.pages["/page"] = (200, {}, "<html></html>")
+	backend = HttpBackend()
+	for _ in range(5):
+		backend.fetch(server.url + "/page")
+
+	assert sum(len(conns) for conns in backend._idle.values()) == 1
+	backend.close()
+
+
+
+def test_fallback_after_too_many_redirects (server):
+	server.default = lambda path: (302, {"Location": f"/loop{len(path)}"}, "")
+
+	class Fallback (object):
+		def fetch (self, url, headers=None):
+			return "fallback"
+
+	backend = FallbackBackend(HttpBackend(max_redirects=1), Fallback())
+
+	assert backend.fetch(server.url + "/loop") == "fallback"
+
+
+def test_fallback_only_for_refused_pages (server):
+	server.pages["/gone"] = (404, {}, "<html>Not found</html>")
+	server.pages["/limited"] = (429, {}, "<html>Too many requests</html>")
+	server.pages["/forbidden"] = (403, {}, "<html>Checking your browser</html>")
+
+	class Fallback (object):
+		def fetch (self, url, headers=None):
+			return "fallback"
+
+	backend = FallbackBackend(HttpBackend(), Fallback())
+
+	# Pages that don't exist are the site's answer, not something a browser\
+	# would get past
+	assert backend.fetch(server.url + "/gone").status == 404
+	assert backend.fetch(server.url + "/limited") == "fallback"
+	assert backend.fetch(server.url + "/forbidden") == "fallback"
+	# Unless the caller says otherwise
+	backend = FallbackBackend(HttpBackend(), Fallback(), needs_js=lambda page: page.status != 200)
+	assert backend.fetch(server.url + "/gone") == "fallback"
\ No newline at end of file
@@ -0,0 +1,49 @@
+'''
+File to test that journals are replayed correctly after a crash.
+'''
+
+from journal import Journal, replay
+
+
+
+def test_resume_keeps_records (tmp_path):
+	path = str(tmp_path / "run.journal")
+	with Journal(path) as journal:
+		journal.append("profile", profile="a", reads=1)
+	with Journal(path, resume=True) as journal:
+		journal.append("profile", profile="b", reads=2)
+
+	assert [record["profile"] for record in replay(path)] == ["a", "b"]
+
+
+
+def test_resume_drops_partial_last_line (tmp_path):
+	path = tmp_path / "run.journal"
+	path.write_text('{"kind": "profile", "profile": "a"}\n{"kind": "prof')
+	with Journal(str(path), resume=True) as journal:
+		assert [record["profile"] for record in journal.records] == ["a"]
+		journal.append("profile", profile="b")
+
+	assert [record["profile"] for record in replay(str(path))] == ["a", "b"]
+
+
+
+def test_resume_drops_partial_only_line (tmp_path):
+	# A crash during the very first write leaves nothing but half a line
+	path = tmp_path / "run.journal"
+	path.write_text('{"kind": "prof')
+	with Journal(str(path), resume=True) as journal:
+		assert journal.records == []
+		journal.append("profile", profile="a")
+		journal.append("profile", profile="b")
+
+	assert [record["profile"] for record in replay(str(path))] == ["a", "b"]
+
+
+
+def test_resume_without_file (tmp_path):
+	path = str(tmp_path / "missing.journal")
+	with Journal(path, resume=True) as journal:
+		journal.append("members", school="ISEP", profiles=[])
+
+	assert list(replay(path)) == [{"kind": "members", "school": "ISEP", "profiles": []}]
\ No newline at end of file
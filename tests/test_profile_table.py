@@ -0,0 +1,97 @@
+'''
+File to test the table of profiles: saving and loading it, and the
+per-school aggregations.
+'''
+
+import pytest
+
+from profile_table import ProfileTable, ProfileRecord
+from metrics_store import MetricsStore
+
+
+
+def sample_table ():
+	table = ProfileTable()
+	for i, publications in enumerate([5, 0, 120, 33, 7]):
+		table.append(ProfileRecord("scholar", "ISEP" if i % 2 == 0 else "ISCAP", f"isep_{i}",
+			publications=publications, citations=publications * 3))
+	table.append(ProfileRecord("researchgate", "ISEP", "rg_0", reads=40, citations=2))
+
+	return table
+
+
+
+def records (table):
+	return [(record.platform, record.school, record.profile, record.metrics()) for record in table]
+
+
+
+def test_unknown_metric ():
+	with pytest.raises(ValueError):
+		ProfileRecord("scholar", "ISEP", "a", likes=3)
+
+
+
+def test_save_load_binary (tmp_path):
+	table = sample_table()
+	path = str(tmp_path / "profiles.cols")
+	table.save(path)
+	loaded = ProfileTable.load(path)
+
+	assert len(loaded) == len(table)
+	assert records(loaded) == records(table)
+
+
+
+def test_load_rejects_other_files (tmp_path):
+	path = tmp_path / "other.cols"
+	path.write_bytes(b"not a table")
+
+	with pytest.raises(ValueError):
+		ProfileTable.load(str(path))
+
+
+
+def test_save_load_parquet (tmp_path):
+	pytest.importorskip("pyarrow")
+	table = sample_table()
+	path = str(tmp_path / "profiles.parquet")
+	table.save(path)
+
+	assert records(ProfileTable.load(path)) == records(table)
+
+
+
+def test_group_by_school ():
+	summary = sample_table().group_by_school("publications", bins=[0, 10, 100])
+
+	assert set(summary) == {"ISEP", "ISCAP"}
+	isep = summary["ISEP"]
+	assert (isep["count"], isep["total"], isep["min"], isep["max"]) == (3, 132, 5, 120)
+	assert isep["p50"] == 7
+	assert isep["distribution"] == {"0-10": 2, "10-100": 0, "100+": 1}
+	assert summary["ISCAP"]["total"] == 33
+
+
+
+def test_group_by_school_per_platform ():
+	table = sample_table()
+
+	summary = table.group_by_school("citations", platform="researchgate")
+	assert list(summary) == ["ISEP"]
+	assert (summary["ISEP"]["count"], summary["ISEP"]["total"], summary["ISEP"]["p99"]) == (1, 2, 2)
+	assert summary["ISEP"]["distribution"] == {"0-1": 0, "1-10": 1, "10+": 0}
+	assert table.group_by_school("citations", platform="academia") == {}
+	# Profiles without the metric are left out
+	assert "ISCAP" not in table.group_by_school("reads")
+
+
+
+def test_from_store (tmp_path):
+	store = MetricsStore(str(tmp_path / "metrics.sqlite3"))
+	store.save("scholar", "ISEP", "a", {"publications": 3, "citations": 4})
+	store.save("academia", "ISEP", "b", {"views": 10})
+	table = ProfileTable.from_store(store, "scholar")
+	store.close()
+
+	assert records(table) == [("scholar", "ISEP", "a", {"publications": 3, "citations": 4})]
\ No newline at end of file
@@ -0,0 +1,81 @@
+'''
+File to test the detection of blocks and how the limits of a host adapt.
+'''
+
+import pytest
+
+from fetch_backend import Page
+from rate_limiter import (RateLimiter, HostLimiter, ThrottledBackend, BlockedError, detect_block,
+	OK, BLOCKED, DEFAULT_LIMITS)
+
+
+
+def test_detect_block ():
+	assert detect_block("http://example.org/a", 429, "") == "HTTP 429"
+	assert detect_block("https://scholar.google.pt/sorry/index", 200, "").startswith("redirected")
+	assert detect_block("http://example.org/a", 200, '<form id="captcha-form">').startswith("page with")
+	assert detect_block("http://example.org/a", 200, "<html>Profile</html>") is None
+
+
+
+def test_cloudflare_challenges ():
+	challenge = '<html><body><script src="/cdn-cgi/challenge-platform/h/b/orchestrate/chl_page/v1?ray=1"></script>' +\
+		'<script>window._cf_chl_opt = {}</script></body></html>'
+	assert detect_block("http://example.org/a", 503, challenge).startswith("HTTP 503 page with")
+	assert detect_block("http://example.org/a", 403, challenge) is not None
+	assert detect_block("http://example.org/a", 200, '<form id="challenge-form" action="/">') is not None
+
+
+
+def test_pages_with_cloudflare_scripts_arent_blocks ():
+	# Ordinary pages behind Cloudflare load its scripts too
+	page = '<html><head><script src="/cdn-cgi/challenge-platform/scripts/jsd/main.js"></script></head>' +\
+		'<body><div class="profile">Reads 120</div></body></html>'
+
+	assert detect_block("http://example.org/a", 200, page) is None
+	assert detect_block("http://example.org/a", 404, page) is None
+
+
+
+def test_hosts_match_parent_domains ():
+	limiter = RateLimiter()
+
+	assert limiter.host("https://iscap.academia.edu/x").delay == 0.2
+	assert limiter.host("http://example.org/x").delay == DEFAULT_LIMITS[2]
+
+
+
+def test_unlisted_hosts_back_off ():
+	host = RateLimiter().host("http://example.org/x")
+	host.acquire()
+	host.release(BLOCKED, retry_after=0)
+
+	assert host.delay > DEFAULT_LIMITS[2]
+	assert host.concurrency < DEFAULT_LIMITS[0]
+
+
+
+def test_successes_recover_the_pace ():
+	host = HostLimiter(4, 8, 0.001)
+	host.acquire()
+	host.release(BLOCKED, retry_after=0)
+	blocked_delay = host.delay
+	for _ in range(50):
+		host.acquire()
+		host.release(OK)
+
+	assert 0.001 <= host.delay < blocked_delay
+	assert host.concurrency > 2
+
+
+
+def test_throttled_backend_raises_on_blocks ():
+	class CaptchaBackend (object):
+		def fetch (self, url, headers=None):
+			return Page(url, 429, "", {"Retry-After": "0"})
+
+	backend = ThrottledBackend(CaptchaBackend(), RateLimiter(default_limits=(1, 1, 0.0)))
+	with pytest.raises(BlockedError) as error:
+		backend.fetch("http://example.org/a")
+
+	assert error.value.retry_after == 0
\ No newline at end of file
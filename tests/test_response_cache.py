@@ -0,0 +1,126 @@
+'''
+File to test the on-disk page cache and the backend that uses it.
+'''
+
+import time
+
+from fetch_backend import Page
+import response_cache
+from response_cache import ResponseCache, CachedBackend, normalize_url
+
+
+
+class FakeBackend (object):
+	'''
+	A backend that answers with the given pages, counting the requests.
+	'''
+
+	def __init__(self, pages):
+		self.pages = pages
+		self.requests = 0
+
+	def fetch (self, url, headers=None):
+		self.requests += 1
+		return self.pages[url]
+
+
+
+def test_normalize_url ():
+	assert normalize_url("HTTP://Example.org:80/a?b=2&a=1#top") == "http://example.org/a?a=1&b=2"
+
+
+
+def test_pages_are_cached (tmp_path):
+	backend = FakeBackend({"http://example.org/a": Page("http://example.org/a", 200, "<html>A</html>")})
+	cached = CachedBackend(backend, ResponseCache(str(tmp_path)))
+
+	assert cached.fetch("http://example.org/a").html == "<html>A</html>"
+	assert cached.fetch("http://example.org/a").html == "<html>A</html>"
+	assert backend.requests == 1
+
+
+
+def test_errors_and_blocks_arent_cached (tmp_path):
+	backend = FakeBackend({
+		"http://example.org/error": Page("http://example.org/error", 500, "<html>Error</html>"),
+		"http://example.org/captcha": Page("http://example.org/captcha", 200, '<form id="captcha-form"></form>'),
+		"http://example.org/sorry": Page("http://example.org/sorry/index", 200, "<html></html>")
+	})
+	cached = CachedBackend(backend, ResponseCache(str(tmp_path)))
+	for _ in range(2):
+		for url in backend.pages:
+			cached.fetch(url)
+
+	assert backend.requests == 6
+	assert cached.cache.stats()["pages"] == 0
+
+
+
+def test_rejected_pages_arent_cached (tmp_path):
+	backend = FakeBackend({"http://example.org/profile": Page("http://example.org/login", 200, "<html>Log in</html>")})
+	cached = CachedBackend(backend, ResponseCache(str(tmp_path)), reject=lambda page: "/login" in page.url)
+	cached.fetch("http://example.org/profile")
+	cached.fetch("http://example.org/profile")
+
+	assert backend.requests == 2
+
+
+
+def test_ttl_per_site (tmp_path, monkeypatch):
+	cache = ResponseCache(str(tmp_path), ttls={"example.org": 60}, default_ttl=3600)
+	for url in ("http://example.org/a", "http://iscap.example.org/a", "http://other.org/a"):
+		cache.put(url, Page(url, 200, "<html></html>"))
+
+	# Two minutes later, only the pages of the site with the longer TTL are\
+	# still fresh (a subdomain uses the TTL of its parent domain)
+	now = time.time() + 120
+	monkeypatch.setattr(response_cache.time, "time", lambda: now)
+	assert cache.get("http://example.org/a") is None
+	assert cache.get("http://iscap.example.org/a") is None
+	assert cache.get("http://other.org/a") is not None
+	assert cache.stats()["misses"] == 2
+
+
+
+def room_for (tmp_path, entries):
+	'''
+	Room on disk for a given number of the entries of the pages used in the
+	eviction tests (their size varies by a few bytes with the time they were
+	fetched, so half an entry is added to be safe).
+	'''
+
+	cache = ResponseCache(str(tmp_path / "size"))
+	cache.put("http://example.org/0", Page("http://example.org/0", 200, "x" * 1000))
+
+	return int((entries + 0.5) * cache.stats()["bytes"])
+
+
+
+def test_least_recently_used_are_evicted (tmp_path):
+	cache = ResponseCache(str(tmp_path / "cache"), max_bytes=room_for(tmp_path, 2))
+	for name in ("a", "b"):
+		cache.put("http://example.org/" + name, Page("http://example.org/" + name, 200, "x" * 1000))
+		time.sleep(0.01)
+	# Using "a" makes "b" the least recently used page
+	assert cache.get("http://example.org/a") is not None
+	time.sleep(0.01)
+	cache.put("http://example.org/c", Page("http://example.org/c", 200, "x" * 1000))
+
+	assert cache.get("http://example.org/b") is None
+	assert cache.get("http://example.org/a") is not None
+	assert cache.get("http://example.org/c") is not None
+	assert cache.stats()["pages"] == 2
+
+
+
+def test_size_limit_is_shared_by_processes (tmp_path):
+	# Two caches on the same directory (like two workers) keep it under the\
+	# limit together, not each on its own
+	max_bytes = room_for(tmp_path, 4)
+	directory = tmp_path / "cache"
+	caches = [ResponseCache(str(directory), max_bytes=max_bytes) for _ in range(2)]
+	for i in range(8):
+		url = f"http://example.org/{i}"
+		caches[i % 2].put(url, Page(url, 200, "x" * 1000))
+
+	assert sum(path.stat().st_size for path in directory.iterdir()) <= max_bytes
\ No newline at end of file
@@ -0,0 +1,43 @@
+'''
+File to test the NDJSON stream of results: the records written, and the
+totals of each school added up from them.
+'''
+
+from result_stream import ResultSink, read_records, school_totals
+
+
+
+def test_records_are_written (tmp_path):
+	path = str(tmp_path / "results.jsonl")
+	with ResultSink(path) as sink:
+		sink.page("scholar", "ISEP", "https://example.org/results", profiles=2)
+		sink.profile("scholar", "ISEP", "https://example.org/a", {"publications": 3})
+
+	records = list(read_records(path))
+	assert [record["type"] for record in records] == ["page", "profile"]
+	assert records[1]["publications"] == 3
+
+
+
+def test_profiles_rewritten_count_once (tmp_path):
+	path = str(tmp_path / "results.jsonl")
+	with ResultSink(path) as sink:
+		sink.profile("researchgate", "ISEP", "https://example.org/a", {"reads": 10, "citations": 1})
+		sink.profile("researchgate", "ISEP", "https://example.org/b", {"reads": 5, "citations": 2})
+		# Scraped again (after a resume), with newer metrics
+		sink.profile("researchgate", "ISEP", "https://example.org/a", {"reads": 12, "citations": 1})
+		# Other platforms aren't counted
+		sink.profile("scholar", "ISEP", "https://example.org/a", {"citations": 100})
+
+	assert school_totals(path, "researchgate") == {"ISEP": {"reads": 17, "citations": 3}}
+
+
+
+def test_profiles_of_two_schools_count_for_both (tmp_path):
+	path = str(tmp_path / "results.jsonl")
+	with ResultSink(path) as sink:
+		sink.profile("academia", "ISEP", "https://example.org/a", {"views": 4})
+		sink.profile("academia", "ISCAP", "https://example.org/a", {"views": 4})
+		sink.profile("academia", "ISCAP", "https://example.org/b", {"views": 1})
+
+	assert school_totals(path, "academia") == {"ISEP": {"views": 4}, "ISCAP": {"views": 5}}
\ No newline at end of file
@@ -0,0 +1,74 @@
+'''
+File to test the scheduling of a distributed crawl: the longest tasks first,
+and how much of the queue is read to keep it that way.
+'''
+
+from scheduler import Scheduler, MIN_SAMPLES
+from work_queue import SQLiteQueue
+
+
+
+class CountingQueue (SQLiteQueue):
+	'''
+	A queue that counts the tasks waiting read by the scheduler.
+	'''
+
+	def __init__(self, path):
+		super().__init__(path)
+		self.read = 0
+
+	def pending (self, kinds=None, after=0):
+		tasks = super().pending(kinds, after)
+		self.read += len(tasks)
+		return tasks
+
+
+
+def profile (url, cited_by):
+	return ("scholar_profile", {"url": url, "school": "ISEP", "cited_by": cited_by})
+
+
+
+def test_longest_first (tmp_path):
+	queue = SQLiteQueue(str(tmp_path / "queue.sqlite3"))
+	scheduler = Scheduler(queue)
+	queue.put_many(scheduler.prioritized([profile("a", 10), profile("b", 5000), profile("c", 300)]))
+
+	assert [queue.claim("w1").payload["url"] for _ in range(3)] == ["b", "c", "a"]
+	queue.close()
+
+
+
+def test_rebalance_reads_only_new_tasks (tmp_path):
+	queue = CountingQueue(str(tmp_path / "queue.sqlite3"))
+	scheduler = Scheduler(queue)
+	queue.put_many(scheduler.prioritized([profile("a", 10), profile("b", 20)]))
+	scheduler.rebalance()
+	queue.read = 0
+
+	# Nothing changed: nothing to read
+	assert scheduler.rebalance() == 0
+	assert queue.read == 0
+	# New tasks (queued with their own estimates) are the only ones read
+	queue.put_many([profile("c", 30)])
+	assert scheduler.rebalance() == 1
+	assert queue.read == 1
+	queue.close()
+
+
+
+def test_rebalance_reorders_when_estimates_change (tmp_path):
+	queue = CountingQueue(str(tmp_path / "queue.sqlite3"))
+	scheduler = Scheduler(queue)
+	queue.put_many(scheduler.prioritized([profile("a", 2000), ("researchgate_profile", {"url": "b", "school": "ISEP"})]))
+	scheduler.rebalance()
+	queue.read = 0
+
+	# ResearchGate profiles turn out to be much slower than estimated
+	for _ in range(MIN_SAMPLES):
+		scheduler.observe("researchgate_profile", {"url": "x"}, {"reads": 1}, 100.0)
+
+	assert scheduler.rebalance() == 1
+	assert queue.read == 2
+	assert queue.claim("w1").payload["url"] == "b"
+	queue.close()
\ No newline at end of file
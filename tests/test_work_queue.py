@@ -0,0 +1,77 @@
+'''
+File to test the SQLite work queue: claims, leases and attempts.
+'''
+
+import pytest
+
+from work_queue import SQLiteQueue, QueueBackend, PENDING, LEASED, DONE, FAILED
+
+
+
+def test_backend_declares_every_operation ():
+	assert QueueBackend.__abstractmethods__ == {"put", "put_many", "claim", "renew", "complete", "fail", "release",
+		"pending", "prioritize", "requeue_expired", "results", "failures", "counts"}
+	with pytest.raises(TypeError):
+		QueueBackend()
+
+
+
+def test_claim_by_priority (tmp_path):
+	queue = SQLiteQueue(str(tmp_path / "queue.sqlite3"))
+	assert queue.put_many([("page", {"url": "a"}, 1), ("page", {"url": "b"}, 5), ("page", {"url": "a"})]) == 2
+
+	assert queue.claim("w1").payload == {"url": "b"}
+	assert queue.claim("w2").payload == {"url": "a"}
+	assert queue.claim("w3") is None
+	queue.close()
+
+
+
+def test_complete_adds_children (tmp_path):
+	queue = SQLiteQueue(str(tmp_path / "queue.sqlite3"))
+	queue.put("page", {"url": "a"})
+	task = queue.claim("w1")
+
+	assert queue.complete(task, "w1", {"views": 3}, [("profile", {"url": "b"})])
+	assert queue.counts() == {PENDING: 1, LEASED: 0, DONE: 1, FAILED: 0}
+	assert queue.results() == [(1, "page", {"url": "a"}, {"views": 3})]
+	queue.close()
+
+
+
+def test_expired_lease_is_requeued (tmp_path):
+	queue = SQLiteQueue(str(tmp_path / "queue.sqlite3"))
+	queue.put("page", {"url": "a"})
+	task = queue.claim("w1", lease=-1)
+
+	assert queue.requeue_expired() == 1
+	assert not queue.complete(task, "w1", {})
+	assert queue.claim("w2").attempts == 2
+	queue.close()
+
+
+
+def test_expired_leases_use_up_attempts (tmp_path):
+	# A task that kills its worker every time ends up failed
+	queue = SQLiteQueue(str(tmp_path / "queue.sqlite3"), max_attempts=2)
+	queue.put("page", {"url": "a"})
+	queue.claim("w1", lease=-1)
+	queue.claim("w2", lease=-1)
+
+	assert queue.claim("w3") is None
+	assert queue.counts()[FAILED] == 1
+	assert queue.failures() == [("page", {"url": "a"}, "lease expired")]
+	queue.close()
+
+
+
+def test_release_doesnt_count_the_attempt (tmp_path):
+	queue = SQLiteQueue(str(tmp_path / "queue.sqlite3"), max_attempts=1)
+	queue.put("page", {"url": "a"})
+	queue.release(queue.claim("w1"), "w1")
+	task = queue.claim("w2")
+
+	assert task.attempts == 1
+	queue.fail(task, "w2", "boom")
+	assert queue.failures() == [("page", {"url": "a"}, "boom")]
+	queue.close()
\ No newline at end of file
@@ -0,0 +1,209 @@
+'''
+File to time the phases of a run (starting a browser, fetching a page,
+waiting for elements, scrolling, parsing...) and export them as a trace.
+
+The scripts and the shared modules mark their phases with `phase()`:
+
+	with tracing.phase("fetch", url=url):
+		...
+
+When tracing is off (the default), `phase()` just hands back the same empty
+context manager every time, so the marks cost next to nothing. When it's on,
+every phase is recorded with its duration, its fields (like the URL) and the
+context set with `set_context()` (like the school being scraped), and at the
+end of the run the events are written to a JSON file along with a summary:
+count, total, p50 and p95 per phase, and how much of the time was spent
+waiting.
+'''
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+
+# Phases whose names start with this are time spent waiting (for elements,\
+# for content to load...), which the summary adds up separately
+WAIT_PREFIX = "wait"
+
+
+
+class _NoPhase (object):
+	'''
+	The context manager handed out when tracing is off.
+	'''
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, *exc_info):
+		return False
+
+
+
+_NO_PHASE = _NoPhase()
+
+
+
+class Tracer (object):
+	'''
+	Records the phases of a run.
+	'''
+
+	def __init__(self):
+		self.enabled = False
+		self.events = []
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		self._start = time.perf_counter()
+
+
+	def _context (self):
+		if not hasattr(self._local, "context"):
+			self._local.context = {}
+		return self._local.context
+
+
+	@contextmanager
+	def _phase (self, name, fields):
+		start = time.perf_counter()
+		error = None
+		try:
+			yield
+		except BaseException as exc:
+			error = type(exc).__name__
+			raise
+		finally:
+			duration = time.perf_counter() - start
+			event = dict(self._context(), **fields)
+			event.update(phase=name, start=start - self._start, duration=duration)
+			if error is not None:
+				event["error"] = error
+			with self._lock:
+				self.events.append(event)
+
+
+	def phase (self, name, **fields):
+		'''
+		Time a phase (to be used in a `with` statement).
+
+		Parameters
+		----------
+		name : str
+			The name of the phase, like "fetch" or "wait_scroll".
+		**fields
+			Anything else worth keeping with the phase, like its URL.
+		'''
+
+		if not self.enabled:
+			return _NO_PHASE
+
+		return self._phase(name, fields)
+
+
+	def set_context (self, **fields):
+		'''
+		Add fields (like the school being scraped) to every phase recorded
+		from now on by the current thread. A field set to `None` is removed.
+		'''
+
+		if not self.enabled:
+			return
+
+		context = self._context()
+		for key, value in fields.items():
+			if value is None:
+				context.pop(key, None)
+			else:
+				context[key] = value
+
+
+	def summary (self):
+		'''
+		Summarize the recorded phases.
+
+		Returns
+		-------
+		dict
+			Dictionary of the type `phase: statistics` (count, total, mean,
+			p50, p95 and max, in seconds), plus the "wait_total" spent in
+			the waiting phases.
+		'''
+
+		with self._lock:
+			durations = {}
+			for event in self.events:
+				durations.setdefault(event["phase"], []).append(event["duration"])
+
+		summary = {}
+		for name, values in sorted(durations.items()):
+			values.sort()
+			summary[name] = {
+				"count": len(values),
+				"total": sum(values),
+				"mean": sum(values) / len(values),
+				"p50": percentile(values, 50),
+				"p95": percentile(values, 95),
+				"max": values[-1]
+			}
+		summary["wait_total"] = sum(stats["total"] for name, stats in summary.items() if name.startswith(WAIT_PREFIX))
+
+		return summary
+
+
+	def export (self, path):
+		'''
+		Write the recorded phases and their summary to a JSON file.
+		'''
+
+		with self._lock:
+			events = list(self.events)
+		with open(path, "w") as f:
+			json.dump({"events": events, "summary": self.summary()}, f)
+
+
+	def print_summary (self):
+		'''
+		Print the summary as a table.
+		'''
+
+		summary = self.summary()
+		wait_total = summary.pop("wait_total")
+		print(f"{'phase':<20} {'count':>7} {'total':>10} {'p50':>9} {'p95':>9} {'max':>9}")
+		for name, stats in summary.items():
+			print(f"{name:<20} {stats['count']:>7} {stats['total']:>10.2f} {stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['max']:>9.3f}")
+		print(f"Time spent waiting: {wait_total:.2f} s")
+
+
+
+def percentile (values, p):
+	'''
+	A percentile (0 to 100) of sorted values, interpolating between the
+	closest ranks (`None` if there are no values). Shared by the summaries of
+	the traces, of the benchmarks and of the profile tables.
+	'''
+
+	if not values:
+		return None
+	position = (len(values) - 1) * p / 100
+	below = int(position)
+	above = min(below + 1, len(values) - 1)
+
+	return values[below] + (values[above] - values[below]) * (position - below)
+
+
+
+# The tracer shared by every module
+tracer = Tracer()
+
+phase = tracer.phase
+set_context = tracer.set_context
+
+
+
+def enable ():
+	'''
+	Start recording phases.
+	'''
+
+	tracer.enabled = True
@@ -0,0 +1,504 @@
+'''
+File with a shared queue of work (pages to scrape) that several worker
+processes, on the same machine or on others, can take tasks from.
+
+A worker claims a task with a lease: the task is its own until the lease
+expires. If the worker finishes, it reports the result (and any new tasks it
+found, like the profiles listed in a page); if it dies or hangs, the lease
+expires and the task goes back to the queue for someone else. Tasks that fail
+too many times are set aside as failed instead of being retried forever.
+
+The queue is used through the methods of `QueueBackend`, so other storages
+can be plugged in. `SQLiteQueue` keeps everything in a SQLite file, which is
+enough to run every process on one machine (or on several ones sharing the
+file over a network file system that supports locking).
+'''
+
+import abc
+import json
+import sqlite3
+import time
+
+
+# States of a task
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+
+class Task (object):
+	'''
+	A task claimed from a queue.
+
+	Parameters
+	----------
+	id : int
+		The id of the task in the queue.
+	kind : str
+		The type of task, like "scholar_profile".
+	payload : dict
+		What the worker needs to do the task (like the URL and the school).
+	attempts : int
+		How many times the task has been claimed (including this one).
+	'''
+
+	__slots__ = ("id", "kind", "payload", "attempts")
+
+	def __init__(self, id, kind, payload, attempts):
+		self.id = id
+		self.kind = kind
+		self.payload = payload
+		self.attempts = attempts
+
+
+	def __repr__ (self):
+		return f"Task({self.id}, {self.kind!r}, {self.payload!r})"
+
+
+
+class QueueBackend (abc.ABC):
+	'''
+	The operations a queue has to offer. Every backend must implement them
+	(they're abstract, so a backend missing one can't be created).
+	'''
+
+	@abc.abstractmethod
+	def put (self, kind, payload, key=None, priority=0):
+		'''
+		Add a task, unless there's already one with the same key.
+
+		Parameters
+		----------
+		kind : str
+			The type of task.
+		payload : dict
+			The task's data (must be serializable to JSON).
+		key : str, optional
+			A key that identifies the task (like its URL), so that the same
+			work is never queued twice. Defaults to the payload's "url".
+		priority : float
+			Tasks with a higher priority are claimed first.
+
+		Returns
+		-------
+		bool
+			Whether the task was added.
+		'''
+
+
+	@abc.abstractmethod
+	def put_many (self, tasks):
+		'''
+		Add several tasks at once.
+
+		Parameters
+		----------
+		tasks : iterable
+			`(kind, payload)` or `(kind, payload, priority)` tuples.
+
+		Returns
+		-------
+		int
+			The number of tasks added.
+		'''
+
+
+	@abc.abstractmethod
+	def claim (self, worker, lease=300, kinds=None):
+		'''
+		Claim the next pending task.
+
+		Parameters
+		----------
+		worker : str
+			Name of the worker claiming the task.
+		lease : float
+			Seconds the task stays claimed without a `renew`.
+		kinds : iterable, optional
+			Only claim tasks of these types.
+
+		Returns
+		-------
+		Task
+			The task, or `None` if there's nothing to do right now.
+		'''
+
+
+	@abc.abstractmethod
+	def renew (self, task, worker, lease=300):
+		'''
+		Extend the lease of a task that is taking long.
+
+		Returns
+		-------
+		bool
+			`False` if the task isn't leased to the worker anymore.
+		'''
+
+
+	@abc.abstractmethod
+	def complete (self, task, worker, result, children=()):
+		'''
+		Report the result of a task, along with the new tasks found while
+		doing it (all at once, so that none is lost if the worker dies).
+
+		Parameters
+		----------
+		task : Task
+			The task.
+		worker : str
+			The worker that did the task.
+		result : dict
+			The result (must be serializable to JSON).
+		children : iterable
+			`(kind, payload)` tuples of the new tasks.
+
+		Returns
+		-------
+		bool
+			`False` if the task's lease had expired and someone else claimed
+			it (the result is dropped).
+		'''
+
+
+	@abc.abstractmethod
+	def fail (self, task, worker, error, retry=True):
+		'''
+		Report that a task failed. It goes back to the queue if `retry` and
+		it hasn't used up its attempts, or is set aside as failed otherwise.
+		'''
+
+
+	@abc.abstractmethod
+	def release (self, task, worker):
+		'''
+		Give a task back to the queue without counting the attempt (for
+		example, when the site blocked us and the task could be done later,
+		or by another worker).
+		'''
+
+
+	@abc.abstractmethod
+	def pending (self, kinds=None, after=0):
+		'''
+		Get the tasks waiting to be claimed.
+
+		Parameters
+		----------
+		kinds : iterable, optional
+			Only the tasks of these types.
+		after : int
+			Only the tasks added after the one with this ID (to get just the
+			new tasks, pass the highest ID seen).
+
+		Returns
+		-------
+		list
+			`(task, priority)` tuples.
+		'''
+
+
+	@abc.abstractmethod
+	def prioritize (self, priorities):
+		'''
+		Change the priority of tasks that haven't been claimed yet.
+
+		Parameters
+		----------
+		priorities : dict
+			Dictionary of the type `task_id: priority`.
+		'''
+
+
+	@abc.abstractmethod
+	def requeue_expired (self):
+		'''
+		Put the tasks whose lease expired back in the queue. The expired
+		lease counts as an attempt, so a task that keeps killing (or hanging)
+		its worker is set aside as failed once it used up its attempts.
+
+		Returns
+		-------
+		int
+			The number of tasks put back.
+		'''
+
+
+	@abc.abstractmethod
+	def results (self, kinds=None, after=0):
+		'''
+		Get the results of the tasks done.
+
+		Parameters
+		----------
+		kinds : iterable, optional
+			Only the results of these types of tasks.
+		after : int
+			Only the results reported after the one with this number (to
+			get just the new results, pass the number of the last one seen).
+
+		Returns
+		-------
+		list
+			`(number, kind, payload, result)` tuples, in the order they were
+			reported.
+		'''
+
+
+	@abc.abstractmethod
+	def failures (self):
+		'''
+		The tasks set aside as failed.
+
+		Returns
+		-------
+		list
+			`(kind, payload, error)` tuples.
+		'''
+
+
+	@abc.abstractmethod
+	def counts (self, kinds=None):
+		'''
+		The number of tasks in each state.
+
+		Parameters
+		----------
+		kinds : iterable, optional
+			Only count the tasks of these types.
+
+		Returns
+		-------
+		dict
+			Dictionary of the type `state: number_of_tasks`.
+		'''
+
+
+	def close (self):
+		pass
+
+
+
+class SQLiteQueue (QueueBackend):
+	'''
+	A queue kept in a SQLite database.
+
+	Parameters
+	----------
+	path : str
+		Path of the database file (created if needed).
+	max_attempts : int
+		Times a task is tried before it's set aside as failed.
+	'''
+
+	def __init__(self, path="work_queue.sqlite3", max_attempts=3):
+		self.path = path
+		self.max_attempts = max_attempts
+		# `timeout` so that several processes can share the same file, and\
+		# no implicit transactions: claiming needs an explicit `BEGIN\
+		# IMMEDIATE` so that two workers never claim the same task
+		self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute(f'''
+			CREATE TABLE IF NOT EXISTS tasks (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				kind TEXT NOT NULL,
+				key TEXT NOT NULL UNIQUE,
+				payload TEXT NOT NULL,
+				priority REAL NOT NULL DEFAULT 0,
+				state TEXT NOT NULL DEFAULT '{PENDING}',
+				worker TEXT,
+				lease_until REAL,
+				attempts INTEGER NOT NULL DEFAULT 0,
+				result TEXT,
+				result_number INTEGER UNIQUE,
+				error TEXT
+			)
+		''')
+		self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_pending ON tasks (state, priority DESC, id)")
+
+
+	def _put (self, kind, payload, key, priority):
+		cursor = self.conn.execute(
+			"INSERT OR IGNORE INTO tasks (kind, key, payload, priority) VALUES (?, ?, ?, ?)",
+			(kind, kind + "\n" + (key if key is not None else payload["url"]), json.dumps(payload), priority))
+
+		return cursor.rowcount == 1
+
+
+	def put (self, kind, payload, key=None, priority=0):
+		return self._put(kind, payload, key, priority)
+
+
+	def put_many (self, tasks):
+		added = 0
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			for task in tasks:
+				kind, payload = task[0], task[1]
+				added += self._put(kind, payload, None, task[2] if len(task) > 2 else 0)
+			self.conn.execute("COMMIT")
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+
+		return added
+
+
+	def _requeue_expired (self, now):
+		# The attempt was counted when the task was claimed, so the tasks\
+		# that already used up their attempts aren't tried again
+		self.conn.execute(
+			f"""UPDATE tasks SET state = '{FAILED}', error = 'lease expired', worker = NULL, lease_until = NULL
+			WHERE state = '{LEASED}' AND lease_until < ? AND attempts >= ?""",
+			(now, self.max_attempts))
+		cursor = self.conn.execute(
+			f"UPDATE tasks SET state = '{PENDING}', worker = NULL, lease_until = NULL WHERE state = '{LEASED}' AND lease_until < ?",
+			(now,))
+
+		return cursor.rowcount
+
+
+	def claim (self, worker, lease=300, kinds=None):
+		now = time.time()
+		kinds = list(kinds) if kinds else None
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			self._requeue_expired(now)
+			query = f"SELECT id, kind, payload, attempts FROM tasks WHERE state = '{PENDING}'"
+			params = []
+			if kinds:
+				query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+				params += kinds
+			row = self.conn.execute(query + " ORDER BY priority DESC, id LIMIT 1", params).fetchone()
+			if row is not None:
+				self.conn.execute(
+					f"UPDATE tasks SET state = '{LEASED}', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+					(worker, now + lease, row[0]))
+			self.conn.execute("COMMIT")
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+
+		if row is None:
+			return None
+
+		return Task(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+
+	def renew (self, task, worker, lease=300):
+		cursor = self.conn.execute(
+			f"UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = '{LEASED}'",
+			(time.time() + lease, task.id, worker))
+
+		return cursor.rowcount == 1
+
+
+	def complete (self, task, worker, result, children=()):
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			# Results are numbered in the order they are reported (not in\
+			# the order of the tasks), so that readers never miss one that\
+			# was reported late
+			cursor = self.conn.execute(
+				f"""UPDATE tasks SET state = '{DONE}', result = ?, lease_until = NULL,
+				result_number = (SELECT COALESCE(MAX(result_number), 0) + 1 FROM tasks)
+				WHERE id = ? AND worker = ? AND state = '{LEASED}'""",
+				(json.dumps(result), task.id, worker))
+			done = cursor.rowcount == 1
+			# Only a worker that still holds the task can add what it found
+			if done:
+				for child in children:
+					kind, payload = child[0], child[1]
+					self._put(kind, payload, None, child[2] if len(child) > 2 else 0)
+			self.conn.execute("COMMIT")
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+
+		return done
+
+
+	def fail (self, task, worker, error, retry=True):
+		state = PENDING if retry and task.attempts < self.max_attempts else FAILED
+		self.conn.execute(
+			f"UPDATE tasks SET state = ?, error = ?, worker = NULL, lease_until = NULL WHERE id = ? AND worker = ? AND state = '{LEASED}'",
+			(state, str(error), task.id, worker))
+
+
+	def requeue_expired (self):
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			requeued = self._requeue_expired(time.time())
+			self.conn.execute("COMMIT")
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+
+		return requeued
+
+
+	def release (self, task, worker):
+		self.conn.execute(
+			f"UPDATE tasks SET state = '{PENDING}', worker = NULL, lease_until = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ? AND state = '{LEASED}'",
+			(task.id, worker))
+
+
+	def pending (self, kinds=None, after=0):
+		query = f"SELECT id, kind, payload, attempts, priority FROM tasks WHERE state = '{PENDING}' AND id > ?"
+		params = [after]
+		if kinds:
+			kinds = list(kinds)
+			query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+			params += kinds
+
+		return [(Task(id, kind, json.loads(payload), attempts), priority)
+			for id, kind, payload, attempts, priority in self.conn.execute(query, params)]
+
+
+	def prioritize (self, priorities):
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			self.conn.executemany(
+				f"UPDATE tasks SET priority = ? WHERE id = ? AND state = '{PENDING}'",
+				[(priority, task_id) for task_id, priority in priorities.items()])
+			self.conn.execute("COMMIT")
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+
+
+	def results (self, kinds=None, after=0):
+		query = f"SELECT result_number, kind, payload, result FROM tasks WHERE state = '{DONE}' AND result_number > ?"
+		params = [after]
+		if kinds:
+			kinds = list(kinds)
+			query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+			params += kinds
+
+		return [(number, kind, json.loads(payload), json.loads(result))
+			for number, kind, payload, result in self.conn.execute(query + " ORDER BY result_number", params)]
+
+
+	def failures (self):
+		return [(kind, json.loads(payload), error)
+			for kind, payload, error in self.conn.execute(f"SELECT kind, payload, error FROM tasks WHERE state = '{FAILED}'")]
+
+
+	def counts (self, kinds=None):
+		query = "SELECT state, COUNT(*) FROM tasks"
+		params = []
+		if kinds:
+			kinds = list(kinds)
+			query += f" WHERE kind IN ({', '.join('?' * len(kinds))})"
+			params += kinds
+		counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+		counts.update(self.conn.execute(query + " GROUP BY state", params).fetchall())
+
+		return counts
+
+
+	def close (self):
+		self.conn.close()